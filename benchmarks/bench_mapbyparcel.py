@@ -0,0 +1,425 @@
+#------------------------------------
+#
+# synthetic-scale benchmark of the mapbyparcel.py mapping pipeline
+#
+#	for each size, generates a fake ICDB (a SQLite file with the ICDB's tables), county parcel data and
+#	saved selections workbooks of that many reports and resources, then maps them with each parcel backend
+#	and mode, each case in a python process of its own, and reports the throughput, peak memory and the
+#	time of each phase (from mapbyparcel's run timer)
+#
+#	backends:
+#		layers	the parcel layers of a map, through a local stand-in for arcpy (in-memory layers, output rows
+#				counted but not kept), so it runs without ArcGIS; it measures the tool's own work, not arcpy's
+#		gpkg	a GeoPackage parcel source and GeoPackage output (parcel_source, output_format = "gpkg"), no arcpy at all
+#	modes:
+#		serial		the default options
+#		prefetch	ICDB batches loaded ahead on 2 worker threads (icdb_workers)
+#		dry_run		counting only, no geometry read or output written
+#		dissolve	one multipart feature per record (layers only, it needs geometries that union)
+#
+#	python benchmarks/bench_mapbyparcel.py [--rows 1000 10000 100000] [--backends layers gpkg]
+#		[--modes serial prefetch dry_run dissolve] [--kinds reports resources] [--workdir <folder>] [--json results.json]
+#
+#	the generated data is kept in the work folder (default: a temporary folder) and reused by the next run
+#	with the same sizes and seed
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import types
+try:
+	import resource							# (not on Windows)
+except ImportError:
+	resource = None
+try:
+	import tracemalloc						# (python 3)
+except ImportError:
+	tracemalloc = None
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+#--------------------
+# synthetic data
+#
+#	the counties the records are spread over, and the format of their APN's (fitting mapbyparcel.apn_patterns)
+#	the weights below are (value, weight) tables: the fan-out of APN's per record and of parcels per APN,
+#	and how many counties a report lists
+
+bench_counties = {
+	49	: ("{0:03d}-{1:03d}-{2:03d}", 999),		# Sonoma
+	21	: ("{0:03d}-{1:03d}-{2:02d}", 99),		# Marin
+	28	: ("{0:03d}-{1:03d}-{2:02d}", 99),		# Napa
+	48	: ("{0:03d}-{1:03d}-{2:03d}", 999),		# Solano
+	57	: ("{0:03d}-{1:03d}-{2:02d}", 99)		# Yolo
+}
+apns_per_record = ((0, 15), (1, 50), (2, 18), (3, 8), (5, 5), (12, 3), (40, 1))
+parcels_per_apn = ((1, 90), (2, 8), (4, 2))
+counties_per_report = ((0, 5), (1, 80), (2, 12), (3, 3))
+apn_hit_rate = 0.85					# share of the ICDB's APN's that are in the county's parcels
+malformed_rate = 0.03				# share of the ICDB's APN's that don't fit the county's pattern
+spaced_rate = 0.05					# share of the ICDB's APN's with spaces for dashes (put right by canonical_apn)
+voided_rate = 0.03
+layer_factor = 2					# parcels in a county's layer for each of its parcels the ICDB refers to
+
+def weighted(rng, table):
+	pick = rng.uniform(0, sum(weight for (value, weight) in table))
+	for (value, weight) in table:
+		pick -= weight
+		if pick <= 0:
+			return value
+	return table[-1][0]
+
+def random_apn(rng, county):
+	(apn_format, last_max) = bench_counties[county]
+	return apn_format.format(rng.randint(0, 999), rng.randint(0, 999), rng.randint(0, last_max))
+
+# an APN as the ICDB has it: usually as the parcel layer has it, now and then spaced out or malformed
+def icdb_apn(rng, apn):
+	if rng.random() < malformed_rate:
+		return apn[:-1]
+	if rng.random() < spaced_rate:
+		return apn.replace("-", " ")
+	return apn
+
+# a small square polygon (as WKB) for a parcel, laid out on a grid by OID
+def parcel_wkb(oid):
+	(x, y) = (6000000.0 + (oid % 1000) * 100.0, 1900000.0 + (oid // 1000) * 100.0)
+	points = ((x, y), (x + 90.0, y), (x + 90.0, y + 90.0), (x, y + 90.0), (x, y))
+	return struct.pack("<BIII", 1, 3, 1, len(points)) + b"".join(struct.pack("<dd", px, py) for (px, py) in points)
+
+# a GeoPackage geometry blob of a WKB (see mapbyparcel.gpkg_blob)
+def gpkg_blob(wkb, srs_id):
+	return b"GP\x00\x01" + struct.pack("<i", srs_id) + wkb
+
+bench_srs_id = 2226					# NAD83 / California zone 2 (ftUS)
+
+def generate(size_dir, rows, seed):
+	import mapbyparcel
+	rng = random.Random(seed)
+	county_list = sorted(bench_counties)
+	parcel_apns = dict((county, set()) for county in county_list)
+
+	def record_apns(counties):
+		apns = []
+		for i in range(weighted(rng, apns_per_record)):
+			county = rng.choice(counties)
+			apn = random_apn(rng, county)
+			if rng.random() < apn_hit_rate:
+				parcel_apns[county].add(apn)
+			apns.append(icdb_apn(rng, apn))
+		return apns
+
+	db = sqlite3.connect(os.path.join(size_dir, "icdb.sqlite"))
+	db.executescript("""
+		CREATE TABLE tblInventory (DocNo INTEGER PRIMARY KEY, CitTitle TEXT, Voided INTEGER);
+		CREATE TABLE tblInventoryAddr (DocNo INTEGER, APN TEXT);
+		CREATE TABLE tblInventoryCnty (DocNo INTEGER, CountyName TEXT);
+		CREATE TABLE tblResource (PrimCo INTEGER, PrimNo INTEGER, ResourceName TEXT, TrinNo INTEGER, TrinH TEXT, Voided INTEGER, PRIMARY KEY (PrimCo, PrimNo));
+		CREATE TABLE tblResourceAddr (PrimCo INTEGER, PrimNo INTEGER, APN TEXT);
+		CREATE INDEX tblInventoryAddr_DocNo ON tblInventoryAddr (DocNo);
+		CREATE INDEX tblInventoryCnty_DocNo ON tblInventoryCnty (DocNo);
+		CREATE INDEX tblResourceAddr_PrimNo ON tblResourceAddr (PrimCo, PrimNo);
+	""")
+	(inventory, inventory_addr, inventory_cnty) = ([], [], [])
+	for doc_no in range(1, rows + 1):
+		counties = rng.sample(county_list, weighted(rng, counties_per_report))
+		inventory.append((doc_no, "synthetic report {0}".format(doc_no), int(rng.random() < voided_rate)))
+		inventory_cnty.extend((doc_no, mapbyparcel.county_numbers[county]) for county in counties)
+		inventory_addr.extend((doc_no, apn) for apn in record_apns(counties or county_list))
+	(resources, resource_addr, resource_keys) = ([], [], [])
+	for i in range(rows):
+		p_co = rng.choice(county_list)
+		p_no = i + 1
+		resource_keys.append((p_co, p_no))
+		resources.append((p_co, p_no, "synthetic resource {0}".format(p_no), rng.choice((0, 0, 0, p_no)), rng.choice((None, None, "H")), int(rng.random() < voided_rate)))
+		resource_addr.extend((p_co, p_no, apn) for apn in record_apns([p_co]))
+	db.executemany("INSERT INTO tblInventory VALUES (?,?,?)", inventory)
+	db.executemany("INSERT INTO tblInventoryAddr VALUES (?,?)", inventory_addr)
+	db.executemany("INSERT INTO tblInventoryCnty VALUES (?,?)", inventory_cnty)
+	db.executemany("INSERT INTO tblResource VALUES (?,?,?,?,?,?)", resources)
+	db.executemany("INSERT INTO tblResourceAddr VALUES (?,?,?)", resource_addr)
+	db.commit()
+	db.close()
+
+	#----
+	# the parcels: those the ICDB refers to (some APN's with more than one parcel), and as many again others
+	layers_db = sqlite3.connect(os.path.join(size_dir, "layers.sqlite"))
+	layers_db.execute("CREATE TABLE parcels (layer TEXT, oid INTEGER, apn TEXT, wkb BLOB)")
+	gpkg = sqlite3.connect(os.path.join(size_dir, "parcels.gpkg"))
+	gpkg.executescript("""
+		PRAGMA application_id = 1196444487;
+		CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+		CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME, min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER);
+		CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name));
+	""")
+	gpkg.execute("INSERT INTO gpkg_spatial_ref_sys VALUES ('NAD83 / California zone 2 (ftUS)', ?, 'EPSG', ?, 'undefined', NULL)", (bench_srs_id, bench_srs_id))
+	parcel_count = 0
+	for county in county_list:
+		layer = mapbyparcel.parcel_layers[county]
+		table = layer.split("\\")[-1]
+		apns = sorted(parcel_apns[county])
+		apns.extend(random_apn(rng, county) for i in range(len(apns) * (layer_factor - 1)))
+		parcels = []
+		for apn in apns:
+			for i in range(weighted(rng, parcels_per_apn)):
+				parcels.append((len(parcels) + 1, apn, parcel_wkb(len(parcels) + 1)))
+		parcel_count += len(parcels)
+		layers_db.executemany("INSERT INTO parcels VALUES (?,?,?,?)", [(layer, oid, apn, sqlite3.Binary(wkb)) for (oid, apn, wkb) in parcels])
+		gpkg.execute("CREATE TABLE \"{0}\" (OBJECTID INTEGER PRIMARY KEY, Shape BLOB, APN TEXT)".format(table))
+		gpkg.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, 'features', ?, ?)", (table, table, bench_srs_id))
+		gpkg.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'Shape', 'POLYGON', ?, 0, 0)", (table, bench_srs_id))
+		gpkg.executemany("INSERT INTO \"{0}\" VALUES (?,?,?)".format(table), [(oid, sqlite3.Binary(gpkg_blob(wkb, bench_srs_id)), apn) for (oid, apn, wkb) in parcels])
+	layers_db.commit()
+	layers_db.close()
+	gpkg.commit()
+	gpkg.close()
+
+	#----
+	# the saved selections: workbooks like the ICDB saves (or, without openpyxl, their CSV exports)
+	write_saved_selection(size_dir, "reports", mapbyparcel.sheet_saved_reports, ("DocCo", "DocNo"), [(None, doc_no) for doc_no in range(1, rows + 1)])
+	write_saved_selection(size_dir, "resources", mapbyparcel.sheet_saved_resources, ("PrimCo", "PrimNo"), resource_keys)
+	return {'records': rows, 'report_apns': len(inventory_addr), 'resource_apns': len(resource_addr), 'parcels': parcel_count}
+
+def write_saved_selection(size_dir, name, sheet, header, keys):
+	try:
+		import openpyxl
+	except ImportError:
+		openpyxl = None
+	if openpyxl is None:
+		import csv
+		with open(os.path.join(size_dir, name + ".csv"), "w") as csv_file:
+			writer = csv.writer(csv_file)
+			writer.writerow(header)
+			writer.writerows(("" if value is None else value for value in key) for key in keys)
+		return
+	workbook = openpyxl.Workbook(write_only=True)
+	worksheet = workbook.create_sheet(sheet)
+	worksheet.append(header)
+	for key in keys:
+		worksheet.append(key)
+	workbook.save(os.path.join(size_dir, name + ".xlsx"))
+
+def saved_selection_file(size_dir, kind):
+	for ext in (".xlsx", ".csv"):
+		if os.path.exists(os.path.join(size_dir, kind + ext)):
+			return os.path.join(size_dir, kind + ext)
+	return None
+
+#--------------------
+# arcpy stand-in
+#
+#	just what mapbyparcel calls on the way through map_reports()/map_resources() with the layers backend:
+#	the parcel layers are held in memory (a SearchCursor's "APN IN (...)" is a dictionary lookup, as an
+#	attribute index would be), and the output's rows are counted, not kept
+
+class StandInShape(object):
+	def __init__(self, wkb):
+		self.WKB = wkb
+
+	def union(self, other):
+		return StandInShape(self.WKB)
+
+class StandInResult(object):
+	status = 4
+
+	def __init__(self, output):
+		self.output = output
+
+	def getOutput(self, index):
+		return self.output
+
+	def getMessages(self):
+		return ""
+
+class StandInInsertCursor(object):
+	rows = 0
+
+	def __init__(self, table, fields):
+		pass
+
+	def insertRow(self, row):
+		StandInInsertCursor.rows += 1
+
+def arcpy_stand_in(layers_path):
+	layers = {}								# layer -> { apn : [(oid, shape),...] }
+	db = sqlite3.connect(layers_path)
+	for (layer, oid, apn, wkb) in db.execute("SELECT layer, oid, apn, wkb FROM parcels ORDER BY layer, oid"):
+		layers.setdefault(layer, {}).setdefault(apn, []).append((oid, StandInShape(bytes(wkb))))
+	db.close()
+	created = set()
+	quoted = re.compile(r"'((?:[^']|'')*)'")
+
+	def search_cursor(layer, fields, where_clause=None):
+		parcels = layers.get(layer, {})
+		if where_clause is None:
+			apns = sorted(parcels)
+		else:
+			apns = [value.replace("''", "'") for value in quoted.findall(where_clause)]
+		rows = []
+		for apn in apns:
+			for (oid, shape) in parcels.get(apn, ()):
+				row = {"APN": apn, "OID@": oid, "SHAPE@": shape}
+				rows.append(tuple(row[field] for field in fields))
+		return rows
+
+	def create_file_gdb(folder, name):
+		path = os.path.join(folder, name)
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		return StandInResult(path)
+
+	def create_feature_class(folder, name, *args):
+		created.add(os.path.join(folder, name))
+		return StandInResult(os.path.join(folder, name))
+
+	arcpy = types.ModuleType("arcpy")
+	arcpy.AddMessage = arcpy.AddWarning = arcpy.AddError = lambda message: None
+	arcpy.GetParameterAsText = lambda index: ""
+	arcpy.SetParameterAsText = lambda index, text: None
+	arcpy.Exists = lambda path: path in created or path in layers or os.path.exists(path)
+	arcpy.CreateFileGDB_management = create_file_gdb
+	arcpy.CreateFeatureclass_management = create_feature_class
+	arcpy.SelectLayerByAttribute_management = lambda layer, selection_type: None
+	arcpy.ListFields = lambda table, wild_card=None: []
+	arcpy.FromWKB = lambda wkb, spatial_ref=None: StandInShape(bytes(wkb))
+	arcpy.da = types.ModuleType("arcpy.da")
+	arcpy.da.SearchCursor = search_cursor
+	arcpy.da.InsertCursor = StandInInsertCursor
+	return arcpy
+
+#--------------------
+# a case: one saved selection, mapped with one backend and mode, in a process of its own
+
+bench_modes = {
+	"serial"	: {},
+	"prefetch"	: {"icdb_workers": 2},
+	"dry_run"	: {"dry_run": True},
+	"dissolve"	: {"dissolve_records": True}
+}
+
+def run_case(case):
+	if case['backend'] == "layers":
+		sys.modules["arcpy"] = arcpy_stand_in(os.path.join(case['size_dir'], "layers.sqlite"))
+	else:
+		sys.modules["arcpy"] = None			# a GeoPackage run must not need arcpy
+	import mapbyparcel
+	mapbyparcel.icdb_connect_factory = lambda: sqlite3.connect(os.path.join(case['size_dir'], "icdb.sqlite"), check_same_thread=False)
+	mapbyparcel.icdb_placeholder = "?"
+	mapbyparcel.run_options.update({
+		"icdb_cache_hours"	: 0,
+		"journal_runs"		: False,
+		"run_report"		: False,			# the phases are read from the run timer below instead
+		"log_file"			: False,
+		"progress_seconds"	: 0
+	})
+	if case['backend'] == "gpkg":
+		mapbyparcel.run_options.update({"parcel_source": os.path.join(case['size_dir'], "parcels.gpkg"), "output_format": "gpkg"})
+	mapbyparcel.run_options.update(bench_modes[case['mode']])
+	saved_selection = os.path.join(case['case_dir'], os.path.basename(case['saved_selection']))
+	shutil.copy(case['saved_selection'], saved_selection)
+
+	if tracemalloc is not None:
+		tracemalloc.start()
+	start = time.time()
+	run_timer = mapbyparcel.reset_run_timer()
+	with run_timer.phase("read saved selection"):
+		(kind, keys) = mapbyparcel.read_saved_selection(saved_selection)
+	if kind == mapbyparcel.sheet_saved_reports:
+		counts = mapbyparcel.map_reports(saved_selection, keys)
+	else:
+		counts = mapbyparcel.map_resources(saved_selection, keys)
+	seconds = time.time() - start
+	result = {
+		'seconds'	: round(seconds, 3),
+		'records'	: counts['input'],
+		'per_second': round(counts['input'] / max(seconds, 0.001), 1),
+		'counts'	: counts,
+		'phases'	: mapbyparcel.run_timer.report()['phases']
+	}
+	if tracemalloc is not None:
+		result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1048576.0, 1)
+	if resource is not None:
+		maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		result['peak_rss_mb'] = round(maxrss / (1048576.0 if sys.platform == "darwin" else 1024.0), 1)
+	with open(case['result'], "w") as result_file:
+		json.dump(result, result_file)
+
+#--------------------
+# the benchmark
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="benchmark mapbyparcel.py on synthetic saved selections, ICDB and parcels")
+	parser.add_argument("--rows", nargs="+", type=int, default=[1000, 10000], help="records in each saved selection (default: 1000 10000)")
+	parser.add_argument("--backends", nargs="+", choices=("layers", "gpkg"), default=["layers", "gpkg"])
+	parser.add_argument("--modes", nargs="+", choices=sorted(bench_modes), default=["serial", "prefetch", "dry_run", "dissolve"])
+	parser.add_argument("--kinds", nargs="+", choices=("reports", "resources"), default=["reports", "resources"])
+	parser.add_argument("--workdir", help="folder for the synthetic data and outputs (default: a temporary folder)")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--json", help="also write the results to this file")
+	parser.add_argument("--run-case", help=argparse.SUPPRESS)
+	args = parser.parse_args(argv)
+	if args.run_case:
+		with open(args.run_case) as case_file:
+			run_case(json.load(case_file))
+		return 0
+
+	workdir = args.workdir or tempfile.mkdtemp(prefix="bench_mapbyparcel_")
+	results = []
+	print("{0:>7} {1:<9} {2:<6} {3:<8} {4:>8} {5:>10} {6:>8}  {7}".format("rows", "kind", "source", "mode", "seconds", "records/s", "peak MB", "slowest phases"))
+	for rows in args.rows:
+		size_dir = os.path.join(workdir, "rows_{0}_seed_{1}".format(rows, args.seed))
+		if not os.path.exists(os.path.join(size_dir, "parcels.gpkg")):
+			if not os.path.isdir(size_dir):
+				os.makedirs(size_dir)
+			start = time.time()
+			data = generate(size_dir, rows, args.seed)
+			print("generated {0} records of each kind ({1} report APN's, {2} resource APN's, {3} parcels) in {4:.1f}s".format(data['records'], data['report_apns'], data['resource_apns'], data['parcels'], time.time() - start))
+		for kind in args.kinds:
+			for backend in args.backends:
+				for mode in args.modes:
+					if backend == "gpkg" and mode == "dissolve":
+						continue				# (GeoPackage geometry blobs aren't unioned, see mapbyparcel)
+					case_dir = os.path.join(workdir, "case_{0}_{1}_{2}_{3}".format(rows, kind, backend, mode))
+					shutil.rmtree(case_dir, ignore_errors=True)
+					os.makedirs(case_dir)
+					case = {
+						'rows'				: rows,
+						'kind'				: kind,
+						'backend'			: backend,
+						'mode'				: mode,
+						'size_dir'			: size_dir,
+						'case_dir'			: case_dir,
+						'saved_selection'	: saved_selection_file(size_dir, kind),
+						'result'			: os.path.join(case_dir, "result.json")
+					}
+					case_file = os.path.join(case_dir, "case.json")
+					with open(case_file, "w") as case_json:
+						json.dump(case, case_json)
+					with open(os.devnull, "w") as devnull:
+						status = subprocess.call([sys.executable, os.path.abspath(__file__), "--run-case", case_file], stdout=devnull)
+					if status != 0 or not os.path.exists(case['result']):
+						print("{0:>7} {1:<9} {2:<6} {3:<8} failed (exit status {4})".format(rows, kind, backend, mode, status))
+						continue
+					with open(case['result']) as result_file:
+						case.update(json.load(result_file))
+					results.append(case)
+					slowest = sorted(case['phases'].items(), key=lambda item: -item[1]['seconds'])[:3]
+					print("{0:>7} {1:<9} {2:<6} {3:<8} {4:>8.2f} {5:>10.0f} {6:>8}  {7}".format(rows, kind, backend, mode, case['seconds'], case['per_second'], case.get('peak_mb', case.get('peak_rss_mb', "?")),
+						", ".join("{0} {1:.2f}s".format(phase, times['seconds']) for (phase, times) in slowest)))
+	if args.json:
+		with open(args.json, "w") as json_file:
+			json.dump(results, json_file, indent=1, sort_keys=True)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -30,24 +30,416 @@
 #	based on: https://gis.stackexchange.com/questions/122780/how-to-allow-null-values-in-a-feature-layer
 #		the problem is that this code outputs a shape file. and shapefiles don't allow Null values (at least for INT fields)
 #		the correct solution is to write the output to a poly feature in a file geodatabase... Ugh.
+#
+# 2026-10-17
+#	load the ICDB records for the whole saved selection up front with a few chunked set-based queries
+#		(was 3 queries per S-#, 2 per P-#)
+#	reuse one ICDB session per run (per thread) with parameterized SQL, instead of a new login per record
+#	look up all the APN's of a run a county at a time with chunked "APN IN (...)" cursors (was 1 cursor per APN)
+#	optional persistent APN index of the parcel layers (mapByAPN_index.sqlite), rebuilt when a layer changes
+#	run options, overridable by MapByAPN_<option> environment variables
+#	write the output through one arcpy.da.InsertCursor for the whole run (was a legacy InsertCursor per record)
+#	map the records in batches; optionally load upcoming batches from the ICDB on worker threads while mapping
+#	optionally look up the counties of a batch at the same time in worker processes
+#	stream the saved selections workbook read-only, and accept CSV/TSV exports of it too
+#	put the ICDB APN's in canonical form and check them once, with precompiled patterns, before searching
+#		fix the patterns of counties 6 and 7 ('d{3}' for '\d{3}' flagged every APN there)
+#		skip searching for malformed APN's and list them all in one <selection>_malformed_APN.csv
+#	route each APN of a multi-county report to only the counties whose pattern (and APN index) it fits
+#	journal the records done (mapByAPN_journal.sqlite), so a rerun of a crashed run resumes its feature class
+#	optionally cache the records loaded from the ICDB locally (mapByAPN_icdb_cache.sqlite in the user's profile) for a while
+#	ICDB-to-parcel crosswalk, built by "mapbyparcel.py --build-crosswalk" (nightly), read by runs and --unmapped reports
+#	dry run option: the summary counts (and per county match rates) without reading geometry or writing output
+#	linked output layout: each parcel shape once, plus a record -> parcel links table (--expand writes the flat layout)
+#		and share the parcel shapes read during a run by (county, OID)
+#	dissolve option: one multipart polygon per record, the parcels unioned pairwise, with all its APN's in Notes
+#	batch mode: a folder or list of saved selections files mapped in one go, sharing sessions and lookups, with a combined summary
+#	importable without side effects: main(argv) does the run (command line, or the tool's parameter),
+#		and arcpy, pymssql and openpyxl are only imported when first used
+#	pluggable parcel sources: the map's parcel layers, the APN index, or a GeoPackage of the county parcel tables,
+#		and GeoPackage output, so a run on a GeoPackage needs no arcpy (tool messages are printed without it)
+#	time each phase of a run (and the slowest records and APN's) into a JSON run report next to the output,
+#		and optionally profile the run with cProfile
+#	leveled messages: only the summary (and a throughput/ETA line now and then) in the geoprocessing window by default,
+#		the per-record and per-APN detail in a run log file, written a batch of lines at a time
+#	benchmarks/bench_mapbyparcel.py: throughput, peak memory and phase times on a synthetic ICDB, parcels and saved selections
+#		of 1k-100k records, for the layer (with an arcpy stand-in) and GeoPackage parcel sources
 
 
-import openpyxl
-import pymssql
-import arcpy
 import getpass
 import datetime
 import os
 import string
 import re
+import threading
+import atexit
+import sqlite3
+import sys
+import multiprocessing
+import csv
+import time
+import importlib
+import argparse
+import struct
+import contextlib
+import heapq
+import json
+import cProfile
+import io
+import collections
+import traceback
+try:
+	import cPickle as pickle				# python 2 (ArcMap)
+except ImportError:
+	import pickle
+try:
+	import Queue							# python 2 (ArcMap)
+except ImportError:
+	import queue as Queue
+
+#-----
+# arcpy, pymssql and openpyxl are slow to import (arcpy takes seconds, and needs ArcGIS installed),
+# so each is imported the first time one of its attributes is used: importing this module, or using
+# the parts that don't touch them (APN normalization, the ICDB loading with another DB-API module, ...), is quick
+class LazyModule(object):
+	def __init__(self, name):
+		self.__dict__['_name'] = name
+		self.__dict__['_module'] = None
+
+	def __getattr__(self, attr):
+		if self._module is None:
+			self.__dict__['_module'] = importlib.import_module(self._name)
+		return getattr(self._module, attr)
+
+	def __setattr__(self, attr, value):
+		if self._module is None:
+			self.__dict__['_module'] = importlib.import_module(self._name)
+		setattr(self._module, attr, value)
+
+arcpy = LazyModule("arcpy")
+pymssql = LazyModule("pymssql")
+openpyxl = LazyModule("openpyxl")
+
+#-----
+# tool messages: to the geoprocessing window through arcpy, or, where arcpy isn't installed (a headless
+# run on a GeoPackage parcel source, see GeoPackageParcelSource), printed to stdout (warnings and errors to stderr)
+arcpy_missing = []						# holds True once arcpy turned out not to be installed
+
+def tool_message(arcpy_function, stream, message):
+	if not arcpy_missing:
+		try:
+			getattr(arcpy, arcpy_function)(message)
+			return
+		except ImportError:
+			arcpy_missing.append(True)
+	stream.write("{0}\n".format(message))
+
+def add_message(message):
+	tool_message("AddMessage", sys.stdout, message)
+	run_log.log(message)
+
+def add_warning(message):
+	tool_message("AddWarning", sys.stderr, message)
+	run_log.log("WARNING: {0}".format(message))
+
+def add_error(message):
+	tool_message("AddError", sys.stderr, message)
+	run_log.log("ERROR: {0}".format(message))
+
+# the detail of the mapping loop: a line or two per record, and a line per APN (see RunLog)
+def record_message(message):
+	run_log.detail("record", message)
 
-DBsaved_selection_file =		arcpy.GetParameterAsText(0)									# input file path of saved selections
+def apn_message(message):
+	run_log.detail("apn", message)
 
 map_by_APN_gdb = "mapByAPN.gdb"					# filename of the geodatabase to create/use for output
 
 run_user = getpass.getuser()					# get the current user's login id
 run_date = datetime.datetime(datetime.datetime.now().year,datetime.datetime.now().month,datetime.datetime.now().day)	# used for DigDate
 
+#-----
+# run options
+#	the defaults are set here; any of them can be overridden by a system environment variable
+#	named "MapByAPN_<option>" (the same way the ICDB connection values are set), e.g. MapByAPN_use_apn_index=1
+run_options = {
+	"use_apn_index"		: False,		# match APN's against the persistent APN index (mapByAPN_index.sqlite) instead of the parcel layers
+	"rebuild_apn_index"	: False,		# rebuild the APN index of every parcel layer before mapping
+	"stage_in_memory"	: False,		# write the output rows to an in_memory feature class, copied to mapByAPN.gdb at the end (each batch, if journaled)
+	"record_batch_size"	: 500,			# records loaded from the ICDB and looked up in the parcel layers at a time
+	"icdb_workers"		: 0,			# threads loading upcoming batches from the ICDB while the current one is mapped (0 = don't)
+	"prefetch_batches"	: 4,			# max batches loaded ahead of the one being mapped
+	"parcel_workers"	: 0,			# processes looking up the counties of a batch at the same time (0 = look them up in turn)
+	"shape_cache_size"	: 20000,		# parcel shapes kept between batches, the most recently used ones, for records matching them again
+	"search_malformed_apns"	: False,	# search the parcel layers for APN's that don't fit their county's pattern, too
+	"route_report_apns"	: True,			# search each APN of a multi-county report only in the counties it can be in (False = in all of them)
+	"journal_runs"		: True,			# journal the records done (mapByAPN_journal.sqlite), so a rerun after a crash picks up where it stopped
+	"icdb_cache_hours"	: 0,			# keep the records loaded from the ICDB in a local cache this long (0 = no cache)
+	"icdb_cache_mb"		: 200.0,		# max size of the local ICDB cache, least recently used records are dropped beyond it
+	"icdb_cache_stamp_column"	: "",	# modification timestamp column of tblInventory/tblResource to check cached records against
+	"bypass_icdb_cache"	: False,		# load every record from the ICDB (refreshing the cache)
+	"use_crosswalk"		: False,		# look the APN's up in the ICDB-to-parcel crosswalk built by --build-crosswalk first
+	"crosswalk_path"	: "",			# the crosswalk file (default: mapByAPN_crosswalk.sqlite in the user's profile folder)
+	"dry_run"			: False,		# only count: match the APN's without reading any geometry, and write no feature class
+	"output_layout"		: "flat",		# "flat": a polygon per record and parcel; "linked": each parcel once, plus a table of record -> parcel links
+	"expand_linked_output"	: False,	# after a linked run, also write the flat feature class from the parcels and links
+	"dissolve_records"	: False,		# write one multipart polygon per record (and county) instead of a feature per parcel
+	"parcel_source"		: "",			# GeoPackage of county parcel tables to look the APN's up in ("" = the parcel layers of the map)
+	"output_format"		: "gdb",		# "gdb": a feature class in mapByAPN.gdb; "gpkg": a table in mapByAPN.gpkg (written without arcpy)
+	"run_report"		: True,			# write the phase timings, slowest records/APN's, counts and options to <feature class>_run.json
+	"slowest_n"			: 10,			# how many of the slowest records and APN's the run report lists
+	"profile_run"		: False,		# run under cProfile, saving the stats to <selection>_profile.pstats
+	"verbosity"			: "summary",	# messages shown while mapping: "summary", "record" (a line or two per record) or "apn" (and a line per APN)
+	"progress_seconds"	: 10.0,			# show the records done, records/second and ETA this often (0 = never)
+	"log_file"			: True,			# log every message, all the detail too, to <feature class>_run.log
+}
+
+def load_run_options():
+	for (name, default) in run_options.items():
+		value = os.getenv("MapByAPN_" + name)
+		if value is None:
+			continue
+		if isinstance(default, bool):
+			run_options[name] = value.strip().lower() in ("1","true","yes","y")
+		elif isinstance(default, int):
+			run_options[name] = int(value)
+		elif isinstance(default, float):
+			run_options[name] = float(value)
+		else:
+			run_options[name] = value
+
+#--------------------
+# run instrumentation
+#
+#	run_timer adds up the wall time and calls of each phase of a run: reading the saved selection, ICDB
+#	queries (on any thread), waiting for the next batch of ICDB records, planning the APN searches, the
+#	parcel search of each county, inserting the output rows and committing them
+#	the phases are exclusive: a phase timed while another is open on the same thread (the saved selection
+#	read and the ICDB queries of a batch loaded in "icdb batches" without prefetch threads) is taken out
+#	of the enclosing one, so with icdb_workers = 0 "icdb batches" is only the rest of the loading (the
+#	ICDB cache, building the bundles); with prefetch threads it's the wait for the next batch, and their
+#	reading and queries are timed on their own threads, alongside the main thread's phases
+#	it also keeps the slowest_n slowest records, and the APN's that took longest to write the parcels of
+#	(the parcel searches are by county and batch, not by APN)
+#	map_reports()/map_resources() write it, along with the run's counts and options, to a JSON run report
+#	next to the output (<folder>\<feature class>_run.json) and start a new one for the next run
+
+timer_clock = getattr(time, "perf_counter", time.time)	# (python 2 has no perf_counter)
+
+class RunTimer(object):
+	def __init__(self, slowest_n=10):
+		self.slowest_n = slowest_n
+		self.started = datetime.datetime.now()
+		self.start_clock = timer_clock()
+		self.phases = {}						# phase -> [seconds, calls]
+		self.slowest_records = []				# heap of the (seconds, record) of the slowest_n slowest records
+		self.current_record = None				# (record, clock when it was started)
+		self.apn_times = {}						# (county#, apn) -> [seconds writing its parcels, parcels written]
+		self.lock = threading.Lock()
+		self.local = threading.local()			# holds the stack of the phases open on each thread
+
+	# the [seconds of nested phases] of each phase open on this thread, innermost last
+	def open_phases(self):
+		stack = getattr(self.local, "stack", None)
+		if stack is None:
+			stack = self.local.stack = []
+		return stack
+
+	def add(self, phase, seconds, calls=1):
+		stack = self.open_phases()
+		if stack:
+			stack[-1] += seconds					# (not counted again in the phase it's nested in)
+		with self.lock:
+			totals = self.phases.setdefault(phase, [0.0, 0])
+			totals[0] += seconds
+			totals[1] += calls
+
+	# time a block of code as (a call of) a phase:  with run_timer.phase("..."):
+	@contextlib.contextmanager
+	def phase(self, phase):
+		start = self.begin_phase()
+		try:
+			yield
+		finally:
+			self.end_phase(phase, start)
+
+	# the same, for code that isn't a block: start = run_timer.begin_phase() ... run_timer.end_phase("...", start)
+	def begin_phase(self):
+		self.open_phases().append(0.0)
+		return timer_clock()
+
+	def end_phase(self, phase, start, calls=1):
+		seconds = timer_clock() - start
+		stack = self.open_phases()
+		nested = stack.pop()
+		self.add(phase, seconds - nested, calls)
+		if stack:
+			stack[-1] += nested
+
+	# a record's time runs from its start_record() to the next one's (or to end_record())
+	def start_record(self, record):
+		self.end_record()
+		self.current_record = (record, timer_clock())
+
+	def end_record(self):
+		if self.current_record is None:
+			return
+		(record, start) = self.current_record
+		self.current_record = None
+		entry = (timer_clock() - start, record)
+		if len(self.slowest_records) < self.slowest_n:
+			heapq.heappush(self.slowest_records, entry)
+		elif entry > self.slowest_records[0]:
+			heapq.heapreplace(self.slowest_records, entry)
+
+	# the time to insert a feature, split between its APN's
+	def add_insert(self, county, apns, seconds):
+		self.add("insert", seconds)
+		for apn in apns:
+			apn_time = self.apn_times.setdefault((county, apn), [0.0, 0])
+			apn_time[0] += seconds / len(apns)
+			apn_time[1] += 1
+
+	def report(self):
+		slowest_apns = heapq.nlargest(self.slowest_n, self.apn_times.items(), key=lambda item: item[1][0])
+		return {
+			'started'			: self.started.isoformat(),
+			'seconds'			: round(timer_clock() - self.start_clock, 3),
+			'phases'			: dict((phase, {'seconds': round(seconds, 3), 'calls': calls}) for (phase, (seconds, calls)) in self.phases.items()),
+			'slowest_records'	: [{'record': record, 'seconds': round(seconds, 6)} for (seconds, record) in sorted(self.slowest_records, reverse=True)],
+			'slowest_apns'		: [{'county': county_numbers.get(county, county), 'apn': apn, 'seconds': round(seconds, 6), 'parcels': parcels} for ((county, apn), (seconds, parcels)) in slowest_apns]
+		}
+
+run_timer = RunTimer()
+
+# start timing a new run
+def reset_run_timer():
+	global run_timer
+	run_timer = RunTimer(run_options["slowest_n"])
+	return run_timer
+
+# time each step of an iterator (e.g. the wait for the next batch) as a call of a phase
+def timed_iter(iterable, phase):
+	iterator = iter(iterable)
+	while True:
+		start = run_timer.begin_phase()
+		calls = 0							# (the end of the iterator is timed, but isn't a step)
+		try:
+			item = next(iterator)
+			calls = 1
+		except StopIteration:
+			return
+		finally:
+			run_timer.end_phase(phase, start, calls)
+		yield item
+
+# write the run report of the run_timer, with the run's counts and options, next to the output
+# (or, in a dry run, the saved selections file), then start a new run_timer; returns the filename
+def write_run_report(saved_selection_file, output, counts):
+	run_timer.end_record()
+	report = run_timer.report()
+	report['selection'] = os.path.abspath(saved_selection_file)
+	report['output'] = output
+	report['counts'] = counts
+	report['options'] = dict(run_options)
+	report_file = run_file(saved_selection_file,output,"run","json")
+	with open(report_file, "w") as report_json:
+		json.dump(report, report_json, indent=1, sort_keys=True, default=str)
+	reset_run_timer()
+	return report_file
+
+# a file of a run that goes next to its output: <folder>\<feature class>_<stem>.<ext>
+# (or, in a dry run, next to the saved selections file)
+def run_file(saved_selection_file, output, stem, ext):
+	if output is None:
+		return make_output_file(saved_selection_file,stem,ext)
+	return os.path.join(os.path.dirname(os.path.dirname(output)),"{0}_{1}.{2}".format(os.path.basename(output),stem,ext))
+
+#--------------------
+# run log
+#
+#	the messages of the mapping loop are leveled: "record" (the record, whether it's in the ICDB, voided, how
+#	many APN's it has) and "apn" (each APN searched, or malformed); only those up to the verbosity option
+#	show in the geoprocessing window (thousands of messages slow ArcMap down, and bury the summary)
+#	instead, every progress_seconds, a line with the records done, records/second and ETA is shown
+#	every message, detail or not, goes to the run's log file (<feature class>_run.log, appended to by a resumed
+#	run), a log_batch_lines at a time
+#	run_log is the log of the current map_reports()/map_resources(), or one without a file in between
+
+message_levels = {"summary": 0, "record": 1, "apn": 2}
+log_batch_lines = 2000
+
+class RunLog(object):
+	def __init__(self, log_path=None, verbosity="summary", progress_seconds=0):
+		self.path = log_path
+		self.level = message_levels.get(verbosity, 0)
+		self.progress_seconds = progress_seconds
+		self.lines = []
+		self.lock = threading.Lock()
+		self.start_clock = timer_clock()
+		self.progress_clock = self.start_clock
+
+	def log(self, message):
+		if self.path is None:
+			return
+		with self.lock:
+			self.lines.append(u"{0}".format(message))
+			if len(self.lines) >= log_batch_lines:
+				self.write_lines()
+
+	def detail(self, level, message):
+		if message_levels[level] <= self.level:
+			tool_message("AddMessage", sys.stdout, message)
+		self.log(message)
+
+	# show the progress of the mapping loop, if it's been progress_seconds since the last time
+	#	total is (about) how many records the run maps, None if that isn't known (then there's no ETA)
+	def progress(self, done, total):
+		now = timer_clock()
+		if self.progress_seconds <= 0 or done == 0 or now - self.progress_clock < self.progress_seconds:
+			return
+		self.progress_clock = now
+		rate = done / max(now - self.start_clock, 0.001)
+		if total is None or total < done:
+			add_message("{0} records mapped ({1:.1f} records/second)".format(done,rate))
+			return
+		eta = datetime.timedelta(seconds=int((total - done) / rate)) if rate else "?"
+		add_message("{0} of {1} records mapped ({2:.1f} records/second), about {3} left".format(done,total,rate,eta))
+
+	# append the lines logged so far to the log file (with the lock held)
+	def write_lines(self):
+		if self.path is None or not self.lines:
+			return
+		with io.open(self.path, "a", encoding="utf-8") as log_file:
+			log_file.write(u"\n".join(self.lines) + u"\n")
+		self.lines = []
+
+	def flush(self):
+		with self.lock:
+			self.write_lines()
+
+	def close(self):
+		self.flush()
+
+run_log = RunLog(None, run_options["verbosity"])
+
+# start the run log of a run (and its log file, next to the output, if log_file is set)
+def start_run_log(saved_selection_file, output):
+	global run_log
+	log_path = None
+	if run_options["log_file"]:
+		log_path = run_file(saved_selection_file,output,"run","log")
+	run_log = RunLog(log_path, run_options["verbosity"], run_options["progress_seconds"])
+	if log_path is not None:
+		add_message("all messages are logged to {0}".format(log_path))
+	return run_log
+
+# close the run's log, going back to one without a file
+def end_run_log():
+	global run_log
+	run_log.close()
+	run_log = RunLog(None, run_options["verbosity"])
+
 #-----
 # derive an output .shp filename based on the saved selection file name....
 #	'x' is an input path/file to use as a stem for the output file location and filename
@@ -85,43 +477,73 @@ def make_output_file(x,stem,ext):
 #
 #	creates a file geodatabase in the directory
 #	creates a feature in the file geodatabase
+#	(or, if linked is set, a <name>_APN_<n>_parcels feature class and a <name>_APN_<n>_links table, see LinkedOutputWriter)
+#	(or, with output_format = "gpkg", a table in mapByAPN.gpkg, see create_gpkg_output)
 #	returns (result,featurename)
-#		if result=True, then featurename contains the pathname to the featureclass
+#		if result=True, then featurename contains the pathname to the featureclass (the links table, if linked)
 #		if result=False, then featurename contains an error msg string
 
-def create_output_feature(base_file,template_name):
+def create_output_feature(base_file,template_name,linked=False):
 	(source_dir, source_file) = os.path.split(base_file)					# split apart the directory path from the filename
 	(source_basename, source_ext) = os.path.splitext(source_file)			# split the extension off the filename
+	if run_options["output_format"] == "gpkg":
+		return create_gpkg_output(source_dir,feature_basename(source_basename),template_fields[template_name])
 	map_by_apn_fgdb_path = os.path.join(source_dir,map_by_APN_gdb)			# path to fgdb
 	#arcpy.AddMessage(map_by_apn_fgdb_path)
 	if not arcpy.Exists(map_by_apn_fgdb_path):
-		arcpy.AddMessage("creating geodatabase for Map_by_APN outputs: {0}".format(map_by_apn_fgdb_path))
+		add_message("creating geodatabase for Map_by_APN outputs: {0}".format(map_by_apn_fgdb_path))
 		arcpy_result = arcpy.CreateFileGDB_management(source_dir,map_by_APN_gdb)
 		if arcpy_result.status != 4:										# 4 is the 'success' status result
 			return(False,"; ".join(arcpy_result.getMessages()))				# return fail and errors
 	# at this point the output geodatabase exists
 	# now, find the next available feature class name
-	remove_letters = u" ~`!@#$%^&*()+-={}[]|\\:;<>?/.,\""					# list of characters to convert to '_'
-	new_basename = ""														# do our own translate loop (f-cking Unicode)
-	for c in source_basename:
-		if c in remove_letters:
-			new_basename += "_"
-		else:
-			new_basename += c
+	new_basename = feature_basename(source_basename)
 	#now, the basename is cleaned up, start searching for the next sequential feature
 	seq = 1
 	while (True):
 		try_feature = new_basename + "_APN_{0}".format(seq)
 		try_path = os.path.join(map_by_apn_fgdb_path,try_feature)
-		if not arcpy.Exists(try_path):
+		if not arcpy.Exists(try_path) and not arcpy.Exists(try_path + "_links"):
 			break
 		seq += 1
+	if linked:
+		return create_linked_output(map_by_apn_fgdb_path,try_feature,template_name)
 	#arcpy.AddMessage("try to create {0}".format(try_feature))
 	arcpy_result = arcpy.CreateFeatureclass_management(map_by_apn_fgdb_path,try_feature,"POLYGON",template_name,"SAME_AS_TEMPLATE","SAME_AS_TEMPLATE",template_name)
 	if arcpy_result.status != 4:
 		return(False,"; ".join(arcpy_result.getMessages()))					# return fail and errors
 	return(True, arcpy_result.getOutput(0))									# it all worked, return True and the path to the feature class
 
+# the saved selections file's name, cleaned up to start an output feature class name with
+def feature_basename(source_basename):
+	remove_letters = u" ~`!@#$%^&*()+-={}[]|\\:;<>?/.,\""					# list of characters to convert to '_'
+	new_basename = ""														# do our own translate loop (f-cking Unicode)
+	for c in source_basename:
+		if c in remove_letters:
+			new_basename += "_"
+		else:
+			new_basename += c
+	return new_basename
+
+# create the <feature>_parcels feature class (County, ParcelOID, APN) and the <feature>_links table
+# (the template's fields, plus County and ParcelOID) of a linked output; returns (result, links table or error msg)
+def create_linked_output(fgdb_path,feature_name,template_name):
+	spatial_ref = arcpy.Describe(template_name).spatialReference
+	arcpy_result = arcpy.CreateFeatureclass_management(fgdb_path,feature_name + "_parcels","POLYGON","","DISABLED","DISABLED",spatial_ref)
+	if arcpy_result.status != 4:
+		return(False,"; ".join(arcpy_result.getMessages()))
+	parcels_path = arcpy_result.getOutput(0)
+	arcpy.AddField_management(parcels_path,"County","SHORT")
+	arcpy.AddField_management(parcels_path,"ParcelOID","LONG")
+	arcpy.AddField_management(parcels_path,"APN","TEXT","","",50)
+	arcpy_result = arcpy.CreateTable_management(fgdb_path,feature_name + "_links",template_name)
+	if arcpy_result.status != 4:
+		return(False,"; ".join(arcpy_result.getMessages()))
+	links_path = arcpy_result.getOutput(0)
+	arcpy.AddField_management(links_path,"County","SHORT")
+	arcpy.AddField_management(links_path,"ParcelOID","LONG")
+	return(True, links_path)
+
 			
 
 #--------------------
@@ -137,7 +559,318 @@ def connect_to_icdb():
 	else:
 		db_connect = pymssql.connect(server=icdb_sqlserv,database=icdb_sqldb)
 	return db_connect
-	
+
+#--------------------
+# ICDB sessions
+#
+#	a session logs in once (via icdb_connect_factory) and is reused for every query of the run,
+#	instead of a fresh pymssql login per record
+#	SQL is written with '?' parameter markers; each statement is translated once to the
+#	DB-API module's marker (icdb_placeholder) and kept, so the same text is sent every time
+#	if the connection has dropped, the session logs in again and retries the statement once
+#	icdb_session() returns the session of the current thread (1 connection per run, or per worker thread)
+#	a worker thread closes its session (close_icdb_session()) when it's done, and main() and map_saved_selections()
+#	close the rest when they're done (ArcMap doesn't exit between runs of the tool, so leaving it to the
+#	script's exit would keep them open for the whole ArcMap session)
+
+icdb_connect_factory = connect_to_icdb		# function returning a new DB-API connection
+icdb_placeholder = "%s"						# parameter marker of the DB-API module: "%s" for pymssql, "?" for sqlite3
+
+class ICDBSession(object):
+	def __init__(self, connect_factory=None, placeholder=None):
+		self.connect_factory = connect_factory or icdb_connect_factory
+		self.placeholder = placeholder or icdb_placeholder
+		self.connection = None
+		self.cursor = None
+		self.statements = {}				# '?'-marked SQL -> SQL as sent to the DB-API module
+		self.query_count = 0
+
+	def connect(self):
+		if self.connection is None:
+			self.connection = self.connect_factory()
+			self.cursor = self.connection.cursor()
+		return self.connection
+
+	def prepare(self, sql):
+		statement = self.statements.get(sql)
+		if statement is None:
+			statement = sql.replace("?", self.placeholder)
+			self.statements[sql] = statement
+		return statement
+
+	# run a query, return the rows as dictionaries keyed by column name
+	def query(self, sql, params=()):
+		statement = self.prepare(sql)
+		start = timer_clock()
+		try:
+			self.connect()
+			rows = fetch_dict_rows(self.cursor, statement, params)
+		except Exception as e:
+			if not is_dropped_connection(e):
+				raise
+			self.close()						# drop the dead connection, log in again and retry once
+			self.connect()
+			rows = fetch_dict_rows(self.cursor, statement, params)
+		self.query_count += 1
+		run_timer.add("icdb query", timer_clock() - start)
+		return rows
+
+	def close(self):
+		if self.connection is not None:
+			try:
+				self.connection.close()
+			except Exception:
+				pass							# it may already be gone, that's why we're closing it
+		self.connection = None
+		self.cursor = None
+
+# DB-API modules raise OperationalError/InterfaceError when the server connection is lost
+def is_dropped_connection(e):
+	return type(e).__name__ in ("OperationalError","InterfaceError")
+
+icdb_local = threading.local()				# holds the session of each thread
+icdb_sessions = []							# every session open, so they can be closed when the run is done
+icdb_sessions_lock = threading.Lock()
+
+def icdb_session():
+	session = getattr(icdb_local, "session", None)
+	if session is None:
+		session = ICDBSession()
+		icdb_local.session = session
+		with icdb_sessions_lock:
+			icdb_sessions.append(session)
+	return session
+
+# close the session of the current thread, if it has one
+def close_icdb_session():
+	session = getattr(icdb_local, "session", None)
+	if session is None:
+		return
+	session.close()
+	icdb_local.session = None
+	with icdb_sessions_lock:
+		if session in icdb_sessions:
+			icdb_sessions.remove(session)
+
+def close_icdb_sessions():
+	with icdb_sessions_lock:
+		for session in icdb_sessions:
+			session.close()
+		del icdb_sessions[:]
+	icdb_local.session = None
+
+atexit.register(close_icdb_sessions)			# (in case a script importing this one doesn't)
+
+#--------------------
+# bulk load the ICDB records for a whole saved selection
+#
+#	rather than querying tblInventory/tblInventoryAddr/tblInventoryCnty (or tblResource/tblResourceAddr)
+#	once per record, pull the rows for every record with a few chunked "IN (...)" queries
+#	returns a dictionary of per-record bundles for the mapping loops to read from:
+#		{ key : {'parent': <row dict, None if not in ICDB>, 'apns': [apn,...], 'counties': [county#,...]} }
+#	report keys are DocNo's (int), resource keys are (PrimCo,PrimNo) tuples
+
+icdb_chunk_size = 512			# max keys in one IN (...) list (SQL Server allows ~2100 parameters per statement)
+
+def chunked(items, size):
+	chunk = []
+	for item in items:
+		chunk.append(item)
+		if len(chunk) == size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+# build the "?,?,..." marker list for a chunk of keys, padding the keys out to a power of 2
+# (repeating the last key) so only a handful of distinct statements are ever sent to the server
+def in_list_params(chunk, chunk_size=icdb_chunk_size):
+	size = 1
+	while size < len(chunk):
+		size *= 2
+	size = max(len(chunk), min(size, chunk_size))
+	params = list(chunk) + [chunk[-1]] * (size - len(chunk))
+	return (",".join(["?"] * size), params)
+
+# run a query and return the rows as dictionaries keyed by column name
+def fetch_dict_rows(icdb_cursor, sql, params=()):
+	icdb_cursor.execute(sql, tuple(params))
+	columns = [column[0] for column in icdb_cursor.description]
+	return [dict(zip(columns,row)) for row in icdb_cursor.fetchall()]
+
+# add an address APN value to a bundle, skipping blanks and duplicates
+def add_bundle_apn(bundle, apn):
+	if apn:
+		apn_cleaned = apn.strip()					# remove leading/trailing whitespace
+		if (len(apn_cleaned) > 0) and (apn_cleaned not in bundle['apns']):
+			bundle['apns'].append(apn_cleaned)
+
+def load_report_bundles(session, doc_list, chunk_size=icdb_chunk_size):
+	bundles = {}
+	for s_no in doc_list:
+		bundles[int(s_no)] = {'parent': None, 'apns': [], 'counties': []}
+	for chunk in chunked(sorted(bundles), chunk_size):
+		(in_list, params) = in_list_params(chunk, chunk_size)
+		for row in session.query("Select * from tblInventory WHERE DocNo IN ({0})".format(in_list), params):
+			bundles[row['DocNo']]['parent'] = row
+		for row in session.query("Select DocNo, APN from tblInventoryAddr WHERE DocNo IN ({0})".format(in_list), params):
+			add_bundle_apn(bundles[row['DocNo']], row['APN'])
+		for row in session.query("Select DocNo, CountyName from tblInventoryCnty WHERE DocNo IN ({0})".format(in_list), params):
+			if row['CountyName']:
+				bundles[row['DocNo']]['counties'].append(county_names[row['CountyName']])	# lookup the name and store county number
+	return bundles
+
+def load_resource_bundles(session, res_keys, chunk_size=icdb_chunk_size):
+	bundles = {}
+	primaries_by_county = {}					# group the PrimNo's by PrimCo so each query is a simple IN (...) list
+	for (p_co,p_no) in res_keys:
+		(p_co,p_no) = (int(p_co),int(p_no))
+		if (p_co,p_no) not in bundles:
+			bundles[(p_co,p_no)] = {'parent': None, 'apns': [], 'counties': [p_co]}
+			primaries_by_county.setdefault(p_co,[]).append(p_no)
+	for p_co in sorted(primaries_by_county):
+		for chunk in chunked(sorted(primaries_by_county[p_co]), chunk_size):
+			(in_list, params) = in_list_params(chunk, chunk_size)
+			params = [p_co] + params
+			for row in session.query("Select * from tblResource WHERE PrimCo = ? and PrimNo IN ({0})".format(in_list), params):
+				bundles[(row['PrimCo'],row['PrimNo'])]['parent'] = row
+			for row in session.query("Select PrimCo, PrimNo, APN from tblResourceAddr WHERE PrimCo = ? and PrimNo IN ({0})".format(in_list), params):
+				add_bundle_apn(bundles[(row['PrimCo'],row['PrimNo'])], row['APN'])
+	return bundles
+
+#--------------------
+# local ICDB cache
+#
+#	keeps the bundles loaded from the ICDB in a SQLite database under the user's profile
+#	(mapByAPN_icdb_cache.sqlite), keyed by S-#/P-#, so overlapping saved selections run the same day
+#	don't pull the same tblInventory*/tblResource* rows from SQL Server again
+#	off unless icdb_cache_hours is set: without icdb_cache_stamp_column an APN fixed in the ICDB isn't seen
+#	until its entry expires; records not found in the ICDB (no parent row) are never cached
+#	entries expire after icdb_cache_hours; when the cache grows past icdb_cache_mb the least recently
+#	used entries are dropped; bypass_icdb_cache reloads every record from the ICDB (and refreshes the cache)
+#	if icdb_cache_stamp_column names a modification timestamp column of tblInventory/tblResource, the
+#	stamps of the cached records are checked first (one light query per chunk) and changed ones reloaded
+
+icdb_cache_name = "mapByAPN_icdb_cache.sqlite"	# filename of the cache, kept in the user's profile folder
+
+def load_report_stamps(session, doc_list, column, chunk_size=icdb_chunk_size):
+	stamps = {}
+	for chunk in chunked(sorted(set(int(s_no) for s_no in doc_list)), chunk_size):
+		(in_list, params) = in_list_params(chunk, chunk_size)
+		for row in session.query("Select DocNo, {0} from tblInventory WHERE DocNo IN ({1})".format(column, in_list), params):
+			stamps[row['DocNo']] = row[column]
+	return stamps
+
+def load_resource_stamps(session, res_keys, column, chunk_size=icdb_chunk_size):
+	stamps = {}
+	primaries_by_county = {}
+	for (p_co,p_no) in set((int(p_co),int(p_no)) for (p_co,p_no) in res_keys):
+		primaries_by_county.setdefault(p_co,[]).append(p_no)
+	for p_co in sorted(primaries_by_county):
+		for chunk in chunked(sorted(primaries_by_county[p_co]), chunk_size):
+			(in_list, params) = in_list_params(chunk, chunk_size)
+			for row in session.query("Select PrimCo, PrimNo, {0} from tblResource WHERE PrimCo = ? and PrimNo IN ({1})".format(column, in_list), [p_co] + params):
+				stamps[(row['PrimCo'],row['PrimNo'])] = row[column]
+	return stamps
+
+def stamp_text(stamp):
+	if stamp is None:
+		return None
+	return str(stamp)
+
+class ICDBCache(object):
+	def __init__(self, cache_path, ttl_hours, max_mb, stamp_column="", bypass=False):
+		self.path = cache_path
+		self.db = sqlite3.connect(cache_path, check_same_thread=False)	# shared by the ICDB worker threads, under the lock
+		self.lock = threading.Lock()
+		self.db.execute("CREATE TABLE IF NOT EXISTS bundles (kind TEXT, record TEXT, stamp TEXT, fetched REAL, used REAL, size INTEGER, bundle BLOB, PRIMARY KEY (kind, record))")
+		self.oldest = time.time() - ttl_hours * 3600.0
+		self.db.execute("DELETE FROM bundles WHERE fetched < ?", (self.oldest,))
+		self.max_size = int(max_mb * 1024 * 1024)
+		self.evict()
+		self.db.commit()
+		self.stamp_column = stamp_column
+		self.bypass = bypass
+		self.hits = 0							# records served from the cache
+		self.misses = 0							# records loaded from the ICDB
+
+	# cached entries of some records: { key : (stamp, bundle) }
+	def get(self, kind, keys, key_record, chunk_size=icdb_chunk_size):
+		keys_by_record = dict((key_record(key), key) for key in keys)
+		found = {}
+		with self.lock:
+			for chunk in chunked(sorted(keys_by_record), chunk_size):
+				sql = "SELECT record, stamp, bundle FROM bundles WHERE kind = ? AND fetched >= ? AND record IN ({0})".format(",".join(["?"] * len(chunk)))
+				for (record, stamp, bundle) in self.db.execute(sql, [kind, self.oldest] + chunk):
+					found[keys_by_record[record]] = (stamp, pickle.loads(bytes(bundle)))
+			now = time.time()
+			self.db.executemany("UPDATE bundles SET used = ? WHERE kind = ? AND record = ?", [(now, kind, key_record(key)) for key in found])
+			self.db.commit()
+		return found
+
+	def put(self, kind, bundles, key_record):
+		now = time.time()
+		rows = []
+		for (key, bundle) in bundles.items():
+			if bundle['parent'] is None:
+				continue								# not in the ICDB (yet), so look it up again next time
+			blob = pickle.dumps(bundle, 2)
+			stamp = None
+			if self.stamp_column:
+				stamp = stamp_text(bundle['parent'].get(self.stamp_column))
+			rows.append((kind, key_record(key), stamp, now, now, len(blob), sqlite3.Binary(blob)))
+		with self.lock:
+			self.db.executemany("INSERT OR REPLACE INTO bundles VALUES (?,?,?,?,?,?,?)", rows)
+			self.evict()
+			self.db.commit()
+
+	# drop the least recently used entries once the cache is over its size, down to 90% of it
+	def evict(self):
+		total = self.db.execute("SELECT COALESCE(SUM(size),0) FROM bundles").fetchone()[0]
+		if total <= self.max_size:
+			return
+		dropped = []
+		for (kind, record, size) in self.db.execute("SELECT kind, record, size FROM bundles ORDER BY used").fetchall():
+			if total <= self.max_size * 0.9:
+				break
+			dropped.append((kind, record))
+			total -= size
+		self.db.executemany("DELETE FROM bundles WHERE kind = ? AND record = ?", dropped)
+
+	# wrap a load_*_bundles() function so it serves what it can from the cache, and caches what it loads
+	def loader(self, kind, load_bundles, load_stamps, key_record):
+		def load_cached_bundles(session, keys):
+			keys = list(keys)
+			bundles = {}
+			if not self.bypass:
+				cached = self.get(kind, keys, key_record)
+				if self.stamp_column and cached:
+					stamps = load_stamps(session, list(cached), self.stamp_column)
+					for key in list(cached):
+						if cached[key][0] != stamp_text(stamps.get(key)):
+							del cached[key]						# changed in the ICDB since it was cached
+				bundles = dict((key, bundle) for (key, (stamp, bundle)) in cached.items())
+			missing = [key for key in keys if key not in bundles]
+			if missing:
+				loaded = load_bundles(session, missing)
+				self.put(kind, loaded, key_record)
+				bundles.update(loaded)
+			with self.lock:
+				self.hits += len(keys) - len(missing)
+				self.misses += len(missing)
+			return bundles
+		return load_cached_bundles
+
+	def close(self):
+		self.db.close()
+
+# open the cache in the user's profile folder, or None if it's turned off (icdb_cache_hours = 0)
+def open_icdb_cache():
+	if run_options["icdb_cache_hours"] <= 0:
+		return None
+	cache_path = os.path.join(os.path.expanduser("~"),icdb_cache_name)
+	return ICDBCache(cache_path,run_options["icdb_cache_hours"],run_options["icdb_cache_mb"],run_options["icdb_cache_stamp_column"],run_options["bypass_icdb_cache"])
+
 #-------
 # valid sheet names accepted (these are generated by the DB Save... function
 # we check for these as a sort validation that the spreadsheet we're looking is 
@@ -213,36 +946,1525 @@ county_numbers = { county_names[x]:x for x in county_names}
 # a table of APN patterns, by county
 # a table of regular expressions that can be used to attempt to detect mis-formed APN values in the ICDB
 apn_patterns = {
-	1	:	"^\d{1,3}[A-Z]?-\d{1,4}-\d{1,3}(-\d{1,2})?$",
-	6	:	"^\d{3}-\d{3}-d{3}$",
-	7	:	"^\d{3}-\d{3}-d{3}-000$",
-	8	:	"^\d{3}-\d{3}-\d{2}$",
-	12	:	"^\d{3}-\d{3}-\d{2}$",
-	17	:	"^\d{3}-\d{3}-\d{2}$",
-	21	:	"^\d{3}-\d{3}-\d{2}$",
-	23	:	"^\d{3}-\d{3}-\d{2}$",
-	27	:	"^\d{3}-\d{3}-\d{3}$",
-	28	:	"^\d{3}-\d{3}-\d{2}$",
-	35	:	"^\d{3}-\d{3}-\d{3}$",
-	38	:	"^\d{4}-\d{3}(-[A-Z])?$",
-	41	:	"^\d{3}-\d{3}-\d{3}$",
-	43	:	"^\d{3}-\d{2}-\d{3}$",
-	44	:	"^\d{3}-\d{3}-\d{2}$",
-	48	:	"^\d{3}-\d{3}-\d{3}$",
-	49	:	"^\d{3}-\d{3}-\d{3}$",
-	57	:	"^\d{3}-\d{3}-\d{2}$"
+	1	:	r"^\d{1,3}[A-Z]?-\d{1,4}-\d{1,3}(-\d{1,2})?$",
+	6	:	r"^\d{3}-\d{3}-\d{3}$",
+	7	:	r"^\d{3}-\d{3}-\d{3}-000$",
+	8	:	r"^\d{3}-\d{3}-\d{2}$",
+	12	:	r"^\d{3}-\d{3}-\d{2}$",
+	17	:	r"^\d{3}-\d{3}-\d{2}$",
+	21	:	r"^\d{3}-\d{3}-\d{2}$",
+	23	:	r"^\d{3}-\d{3}-\d{2}$",
+	27	:	r"^\d{3}-\d{3}-\d{3}$",
+	28	:	r"^\d{3}-\d{3}-\d{2}$",
+	35	:	r"^\d{3}-\d{3}-\d{3}$",
+	38	:	r"^\d{4}-\d{3}(-[A-Z])?$",
+	41	:	r"^\d{3}-\d{3}-\d{3}$",
+	43	:	r"^\d{3}-\d{2}-\d{3}$",
+	44	:	r"^\d{3}-\d{3}-\d{2}$",
+	48	:	r"^\d{3}-\d{3}-\d{3}$",
+	49	:	r"^\d{3}-\d{3}-\d{3}$",
+	57	:	r"^\d{3}-\d{3}-\d{2}$"
 }
 
-def map_reports():
-	arcpy.AddMessage("Mapping reports by APN")
+#--------------------
+# APN normalization and validation
+#
+#	runs once over the APN's of each batch of records, before any parcel searching
+#	each APN is put in canonical form (upper case, plain '-' between the groups in place of spaces or
+#	other dash characters) to match the standardized APN field of the parcel layers, and checked
+#	against the precompiled pattern of each county it'll be searched in
+#	sets in each bundle:
+#		'apns'			the canonical APN's (duplicates dropped)
+#		'apn_sources'	{ canonical apn : apn as it is in the ICDB }
+#		'fits'			{ canonical apn : set of the bundle's county#'s whose pattern it fits }
+
+apn_validators = dict((county, re.compile(pattern)) for (county, pattern) in apn_patterns.items())
+apn_dashes = u"\u2010\u2011\u2012\u2013\u2014\u2015\u2212"		# the hyphen/dash/minus look-alikes of '-'
+
+def canonical_apn(apn):
+	apn = apn.strip().upper()
+	for dash in apn_dashes:
+		apn = apn.replace(dash, "-")
+	apn = re.sub(r"\s*-\s*", "-", apn)			# no spaces around the dashes
+	apn = re.sub(r"\s+", "-", apn)				# groups separated by spaces
+	return re.sub(r"-{2,}", "-", apn)
+
+def normalize_bundle_apns(bundles):
+	for bundle in bundles.values():
+		if 'fits' in bundle:
+			continue								# already done
+		apns = []
+		apn_sources = {}
+		for apn in bundle['apns']:
+			apn_canonical = canonical_apn(apn)
+			if apn_canonical and apn_canonical not in apn_sources:
+				apns.append(apn_canonical)
+				apn_sources[apn_canonical] = apn
+		bundle['apns'] = apns
+		bundle['apn_sources'] = apn_sources
+		bundle['fits'] = dict((apn, set(county for county in bundle['counties'] if apn_validators[county].match(apn))) for apn in apns)
+
+#--------------------
+# plan the parcel searches of each record
+#
+#	sets in each bundle (after normalize_bundle_apns()):
+#		'malformed'		set of (county#, apn) to report as not well-formed
+#		'searches'		set of (county#, apn) to look up in the parcel layers
+#	an APN is malformed in a county if it doesn't fit that county's pattern, and then isn't searched
+#	for there, unless search_malformed is set
+#	with route set, the APN's of a report listing more than one county are routed: each is searched
+#	only in the counties whose pattern it fits (and, given an indexed parcel source, whose index has it), and is
+#	only malformed if it fits none of them; otherwise every APN is searched in every county listed
+
+def plan_apn_searches(bundles, search_malformed=False, route=False, parcel_source=None):
+	routed_bundles = []
+	for bundle in bundles.values():
+		counties = bundle['counties']
+		routed = route and len(counties) > 1
+		malformed = set()
+		searches = set()
+		for apn in bundle['apns']:
+			fits = bundle['fits'][apn]
+			if routed and fits:
+				searches.update((county, apn) for county in fits)
+				continue
+			for county in counties:
+				if county not in fits:
+					malformed.add((county, apn))
+					if not search_malformed:
+						continue
+				searches.add((county, apn))
+		bundle['malformed'] = malformed
+		bundle['searches'] = searches
+		if routed:
+			routed_bundles.append(bundle)
+
+	if parcel_source is not None and routed_bundles:
+		# drop the routed searches the parcel source's index says can't find anything
+		wanted = {}
+		for bundle in routed_bundles:
+			for (county, apn) in bundle['searches'] - bundle['malformed']:
+				wanted.setdefault(county, set()).add(apn)
+		indexed = dict((county, parcel_source.contains(county, apns)) for (county, apns) in wanted.items())
+		for bundle in routed_bundles:
+			bundle['searches'] = set(search for search in bundle['searches'] if search in bundle['malformed'] or search[1] in indexed[search[0]])
+
+# write the consolidated list of malformed APN's of a run to a .csv next to the saved selections file
+#	rows are (record, county name, apn as in the ICDB, canonical apn); returns the filename
+def write_malformed_apn_report(saved_selection_file, rows):
+	return write_csv_report(saved_selection_file,"malformed_APN",("Record","County","APN in ICDB","Canonical APN"),rows)
+
+# write rows to a <selection>_<stem>.csv next to the saved selections file; returns the filename
+def write_csv_report(saved_selection_file, stem, header, rows):
+	report_name = make_output_file(saved_selection_file,stem,"csv")
+	if sys.version_info[0] < 3:
+		report_file = open(report_name, "wb")
+	else:
+		report_file = open(report_name, "w", newline="")
+	with report_file:
+		report_writer = csv.writer(report_file)
+		report_writer.writerow(header)
+		report_writer.writerows(rows)
+	return report_name
+
+#--------------------
+# read a saved selections file
+#
+#	takes the .xlsx written by the ICDB's Save... function, or a CSV/TSV export of the same
+#	tblInvSelect (DocCo,DocNo) or tblResSelect (PrimCo,PrimNo) layout
+#	returns (kind,keys)
+#		kind is sheet_saved_reports or sheet_saved_resources, and keys lazily yields each DocNo (int)
+#		or (PrimCo,PrimNo) tuple of the selection once, in file order, up to the first blank row
+#		(a key that isn't a number raises a ValueError naming the file, row and value, when it's reached)
+#		if kind is None, the file isn't a valid saved selection and keys is an error msg string
+#	a workbook is opened read-only and its rows streamed, instead of loading all of it and looking up one cell at a time
+
+saved_selection_headers = {
+	sheet_saved_reports		: ("DocCo","DocNo"),
+	sheet_saved_resources	: ("PrimCo","PrimNo")
+}
+
+def read_saved_selection(file_name):
+	(kind, rows) = saved_selection_rows(file_name)
+	if rows is None:
+		return (None, "File is not a valid ICDB saved selections")
+	header = tuple(cell_text(value) for value in (tuple(next(rows, ())) + (None, None))[:2])
+	if kind is None:											# a CSV/TSV export, tell which kind by its header
+		for (header_kind, header_names) in saved_selection_headers.items():
+			if header == header_names:
+				kind = header_kind
+		if kind is None:
+			return (None, "File is not a valid ICDB saved selections")
+	if header != saved_selection_headers[kind]:
+		if kind == sheet_saved_reports:
+			return (None, "File is not a valid ICDB saved reports")
+		return (None, "File is not a valid ICDB saved resources")
+	return (kind, saved_selection_keys(kind, rows, file_name))
+
+# returns (sheet name, rows of cell values), the sheet name is None for a CSV/TSV file
+# and the rows are None if a workbook has no recognized sheet
+def saved_selection_rows(file_name):
+	if os.path.splitext(file_name)[1].lower() in (".csv",".tsv",".txt"):
+		return (None, delimited_rows(file_name))
+	workbook = openpyxl.load_workbook(str(file_name), read_only=True)
+	for sheet in workbook.sheetnames:
+		if sheet in saved_selection_headers:
+			return (sheet, workbook_rows(workbook, sheet))
+	workbook.close()
+	return (None, None)
+
+def workbook_rows(workbook, sheet):
+	try:
+		for row in workbook[sheet].iter_rows():
+			yield tuple(cell.value for cell in row)
+	finally:
+		workbook.close()
+
+def delimited_rows(file_name):
+	if sys.version_info[0] < 3:
+		csv_file = open(file_name, "rb")
+	else:
+		csv_file = open(file_name, "r", newline="", encoding="utf-8-sig")
+	with csv_file:
+		delimiter = "\t" if "\t" in csv_file.readline() else ","
+		csv_file.seek(0)
+		for row in csv.reader(csv_file, delimiter=delimiter):
+			yield tuple(row)
+
+# about how many records a saved selections file has, without reading them: the lines of a CSV/TSV (counted
+# a block at a time) or the rows of the workbook's sheet, less the header; None if that can't be told
+def saved_selection_row_count(file_name):
+	try:
+		if os.path.splitext(file_name)[1].lower() in (".csv",".tsv",".txt"):
+			(lines, last) = (0, b"\n")
+			with open(file_name, "rb") as csv_file:
+				for block in iter(lambda: csv_file.read(1 << 20), b""):
+					lines += block.count(b"\n")
+					last = block[-1:]
+			if last != b"\n":
+				lines += 1											# (the last line has no line end)
+			return max(lines - 1, 0)
+		workbook = openpyxl.load_workbook(str(file_name), read_only=True)
+		try:
+			for sheet in workbook.sheetnames:
+				if sheet in saved_selection_headers and workbook[sheet].max_row is not None:
+					return max(workbook[sheet].max_row - 1, 0)
+		finally:
+			workbook.close()
+	except Exception:
+		pass
+	return None
+
+# the number of records a run maps, for the ETA of its progress lines: of a list of keys, or else about the
+# rows of its saved selections file (see above); less those done by a run it resumes; None if it isn't known
+def run_record_total(keys, saved_selection_file, done_records):
+	if hasattr(keys, "__len__"):
+		total = len(keys)
+	else:
+		total = saved_selection_row_count(saved_selection_file)
+	if total is None:
+		return None
+	return max(total - len(done_records), 0)
+
+def saved_selection_keys(kind, rows, file_name=None):
+	seen = set()
+	for (row_number, row) in enumerate(rows, 2):					# (row 1 is the header)
+		row = tuple(row) + (None, None)
+		if kind == sheet_saved_reports:
+			if cell_text(row[1]) == "":
+				break												# stop at the first blank DocNo
+			key = cell_int(row[1], file_name, row_number)
+		else:
+			if cell_text(row[0]) == "" or cell_text(row[1]) == "":
+				break												# stop at the first blank PrimCo/PrimNo
+			key = (cell_int(row[0], file_name, row_number), cell_int(row[1], file_name, row_number))
+		if key not in seen:
+			seen.add(key)
+			yield key
+
+def cell_text(value):
+	if value is None:
+		return ""
+	return str(value).strip().lstrip("\xef\xbb\xbf")				# (and any UTF-8 byte order mark, for python 2)
+
+# a key cell's value as an int; one that isn't a number is reported with the file and row it's in
+def cell_int(value, file_name=None, row_number=None):
+	try:
+		return int(float(value))
+	except (TypeError, ValueError):
+		raise ValueError("row {0} of {1}: '{2}' is not a number".format(row_number,os.path.basename(file_name or "the saved selection"),cell_text(value)))
+
+#--------------------
+# batched, optionally pipelined, ICDB loading
+#
+#	the records of a run are loaded and mapped in batches of record_batch_size
+#	with icdb_workers > 0, a pool of threads (each with its own ICDB session, closed when the thread is done) loads the bundles of the
+#	upcoming batches while the main thread does the arcpy work on the current one (arcpy stays on the
+#	main thread); at most prefetch_batches batches are loaded ahead, and they are always handed back
+#	in order, so the per-record output and counters come out the same as a serial run
+#	an error loading a batch, or taking its keys, is raised by the main thread when that batch's turn comes
+#	yields (batch keys, bundles of the batch)
+
+def iter_bundle_batches(load_bundles, keys, batch_size, workers=0, prefetch=4):
+	batches = chunked(keys, batch_size)
+	if workers < 1:
+		for batch in batches:
+			yield (batch, load_bundles(icdb_session(), batch))
+		return
+
+	batches_lock = threading.Lock()						# the workers take the batches from the keys in turn
+	batches_taken = [0]
+	batches_done = [False]
+	loaded = Queue.Queue()
+	ahead = threading.Semaphore(max(prefetch, workers))		# batches loaded but not yet handed to the main thread
+	stopping = threading.Event()
+
+	def load_worker():
+		try:
+			while True:
+				ahead.acquire()
+				if stopping.is_set():
+					return
+				with batches_lock:
+					(batch, error) = (None, None)
+					if not batches_done[0]:
+						try:
+							batch = next(batches, None)
+						except Exception as e:
+							error = e							# reading the keys failed (e.g. a bad row of the saved selection)
+						if batch is None:
+							batches_done[0] = True
+						if batch is not None or error is not None:
+							i = batches_taken[0]
+							batches_taken[0] += 1
+				if error is not None:
+					loaded.put((i, None, None, error))			# raised by the main thread in its turn, after the batches before it
+					return
+				if batch is None:
+					ahead.release()
+					loaded.put((None, None, None, None))		# wake up the main thread, there are no more
+					return
+				try:
+					loaded.put((i, batch, load_bundles(icdb_session(), batch), None))
+				except Exception as e:
+					loaded.put((i, batch, None, e))
+		finally:
+			close_icdb_session()								# (a new thread, with a new session, is started for the next run)
+
+	def all_handed_out(i):
+		with batches_lock:
+			return batches_done[0] and i >= batches_taken[0]
+
+	threads = [threading.Thread(target=load_worker) for n in range(workers)]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	ready = {}													# batches loaded out of order, by batch number
+	try:
+		i = 0
+		while not all_handed_out(i):
+			(n, batch, bundles, error) = loaded.get()
+			if n is not None:
+				ready[n] = (batch, bundles, error)
+			while i in ready:
+				(batch, bundles, error) = ready.pop(i)
+				ahead.release()									# let the workers load another one
+				if error is not None:
+					raise error
+				yield (batch, bundles)
+				i += 1
+	finally:
+		stopping.set()
+		for thread in threads:
+			ahead.release()										# wake up any worker waiting for room, so it can quit
+
+#--------------------
+# batched parcel lookup
+#
+#	gather up every APN of the run, grouped by county, and look them up in each county's parcel layer
+#	with a few chunked "APN IN ('...','...')" SearchCursors (or, for very long lists, one streaming pass
+#	over the layer) instead of opening a SearchCursor for every APN of every record
+#	returns { county# : { apn : [(oid, shape),...] } } with an entry (maybe empty) for every APN asked for
+#	shape_cache { (county#, oid) : shape } (a ShapeCache) is kept by the caller across batches, so a parcel matched
+#	again (by another record or batch) is the same shape object, and isn't read again where that can be avoided
+#	the lookup itself is up to a parcel source, an object with
+#		lookup(county#, apns, chunk_size, shapes, shape_cache) -> { apn : [(oid, shape),...] }
+#	the parcel layers of the map (LayerParcelSource) by default, or, if given, an APNIndex or a
+#	GeoPackageParcelSource, and then the parcel layers aren't opened at all; these two are indexed and
+#	also have contains(county#, apns, chunk_size) -> set of the APN's they have, for plan_apn_searches()
+#	if workers > 1 (and no parcel source is given), the counties are looked up in worker processes (see resolve_parcels_in_processes)
+#	if a Crosswalk is given, the APN's it has are read from it, and only the rest are looked up
+#	with shapes=False (a dry run), no geometry is read and the shapes are None
+
+parcel_chunk_size = 250				# APN's per "APN IN (...)" where clause
+parcel_stream_threshold = 20000		# read the whole layer in one pass when asking for more APN's than this in a county
+
+# gather up the APN's of the records worth searching for: { county# : set(apn,...) }
+# (from the searches planned by plan_apn_searches())
+def collect_apns_by_county(bundles):
+	apns_by_county = {}
+	for bundle in bundles.values():
+		if bundle['parent'] is None or bundle['parent']['Voided']:
+			continue
+		for (county, apn) in bundle['searches']:
+			apns_by_county.setdefault(county, set()).add(apn)
+	return apns_by_county
+
+# quote a string value for an arcpy where clause
+def sql_quote(value):
+	return "'{0}'".format(value.replace("'","''"))
+
+# the parcel shapes of a run by (county#, oid), a dict that keeps only the max_size most recently used
+# once trim()'d; that's done between batches, so every shape a batch has looked up is there until it's written
+class ShapeCache(object):
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self.shapes = collections.OrderedDict()		# least recently used first
+
+	def __contains__(self, key):
+		return key in self.shapes
+
+	def __len__(self):
+		return len(self.shapes)
+
+	def __getitem__(self, key):
+		shape = self.shapes.pop(key)					# and put it back, as the most recently used
+		self.shapes[key] = shape
+		return shape
+
+	def __setitem__(self, key, shape):
+		self.shapes.pop(key, None)
+		self.shapes[key] = shape
+
+	def get(self, key, default=None):
+		if key in self.shapes:
+			return self[key]
+		return default
+
+	def setdefault(self, key, shape):
+		if key in self.shapes:
+			return self[key]
+		self.shapes[key] = shape
+		return shape
+
+	def trim(self):
+		while len(self.shapes) > self.max_size:
+			self.shapes.popitem(last=False)
+
+	def clear(self):
+		self.shapes.clear()
+
+# the (oid, shape) of a parcel found, sharing the shape already read for it this run, if any
+def cached_parcel(shape_cache, county, oid, shape):
+	if shape is not None:
+		shape = shape_cache.setdefault((county, oid), shape)
+	return (oid, shape)
+
+# clear any pre-existing selection on a parcel layer (once per run), so cursors see every parcel
+def clear_parcel_selection(county):
+	if not parcel_selections_cleared[county]:
+		arcpy.SelectLayerByAttribute_management(parcel_layers[county],"CLEAR_SELECTION")
+		parcel_selections_cleared[county] = True
+
+# the parcel layers of the map, searched with chunked "APN IN (...)" SearchCursors (or one pass over the layer)
+class LayerParcelSource(object):
+	def lookup(self, county, apns, chunk_size=parcel_chunk_size, shapes=True, shape_cache=None):
+		if shape_cache is None:
+			shape_cache = {}
+		parcel_layer = parcel_layers[county]			# get the layer name of the parcel
+		clear_parcel_selection(county)
+		wanted = sorted(apns)
+		found = dict((apn,[]) for apn in wanted)
+		if len(wanted) > parcel_stream_threshold:
+			where_clauses = [None]						# one pass over every parcel in the layer
+		else:
+			where_clauses = ["APN IN ({0})".format(",".join(sql_quote(apn) for apn in chunk)) for chunk in chunked(wanted, chunk_size)]
+		for where_clause in where_clauses:
+			cursor_apn = arcpy.da.SearchCursor(parcel_layer,["APN","OID@","SHAPE@"] if shapes else ["APN","OID@"],where_clause)
+			for row in cursor_apn:
+				if row[0] in found:
+					found[row[0]].append(cached_parcel(shape_cache, county, row[1], row[2] if shapes else None))
+			del cursor_apn
+		return found
+
+	def close(self):
+		pass
+
+layer_parcel_source = LayerParcelSource()
+
+def resolve_parcels(apns_by_county, chunk_size=parcel_chunk_size, parcel_source=None, workers=0, crosswalk=None, shapes=True, shape_cache=None):
+	if shape_cache is None:
+		shape_cache = {}
+	if crosswalk is not None:
+		parcel_shapes = {}
+		unseen_by_county = {}
+		for county in sorted(apns_by_county):
+			with run_timer.phase("crosswalk lookup"):
+				(parcel_shapes[county], unseen) = crosswalk.lookup(county, apns_by_county[county], chunk_size, shapes, shape_cache)
+			if unseen:
+				unseen_by_county[county] = unseen
+		for (county, found) in resolve_parcels(unseen_by_county, chunk_size, parcel_source, workers, shapes=shapes, shape_cache=shape_cache).items():
+			parcel_shapes[county].update(found)
+		return parcel_shapes
+	if parcel_source is None and workers > 1 and len(apns_by_county) > 1:
+		with run_timer.phase("parcel search (worker processes)"):
+			return resolve_parcels_in_processes(apns_by_county, chunk_size, workers, shapes, shape_cache)
+	if parcel_source is None:
+		parcel_source = layer_parcel_source
+	parcel_shapes = {}
+	for county in sorted(apns_by_county):
+		with run_timer.phase("parcel search " + county_numbers[county]):
+			parcel_shapes[county] = parcel_source.lookup(county, apns_by_county[county], chunk_size, shapes, shape_cache)
+	return parcel_shapes
+
+#--------------------
+# parcel lookup in worker processes
+#
+#	with parcel_workers > 1, the counties of a batch are looked up at the same time, each county in
+#	a worker process reading the layer's data source (its catalogPath) directly
+#	the workers hand back (APN, OID, shape as WKB) rows sorted by APN and OID, along with the layer's
+#	spatial reference, and the shapes are rebuilt here, so the output is the same from run to run
+#	(note: a definition query set on a parcel layer in the map doesn't apply to its data source)
+
+parcel_pool = None							# the pool of worker processes, started on first use and kept for the run
+												# (then closed: ArcMap.exe keeps running, and the workers hold locks on the parcel data)
+
+def get_parcel_pool(workers):
+	global parcel_pool
+	if parcel_pool is None:
+		if not os.path.basename(sys.executable).lower().startswith("python"):
+			# inside ArcMap, sys.executable is ArcMap.exe; the workers need to be started with python itself
+			multiprocessing.set_executable(os.path.join(sys.exec_prefix,"pythonw.exe"))
+		parcel_pool = multiprocessing.Pool(workers)
+	return parcel_pool
+
+def close_parcel_pool():
+	global parcel_pool
+	if parcel_pool is not None:
+		parcel_pool.close()
+		parcel_pool.join()
+		parcel_pool = None
+
+atexit.register(close_parcel_pool)				# (in case a script importing this one doesn't)
+
+def spatial_ref_from_string(spatial_ref_string):
+	spatial_ref = arcpy.SpatialReference()
+	spatial_ref.loadFromString(spatial_ref_string)
+	return spatial_ref
+
+# runs in a worker process: look up the APN's of one county in its layer's data source
+#	task is (county#, data source path, [apn,...], chunk size, shapes)
+#	returns (county#, spatial reference string, [(apn, oid, wkb),...]), wkb is None if shapes is False
+def search_county_parcels(task):
+	(county, source, apns, chunk_size, shapes) = task
+	spatial_ref = arcpy.Describe(source).spatialReference.exportToString()
+	wanted = set(apns)
+	if len(apns) > parcel_stream_threshold:
+		where_clauses = [None]
+	else:
+		where_clauses = ["APN IN ({0})".format(",".join(sql_quote(apn) for apn in chunk)) for chunk in chunked(apns, chunk_size)]
+	rows = []
+	for where_clause in where_clauses:
+		if not shapes:
+			cursor_apn = arcpy.da.SearchCursor(source,["APN","OID@"],where_clause)
+			rows.extend((apn, oid, None) for (apn, oid) in cursor_apn if apn in wanted)
+			del cursor_apn
+			continue
+		cursor_apn = arcpy.da.SearchCursor(source,["APN","OID@","SHAPE@WKB"],where_clause)
+		for (apn, oid, wkb) in cursor_apn:
+			if apn in wanted and wkb:
+				rows.append((apn, oid, bytes(wkb)))
+		del cursor_apn
+	rows.sort()
+	return (county, spatial_ref, rows)
+
+def resolve_parcels_in_processes(apns_by_county, chunk_size, workers, shapes=True, shape_cache=None):
+	if shape_cache is None:
+		shape_cache = {}
+	tasks = []
+	for county in sorted(apns_by_county):
+		source = arcpy.Describe(parcel_layers[county]).catalogPath
+		tasks.append((county, source, sorted(apns_by_county[county]), chunk_size, shapes))
+	parcel_shapes = {}
+	for (county, spatial_ref_string, rows) in get_parcel_pool(workers).map(search_county_parcels, tasks, 1):
+		spatial_ref = spatial_ref_from_string(spatial_ref_string)
+		found = dict((apn,[]) for apn in apns_by_county[county])
+		for (apn, oid, wkb) in rows:
+			shape = None
+			if shapes:
+				shape = shape_cache.get((county, oid)) or arcpy.FromWKB(bytearray(wkb), spatial_ref)
+			found[apn].append(cached_parcel(shape_cache, county, oid, shape))
+		parcel_shapes[county] = found
+	return parcel_shapes
+
+#--------------------
+# persistent APN index of the parcel layers
+#
+#	the county parcel layers only change when a county delivers new data, so instead of searching
+#	them on every run, keep an index of APN -> (OID, shape as WKB) for each layer in a SQLite file
+#	next to mapByAPN.gdb
+#	a layer's index is (re)built whenever the layer's data source, stamp (see source_stamp) or row count
+#	no longer match what was recorded when it was built, or when asked to by rebuild()
+#	("mapbyparcel.py --rebuild-index [map.mxd]", e.g. after a county delivers new data)
+
+apn_index_name = "mapByAPN_index.sqlite"		# filename of the APN index, kept next to mapByAPN.gdb
+
+def apn_index_path(base_file):
+	return os.path.join(os.path.dirname(base_file),apn_index_name)
+
+# what tells that a layer's data source was edited, besides its row count: the newest modification time of
+# its own files (a shapefile's .shp, .dbf, ..., but not the .lock files every ArcMap session using it leaves),
+# or, for a feature class in a geodatabase, its extent (the files in the .gdb folder are shared by all its
+# feature classes, and the .lock files, so their times would change the stamp of every county at once)
+# (an edit that changes neither, like fixing an APN value in place, needs a --rebuild-index)
+def source_stamp(source_path):
+	if os.path.isfile(source_path):
+		(folder, file_name) = os.path.split(source_path)
+		own_prefix = os.path.splitext(file_name)[0].lower() + "."
+		own_files = [f for f in os.listdir(folder) if f.lower().startswith(own_prefix) and not f.lower().endswith(".lock")]
+		return "mtime {0}".format(max(os.path.getmtime(os.path.join(folder,f)) for f in own_files))
+	extent = arcpy.Describe(source_path).extent
+	return "extent {0:.6f} {1:.6f} {2:.6f} {3:.6f}".format(extent.XMin,extent.YMin,extent.XMax,extent.YMax)
+
+# catalog path of a county's parcel layer, in the current map or in the given arcpy.mapping.MapDocument
+# (None if it isn't in the map)
+def parcel_layer_source(county, map_document=None):
+	if map_document is None:
+		if not arcpy.Exists(parcel_layers[county]):
+			return None
+		return arcpy.Describe(parcel_layers[county]).catalogPath
+	for layer in arcpy.mapping.ListLayers(map_document):
+		if layer.longName == parcel_layers[county]:
+			return layer.dataSource
+	return None
+
+# (source, stamp, row count) of a parcel layer's data source, as it is right now (None for no source)
+def source_signature(source):
+	if source is None:
+		return None
+	row_count = int(arcpy.GetCount_management(source).getOutput(0))
+	return (source, source_stamp(source), row_count)
+
+# drop a table an older version made without the column (the index/crosswalk signatures had an mtime, not a stamp)
+# so it's made again; its layers then count as changed, and are rebuilt as usual
+def drop_outdated_table(db, table, column):
+	columns = [row[1] for row in db.execute("PRAGMA table_info({0})".format(table))]
+	if columns and column not in columns:
+		db.execute("DROP TABLE {0}".format(table))
+
+class APNIndex(object):
+	def __init__(self, index_path, map_document=None):
+		self.path = index_path
+		self.map_document = map_document		# the arcpy.mapping.MapDocument to find the parcel layers in (None: the current map)
+		self.db = sqlite3.connect(index_path)
+		drop_outdated_table(self.db, "layers", "stamp")
+		self.db.execute("CREATE TABLE IF NOT EXISTS layers (county INTEGER PRIMARY KEY, source TEXT, stamp TEXT, row_count INTEGER, spatial_ref TEXT, built TEXT)")
+		self.db.execute("CREATE TABLE IF NOT EXISTS parcels (county INTEGER, apn TEXT, oid INTEGER, wkb BLOB)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS parcels_apn ON parcels (county, apn)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS parcels_oid ON parcels (county, oid)")
+		self.db.commit()
+		self.spatial_refs = {}					# county# -> arcpy.SpatialReference of the layer
+		self.checked = set()					# counties already checked against their layer this run
+
+	# (source, stamp, row count) of a county's parcel layer, as it is right now (None if it isn't in the map)
+	def layer_signature(self, county):
+		return source_signature(parcel_layer_source(county, self.map_document))
+
+	def is_current(self, county, signature):
+		row = self.db.execute("SELECT source, stamp, row_count FROM layers WHERE county = ?", (county,)).fetchone()
+		return row is not None and tuple(row) == signature
+
+	# whether there's an index of the county at all
+	def has(self, county):
+		return self.db.execute("SELECT 1 FROM layers WHERE county = ?", (county,)).fetchone() is not None
+
+	# (re)build a county's index; returns False (and warns) if its parcel layer isn't in the map
+	def build(self, county, signature=None):
+		signature = signature or self.layer_signature(county)
+		if signature is None:
+			add_warning("{0} isn't in the map, its APN's aren't indexed".format(parcel_layers[county]))
+			return False
+		(source, stamp, row_count) = signature
+		add_message("indexing APN's of {0}".format(parcel_layers[county]))
+		spatial_ref = arcpy.Describe(source).spatialReference.exportToString()
+		self.db.execute("DELETE FROM parcels WHERE county = ?", (county,))
+		cursor_apn = arcpy.da.SearchCursor(source,["OID@","APN","SHAPE@WKB"])
+		batch = []
+		for (oid, apn, wkb) in cursor_apn:
+			if apn and wkb:
+				batch.append((county, apn, oid, sqlite3.Binary(bytes(wkb))))
+			if len(batch) >= 10000:
+				self.db.executemany("INSERT INTO parcels VALUES (?,?,?,?)", batch)
+				batch = []
+		del cursor_apn
+		self.db.executemany("INSERT INTO parcels VALUES (?,?,?,?)", batch)
+		self.db.execute("INSERT OR REPLACE INTO layers VALUES (?,?,?,?,?,?)", (county, source, stamp, row_count, spatial_ref, datetime.datetime.now().isoformat()))
+		self.db.commit()
+		self.spatial_refs.pop(county, None)
+		self.checked.add(county)
+		return True
+
+	# make sure a county's index matches its layer, (re)building it if not; returns whether the county has an index
+	# (a county whose layer isn't in the map keeps the index it has, if any)
+	def ensure(self, county):
+		if county not in self.checked:
+			self.checked.add(county)
+			signature = self.layer_signature(county)
+			if signature is None:
+				add_warning("{0} isn't in the map, {1}".format(parcel_layers[county],"its APN index is used as it is" if self.has(county) else "no parcels found in it"))
+			elif not self.is_current(county, signature):
+				self.build(county, signature)
+		return self.has(county)
+
+	def rebuild(self, counties=None):
+		for county in sorted(counties or parcel_layers):
+			self.build(county)
+
+	def spatial_ref(self, county):
+		if county not in self.spatial_refs:
+			row = self.db.execute("SELECT spatial_ref FROM layers WHERE county = ?", (county,)).fetchone()
+			self.spatial_refs[county] = spatial_ref_from_string(row[0])
+		return self.spatial_refs[county]
+
+	# which of a list of APN's the county's index has
+	def contains(self, county, apns, chunk_size=parcel_chunk_size):
+		present = set()
+		if not self.ensure(county):
+			return present
+		for chunk in chunked(sorted(apns), chunk_size):
+			sql = "SELECT DISTINCT apn FROM parcels WHERE county = ? AND apn IN ({0})".format(",".join(["?"] * len(chunk)))
+			present.update(row[0] for row in self.db.execute(sql, [county] + chunk))
+		return present
+
+	# look up a list of APN's in a county: { apn : [(oid, shape),...] } with an entry for every APN asked for
+	# (only the shapes not in the run's shape_cache are read; none at all if shapes is False)
+	def lookup(self, county, apns, chunk_size=parcel_chunk_size, shapes=True, shape_cache=None):
+		if shape_cache is None:
+			shape_cache = {}
+		found = dict((apn,[]) for apn in apns)
+		if not self.ensure(county):
+			return found
+		for chunk in chunked(sorted(found), chunk_size):
+			sql = "SELECT apn, oid FROM parcels WHERE county = ? AND apn IN ({0}) ORDER BY oid".format(",".join(["?"] * len(chunk)))
+			for (apn, oid) in self.db.execute(sql, [county] + chunk):
+				found[apn].append(oid)
+		if shapes:
+			spatial_ref = self.spatial_ref(county)
+			unread = sorted(set(oid for oids in found.values() for oid in oids if (county, oid) not in shape_cache))
+			for chunk in chunked(unread, chunk_size):
+				sql = "SELECT oid, wkb FROM parcels WHERE county = ? AND oid IN ({0})".format(",".join(["?"] * len(chunk)))
+				for (oid, wkb) in self.db.execute(sql, [county] + chunk):
+					shape_cache[(county, oid)] = arcpy.FromWKB(bytearray(wkb), spatial_ref)
+		for apn in found:
+			found[apn] = [(oid, shape_cache.get((county, oid)) if shapes else None) for oid in found[apn]]
+		return found
+
+	def close(self):
+		self.db.close()
+
+# open the APN index that sits next to the output geodatabase, rebuilding it first if asked to
+def open_apn_index(base_file):
+	apn_index = APNIndex(apn_index_path(base_file))
+	if run_options["rebuild_apn_index"]:
+		apn_index.rebuild()
+	return apn_index
+
+# rebuild the APN index of every parcel layer of the map document (or, None, the current map), in the folder
+# of mapByAPN.gdb (or of a saved selections file in it) ("mapbyparcel.py --rebuild-index [map.mxd] [folder...]")
+def rebuild_apn_index(path, map_document=None):
+	if not os.path.isdir(path):
+		path = os.path.dirname(os.path.abspath(path))
+	if map_document is not None:
+		map_document = arcpy.mapping.MapDocument(map_document)
+	apn_index = APNIndex(os.path.join(path,apn_index_name), map_document)
+	apn_index.rebuild()
+	apn_index.close()
+	add_message("APN index rebuilt: {0}".format(apn_index.path))
+
+#--------------------
+# GeoPackage parcel source
+#
+#	for headless runs (a batch host without ArcGIS), the county parcel layers can be exported to a GeoPackage,
+#	one feature table per county named like its layer (SON_APN, ...), each with an APN text column
+#	with parcel_source = <the .gpkg>, the APN's are looked up there with plain sqlite3, through a B-tree
+#	index on APN (created the first time a table is used, if it hasn't one already)
+#	the shapes handed back are arcpy geometries, or, with wkb set (output_format = "gpkg", so arcpy isn't
+#	needed at all), the GeoPackage geometry blobs as stored, which the GeoPackageOutputWriter copies as is
+#	(a SpatiaLite database's geometry blobs aren't WKB, so it needs to be exported to a GeoPackage first)
+
+gpkg_envelope_sizes = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}	# bytes of envelope after a geometry blob's 8 byte header, by its envelope indicator
+gpkg_srs_definitions = {}				# srs_id -> gpkg_spatial_ref_sys row of the GeoPackage parcel sources opened, for the output
+
+# the WKB of a GeoPackage geometry blob (its header and envelope stripped)
+def gpkg_blob_wkb(blob):
+	flags = bytearray(blob[3:4])[0]
+	return bytes(blob[8 + gpkg_envelope_sizes[(flags >> 1) & 7]:])
+
+def gpkg_blob_srs_id(blob):
+	flags = bytearray(blob[3:4])[0]
+	return struct.unpack("<i" if flags & 1 else ">i", bytes(blob[4:8]))[0]
+
+# a GeoPackage geometry blob (little endian header, no envelope) of WKB in the srs_id spatial reference system
+def gpkg_blob(wkb, srs_id):
+	return b"GP\x00\x01" + struct.pack("<i", srs_id) + bytes(wkb)
+
+def gpkg_name(name):
+	return '"{0}"'.format(name.replace('"','""'))
+
+class GeoPackageParcelSource(object):
+	def __init__(self, gpkg_path, wkb=False):
+		self.path = gpkg_path
+		self.wkb = wkb
+		self.db = sqlite3.connect(gpkg_path)
+		geometry_columns = dict((row[0].lower(), row) for row in self.db.execute("SELECT table_name, column_name, srs_id FROM gpkg_geometry_columns"))
+		self.tables = {}						# county# -> (table, geometry column, fid column, srs_id)
+		for (county, parcel_layer) in parcel_layers.items():
+			row = geometry_columns.get(parcel_layer.split("\\")[-1].lower())
+			if row is None:
+				continue
+			fid_column = [column[1] for column in self.db.execute("PRAGMA table_info({0})".format(gpkg_name(row[0]))) if column[5]][0]
+			self.tables[county] = (row[0], row[1], fid_column, row[2])
+		for row in self.db.execute("SELECT srs_id, srs_name, organization, organization_coordsys_id, definition FROM gpkg_spatial_ref_sys"):
+			gpkg_srs_definitions.setdefault(row[0], row)
+		self.checked = set()					# counties whose APN index has been checked for this run
+		self.spatial_refs = {}					# county# -> arcpy.SpatialReference of the table
+
+	# the county's table, with an index on APN; None (and a warning, once) if the GeoPackage has no table for it
+	def table(self, county):
+		if county not in self.checked:
+			self.checked.add(county)
+			if county not in self.tables:
+				add_warning("{0} has no {1} table, no parcels found in {2} county".format(self.path,parcel_layers[county].split("\\")[-1],county_numbers[county]))
+				return None
+			table = self.tables[county][0]
+			indexed = False
+			for index in self.db.execute("PRAGMA index_list({0})".format(gpkg_name(table))).fetchall():
+				first_column = self.db.execute("PRAGMA index_info({0})".format(gpkg_name(index[1]))).fetchone()
+				indexed = indexed or (first_column is not None and first_column[2].lower() == "apn")
+			if not indexed:
+				add_message("indexing APN's of {0} in {1}".format(table,self.path))
+				self.db.execute("CREATE INDEX {0} ON {1} (APN)".format(gpkg_name(table + "_apn"),gpkg_name(table)))
+				self.db.commit()
+		return self.tables.get(county)
+
+	def spatial_ref(self, county):
+		if county not in self.spatial_refs:
+			(srs_id, srs_name, organization, coordsys_id, definition) = gpkg_srs_definitions[self.tables[county][3]]
+			if organization.upper() in ("EPSG","ESRI"):
+				self.spatial_refs[county] = arcpy.SpatialReference(int(coordsys_id))
+			else:
+				self.spatial_refs[county] = spatial_ref_from_string(definition)
+		return self.spatial_refs[county]
+
+	# which of a list of APN's the county's table has
+	def contains(self, county, apns, chunk_size=parcel_chunk_size):
+		present = set()
+		table = self.table(county)
+		if table is None:
+			return present
+		for chunk in chunked(sorted(apns), chunk_size):
+			sql = "SELECT DISTINCT APN FROM {0} WHERE APN IN ({1})".format(gpkg_name(table[0]),",".join(["?"] * len(chunk)))
+			present.update(row[0] for row in self.db.execute(sql, chunk))
+		return present
+
+	# look up a list of APN's in a county: { apn : [(oid, shape),...] } with an entry for every APN asked for
+	# (only the shapes not in the run's shape_cache are read; none at all if shapes is False)
+	def lookup(self, county, apns, chunk_size=parcel_chunk_size, shapes=True, shape_cache=None):
+		if shape_cache is None:
+			shape_cache = {}
+		found = dict((apn,[]) for apn in apns)
+		table = self.table(county)
+		if table is None:
+			return found
+		(table_name, geometry_column, fid_column, srs_id) = table
+		for chunk in chunked(sorted(found), chunk_size):
+			sql = "SELECT APN, {0} FROM {1} WHERE APN IN ({2}) AND {3} IS NOT NULL ORDER BY {0}".format(gpkg_name(fid_column),gpkg_name(table_name),",".join(["?"] * len(chunk)),gpkg_name(geometry_column))
+			for (apn, oid) in self.db.execute(sql, chunk):
+				found[apn].append(oid)
+		if shapes:
+			unread = sorted(set(oid for oids in found.values() for oid in oids if (county, oid) not in shape_cache))
+			for chunk in chunked(unread, chunk_size):
+				sql = "SELECT {0}, {1} FROM {2} WHERE {0} IN ({3})".format(gpkg_name(fid_column),gpkg_name(geometry_column),gpkg_name(table_name),",".join(["?"] * len(chunk)))
+				for (oid, blob) in self.db.execute(sql, chunk):
+					if self.wkb:
+						shape_cache[(county, oid)] = bytes(blob)
+					else:
+						shape_cache[(county, oid)] = arcpy.FromWKB(bytearray(gpkg_blob_wkb(blob)), self.spatial_ref(county))
+		for apn in found:
+			found[apn] = [(oid, shape_cache.get((county, oid)) if shapes else None) for oid in found[apn]]
+		return found
+
+	def close(self):
+		self.db.close()
+
+# open the parcel_source GeoPackage; its shapes are left as geometry blobs when the output is a GeoPackage too
+def open_parcel_source(gpkg_path):
+	return GeoPackageParcelSource(gpkg_path, run_options["output_format"] == "gpkg")
+
+#--------------------
+# ICDB-to-parcel crosswalk
+#
+#	build_crosswalk() (run as "mapbyparcel.py --build-crosswalk [map.mxd]", e.g. nightly) joins the APN's of
+#	every non-voided report and resource in the ICDB against the parcel layers once, and stores for each
+#	record the (county#, APN, parcel OID) it maps to, with a status of 'match', 'miss' (not in the layer) or
+#	'malformed' (doesn't fit the county's pattern, not searched for)
+#	with use_crosswalk set, a run looks its APN's up in the crosswalk and reads only the matched parcels from
+#	the layers, by OID; APN's the crosswalk hasn't seen, and the counties whose layer changed since it was
+#	built, are searched for as usual
+#	report_unmapped_apns() ("mapbyparcel.py --unmapped <saved selections file>...") lists the APN's of a
+#	saved selection that don't map to a parcel, from the crosswalk alone
+
+crosswalk_name = "mapByAPN_crosswalk.sqlite"	# filename of the crosswalk, kept in the user's profile folder unless crosswalk_path is set
+
+def crosswalk_path():
+	return run_options["crosswalk_path"] or os.path.join(os.path.expanduser("~"),crosswalk_name)
+
+class Crosswalk(object):
+	def __init__(self, path):
+		self.path = path
+		self.db = sqlite3.connect(path)
+		drop_outdated_table(self.db, "layers", "stamp")
+		self.db.execute("CREATE TABLE IF NOT EXISTS layers (county INTEGER PRIMARY KEY, source TEXT, stamp TEXT, row_count INTEGER, oid_field TEXT, built TEXT)")
+		self.db.execute("CREATE TABLE IF NOT EXISTS records (kind TEXT, record TEXT, county INTEGER, apn TEXT, oid INTEGER, status TEXT)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS records_record ON records (kind, record)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS records_apn ON records (county, apn)")
+		self.db.commit()
+		self.oid_fields = {}					# county# -> OID field name if the county's layer is unchanged since the build, or None
+
+	def is_current(self, county):
+		if county not in self.oid_fields:
+			row = self.db.execute("SELECT source, stamp, row_count, oid_field FROM layers WHERE county = ?", (county,)).fetchone()
+			self.oid_fields[county] = None
+			if row is not None and tuple(row[:3]) == source_signature(parcel_layer_source(county)):		# (a layer not in the map is searched for, as usual)
+				self.oid_fields[county] = row[3]
+		return self.oid_fields[county] is not None
+
+	# look up a county's APN's: returns ({ apn : [(oid, shape),...] } for the APN's the crosswalk has, set of the APN's it hasn't)
+	# (only the shapes not in the run's shape_cache are read from the layer, by OID; none at all if shapes is False)
+	def lookup(self, county, apns, chunk_size=parcel_chunk_size, shapes=True, shape_cache=None):
+		if not self.is_current(county):
+			return ({}, set(apns))
+		if shape_cache is None:
+			shape_cache = {}
+		found = {}
+		for chunk in chunked(sorted(apns), chunk_size):
+			sql = "SELECT DISTINCT apn, oid FROM records WHERE county = ? AND status != 'malformed' AND apn IN ({0})".format(",".join(["?"] * len(chunk)))
+			for (apn, oid) in self.db.execute(sql, [county] + chunk):
+				found.setdefault(apn, [])
+				if oid is not None:
+					found[apn].append(oid)
+		unread = sorted(set(oid for oids in found.values() for oid in oids if (county, oid) not in shape_cache))
+		if shapes and unread:
+			clear_parcel_selection(county)
+			for chunk in chunked(unread, chunk_size):
+				where_clause = "{0} IN ({1})".format(self.oid_fields[county], ",".join(str(oid) for oid in chunk))
+				cursor_oid = arcpy.da.SearchCursor(parcel_layers[county],["OID@","SHAPE@"],where_clause)
+				for (oid, shape) in cursor_oid:
+					shape_cache[(county, oid)] = shape
+				del cursor_oid
+		for apn in found:
+			if shapes:
+				found[apn] = [(oid, shape_cache[(county, oid)]) for oid in sorted(found[apn]) if (county, oid) in shape_cache]
+			else:
+				found[apn] = [(oid, None) for oid in sorted(found[apn])]
+		return (found, set(apns) - set(found))
+
+	def close(self):
+		self.db.close()
+
+# join every non-voided ICDB record's APN's against the parcel layers into a new crosswalk
+#	map_document is the .mxd to find the parcel layers in when not run inside ArcMap
+def build_crosswalk(path, map_document=None, batch_size=None):
+	if map_document is not None:
+		map_document = arcpy.mapping.MapDocument(map_document)
+	building_path = path + ".building"
+	if os.path.exists(building_path):
+		os.remove(building_path)
+	crosswalk = Crosswalk(building_path)
+	session = icdb_session()
+
+	#----
+	# the planned searches of every record, to be resolved a county at a time
+	record_sets = (
+		(sheet_saved_reports, [row['DocNo'] for row in session.query("Select DocNo from tblInventory")], load_report_bundles, run_options["route_report_apns"], report_record),
+		(sheet_saved_resources, [(row['PrimCo'],row['PrimNo']) for row in session.query("Select PrimCo, PrimNo from tblResource")], load_resource_bundles, False, lambda key: resource_record(*key))
+	)
+	for (kind, keys, load_bundles, route, key_record) in record_sets:
+		add_message("loading the APN's of {0} {1} records".format(len(keys),kind))
+		for batch in chunked(keys, batch_size or run_options["record_batch_size"]):
+			bundles = load_bundles(session, batch)
+			normalize_bundle_apns(bundles)
+			plan_apn_searches(bundles, False, route)
+			rows = []
+			for (key, bundle) in bundles.items():
+				if bundle['parent'] is None or bundle['parent']['Voided']:
+					continue
+				record = key_record(key)
+				rows.extend((kind, record, county, apn, None, 'pending') for (county, apn) in bundle['searches'])
+				rows.extend((kind, record, county, apn, None, 'malformed') for (county, apn) in bundle['malformed'])
+			crosswalk.db.executemany("INSERT INTO records VALUES (?,?,?,?,?,?)", rows)
+		crosswalk.db.commit()
+
+	#----
+	# match them against each county's parcel layer, reading just the APN's and OID's
+	for county in sorted(parcel_layers):
+		source = parcel_layer_source(county, map_document)
+		if source is None:
+			add_warning("{0} isn't in the map, its APN's are left out of the crosswalk".format(parcel_layers[county]))
+			continue
+		add_message("matching the APN's of {0}".format(parcel_layers[county]))
+		crosswalk.db.execute("CREATE TEMP TABLE parcels (apn TEXT, oid INTEGER)")
+		cursor_apn = arcpy.da.SearchCursor(source,["APN","OID@"])
+		for rows in chunked((row for row in cursor_apn if row[0]), 10000):
+			crosswalk.db.executemany("INSERT INTO parcels VALUES (?,?)", rows)
+		del cursor_apn
+		crosswalk.db.execute("CREATE INDEX parcels_apn ON parcels (apn)")
+		crosswalk.db.execute("INSERT INTO records SELECT r.kind, r.record, r.county, r.apn, p.oid, 'match' FROM records r JOIN parcels p ON p.apn = r.apn WHERE r.county = ? AND r.status = 'pending'", (county,))
+		crosswalk.db.execute("DELETE FROM records WHERE county = ? AND status = 'pending' AND apn IN (SELECT apn FROM parcels)", (county,))
+		crosswalk.db.execute("UPDATE records SET status = 'miss' WHERE county = ? AND status = 'pending'", (county,))
+		crosswalk.db.execute("DROP TABLE parcels")
+		(source, stamp, row_count) = source_signature(source)
+		crosswalk.db.execute("INSERT INTO layers VALUES (?,?,?,?,?,?)", (county, source, stamp, row_count, arcpy.Describe(source).OIDFieldName, datetime.datetime.now().isoformat()))
+		crosswalk.db.commit()
+	crosswalk.db.execute("DELETE FROM records WHERE status = 'pending'")	# of counties not in the map
+	crosswalk.db.commit()
+	for (status, count) in crosswalk.db.execute("SELECT status, COUNT(*) FROM records GROUP BY status ORDER BY status"):
+		add_message("{0} {1} rows".format(count,status))
+	crosswalk.close()
+
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(building_path, path)
+
+def open_crosswalk():
+	path = crosswalk_path()
+	if not os.path.exists(path):
+		add_warning("no crosswalk at {0}, searching the parcel layers".format(path))
+		return None
+	return Crosswalk(path)
+
+# list the APN's of a saved selection that don't map to a parcel ('miss' or 'malformed' in the crosswalk)
+# to <selection>_unmapped_APN.csv; returns the number of records with unmapped APN's
+def report_unmapped_apns(saved_selection_file, chunk_size=icdb_chunk_size):
+	(kind, keys) = read_saved_selection(saved_selection_file)
+	if kind is None:
+		add_error("{0}: {1}".format(saved_selection_file,keys))
+		return None
+	if kind == sheet_saved_reports:
+		records = [report_record(key) for key in keys]
+	else:
+		records = [resource_record(*key) for key in keys]
+	crosswalk = Crosswalk(crosswalk_path())
+	rows = []
+	for chunk in chunked(records, chunk_size):
+		sql = "SELECT record, county, apn, status FROM records WHERE kind = ? AND status != 'match' AND record IN ({0})".format(",".join(["?"] * len(chunk)))
+		rows.extend(crosswalk.db.execute(sql, [kind] + chunk))
+	crosswalk.close()
+	rows = sorted(set((record, county_numbers[county], apn, status) for (record, county, apn, status) in rows))
+	count = len(set(row[0] for row in rows))
+	if rows:
+		add_message("{0}: {1} of {2} records have unmapped APN's, listed in {3}".format(saved_selection_file,count,len(records),write_csv_report(saved_selection_file,"unmapped_APN",("Record","County","APN","Status"),rows)))
+	else:
+		add_message("{0}: all APN's of its {1} records map to a parcel".format(saved_selection_file,len(records)))
+	return count
+
+#--------------------
+# run journal
+#
+#	a small SQLite database (mapByAPN_journal.sqlite) next to mapByAPN.gdb, recording for each saved
+#	selections file the feature class its run writes to, and every S-#/P-# whose output rows are committed
+#	a rerun on the same, unchanged, saved selections file after a run that didn't finish (ArcMap crashed,
+#	the ICDB connection dropped, ...) appends to that run's feature class and skips the records already done;
+#	rows of a record left half-written by the crash are deleted first
+#	the output options (layout, format, dissolve) are journaled with the feature class, and a rerun with other
+#	options starts a new feature class instead (its writer couldn't append to the old one)
+#	with each batch's records, the run's counts so far and the malformed APN's of the batch are journaled too,
+#	so a resumed run's summary, run report and malformed APN report cover the whole saved selection
+#	once a run finishes, the next run on the file starts a new feature class, as usual
+
+run_journal_name = "mapByAPN_journal.sqlite"	# filename of the run journal, kept next to mapByAPN.gdb
+
+def report_record(s_no):
+	return "S-{0:06}".format(s_no)
+
+def resource_record(p_co, p_no):
+	return "P-{0:02}-{1:06}".format(p_co,p_no)
+
+class RunJournal(object):
+	def __init__(self, journal_path, saved_selection_file):
+		self.path = journal_path
+		self.db = sqlite3.connect(journal_path)
+		drop_outdated_table(self.db, "runs", "options")		# (journaled before the output options were)
+		self.db.execute("CREATE TABLE IF NOT EXISTS runs (selection TEXT PRIMARY KEY, signature TEXT, kind TEXT, feature_class TEXT, options TEXT, started TEXT, finished INTEGER)")
+		self.db.execute("CREATE TABLE IF NOT EXISTS done (selection TEXT, record TEXT, PRIMARY KEY (selection, record))")
+		self.db.execute("CREATE TABLE IF NOT EXISTS counts (selection TEXT PRIMARY KEY, counts TEXT)")
+		self.db.execute("CREATE TABLE IF NOT EXISTS malformed (selection TEXT, record TEXT, county INTEGER, apn_icdb TEXT, apn TEXT)")
+		self.db.commit()
+		self.selection = os.path.normcase(os.path.abspath(saved_selection_file))
+		self.signature = "{0}:{1}".format(os.path.getmtime(saved_selection_file),os.path.getsize(saved_selection_file))
+
+	# the feature class of an unfinished run of the same kind on the unchanged file, written with the same output
+	# options (see output_options()), or None
+	def unfinished_output(self, kind, options):
+		row = self.db.execute("SELECT signature, kind, feature_class, options FROM runs WHERE selection = ? AND finished = 0", (self.selection,)).fetchone()
+		if row is None or row[0] != self.signature or row[1] != kind or not output_exists(row[2]):
+			return None
+		if row[3] != options:
+			add_warning("not resuming the unfinished run into {0}: it was written as ({1}), this run writes ({2})".format(row[2],row[3],options))
+			return None
+		return row[2]
+
+	def start(self, kind, feature_class, options):
+		self.clear()
+		self.db.execute("INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,0)", (self.selection, self.signature, kind, feature_class, options, datetime.datetime.now().isoformat()))
+		self.db.commit()
+
+	def done_records(self):
+		return set(row[0] for row in self.db.execute("SELECT record FROM done WHERE selection = ?", (self.selection,)))
+
+	# record S-#/P-#'s as done, along with the run's counts so far, its county match rates, and the malformed
+	# APN's (record, county, APN in ICDB, canonical APN) of these records; only call once their rows are committed
+	def mark_done(self, records, counts=None, county_matches=None, malformed_apns=()):
+		self.db.executemany("INSERT OR IGNORE INTO done VALUES (?,?)", [(self.selection, record) for record in records])
+		if counts is not None:
+			run_counts = {'counts': counts, 'county_matches': sorted((county, searched, found) for (county, (searched, found)) in (county_matches or {}).items())}
+			self.db.execute("INSERT OR REPLACE INTO counts VALUES (?,?)", (self.selection, json.dumps(run_counts)))
+		self.db.executemany("INSERT INTO malformed VALUES (?,?,?,?,?)", [(self.selection,) + tuple(row) for row in malformed_apns])
+		self.db.commit()
+
+	# what the unfinished run had journaled: (counts, county matches, malformed APN's), see mark_done()
+	def resumed_counts(self):
+		row = self.db.execute("SELECT counts FROM counts WHERE selection = ?", (self.selection,)).fetchone()
+		run_counts = json.loads(row[0]) if row is not None else {'counts': {}, 'county_matches': []}
+		county_matches = dict((county, [searched, found]) for (county, searched, found) in run_counts['county_matches'])
+		malformed_apns = [tuple(row) for row in self.db.execute("SELECT record, county, apn_icdb, apn FROM malformed WHERE selection = ? ORDER BY rowid", (self.selection,))]
+		return (run_counts['counts'], county_matches, malformed_apns)
+
+	def finish(self):
+		self.db.execute("UPDATE runs SET finished = 1 WHERE selection = ?", (self.selection,))
+		self.clear()
+		self.db.commit()
+
+	def clear(self):
+		for table in ("done","counts","malformed"):
+			self.db.execute("DELETE FROM {0} WHERE selection = ?".format(table), (self.selection,))
+
+	def close(self):
+		self.db.close()
+
+def open_run_journal(base_file):
+	return RunJournal(os.path.join(os.path.dirname(base_file),run_journal_name),base_file)
+
+# delete the rows of a resumed feature class whose record isn't journaled as done
+#	record_of maps a row's key field values to its S-#/P-#; returns the number of rows deleted
+def drop_unjournaled_rows(feature_class, key_fields, record_of, done):
+	if gpkg_output_table(feature_class) is not None:
+		return drop_unjournaled_gpkg_rows(feature_class, key_fields, record_of, done)
+	count = 0
+	cursor_out = arcpy.da.UpdateCursor(feature_class, key_fields)
+	for row in cursor_out:
+		if None in row or record_of(*row) not in done:
+			cursor_out.deleteRow()
+			count += 1
+	del cursor_out
+	return count
+
+# start the run's output: resume the feature class of the saved selection's unfinished run, if there is one
+# and it was written with the same output options, or else create a new one
+#	returns (feature class, set of records already done); the feature class is None if it couldn't be created
+def start_run_output(saved_selection_file, kind, out_template, key_fields, record_of, journal, linked, options):
+	if journal is not None:
+		feature_class = journal.unfinished_output(kind, options)
+		if feature_class is not None:
+			done = journal.done_records()
+			dropped = drop_unjournaled_rows(feature_class, key_fields, record_of, done)
+			add_message("resuming the unfinished run into {0}: {1} records already done".format(feature_class,len(done)))
+			if dropped:
+				add_message("     {0} rows of unfinished records deleted".format(dropped))
+			return (feature_class, done)
+	(success, feature_class) = create_output_feature(saved_selection_file,out_template,linked)
+	if not success:
+		add_error(feature_class)
+		return (None, set())
+	if journal is not None:
+		journal.start(kind, feature_class, options)
+	return (feature_class, set())
+
+# the output options a run's feature class is written with: its layout, format, and whether its records are
+# dissolved; a run is only resumed into a feature class written with the same (the writer depends on them)
+def output_options(linked=False, gpkg=False, dissolve=False):
+	return "{0}, {1}{2}".format("linked" if linked else "flat","gpkg" if gpkg else "gdb",", dissolved" if dissolve else "")
+
+#--------------------
+# output writer
+#
+#	opens one arcpy.da.InsertCursor, with a fixed tuple of fields, on the output feature class for the
+#	whole run (was a legacy arcpy.InsertCursor per record, filled in one setValue at a time)
+#	rows are handed over as { field : value } dictionaries; fields not given are left Null
+#	if stage_in_memory is set, rows go to an in_memory copy of the feature class first, and are
+#	appended to the mapByAPN.gdb feature class in one go when the writer is closed
+#	flush() commits the rows inserted so far (the cursor is closed and a new one opened); with staging, that
+#	appends them to mapByAPN.gdb too, so a journaled run (journal_runs, flushed every batch) copies once a batch
+#	and only a run with journal_runs off copies them just once, at the end
+#	insert() is also handed the (county#, apn, oid) of the row's parcel, which only the LinkedOutputWriter uses
+
+# the Reports and Resources (polygons) layers the output is made like, and their fields that get filled in
+report_template = r"MAIN\Reports\Reports (polygons)"
+resource_template = r"MAIN\Resources\Resources (polygons)"
+report_fields = ("SHAPE@","DocCo","DocNo","OtherID","DocSource","DigSource","DigBy","DigDate","DigOrg","Notes")
+resource_fields = ("SHAPE@","PrimCo","PrimNo","TrinNo","OtherID","DocSource","DigSource","DigBy","DigDate","DigOrg","Notes")
+template_fields = {report_template: report_fields, resource_template: resource_fields}
+
+class OutputWriter(object):
+	def __init__(self, feature_class, fields, stage_in_memory=False):
+		self.feature_class = feature_class
+		self.fields = tuple(fields)
+		self.staging = None
+		if stage_in_memory:
+			staging_name = os.path.basename(feature_class)
+			arcpy_result = arcpy.CreateFeatureclass_management("in_memory",staging_name,"POLYGON",feature_class,"SAME_AS_TEMPLATE","SAME_AS_TEMPLATE",feature_class)
+			self.staging = arcpy_result.getOutput(0)
+		self.cursor = arcpy.da.InsertCursor(self.staging or feature_class, self.fields)
+		self.count = 0
+
+	def insert(self, values, parcel=None):
+		self.cursor.insertRow(tuple(values.get(field) for field in self.fields))
+		self.count += 1
+
+	def flush(self):
+		del self.cursor
+		self.cursor = None
+		if self.staging:
+			arcpy.Append_management(self.staging,self.feature_class,"NO_TEST")
+			arcpy.DeleteRows_management(self.staging)
+		self.cursor = arcpy.da.InsertCursor(self.staging or self.feature_class, self.fields)
+
+	def close(self):
+		if self.cursor is None:
+			return
+		del self.cursor											# remove/close the InsertCursor
+		self.cursor = None
+		if self.staging:
+			arcpy.Append_management(self.staging,self.feature_class,"NO_TEST")
+			arcpy.Delete_management(self.staging)
+
+#-----
+# GeoPackage output
+#	with output_format = "gpkg", the output is a <name>_APN_<n> feature table in mapByAPN.gpkg (created the
+#	first time) next to the saved selections file, written with plain sqlite3, so that a run on a GeoPackage
+#	parcel source needs no arcpy at all; its columns are the template's fields, and it takes the spatial
+#	reference of the first shape written
+#	the output "feature class" is then named <folder>\mapByAPN.gpkg\<table>, like <folder>\mapByAPN.gdb\<feature class>
+
+map_by_APN_gpkg = "mapByAPN.gpkg"				# filename of the GeoPackage to create/use for output, with output_format = "gpkg"
+
+gpkg_column_types = {"DocCo": "MEDIUMINT", "DocNo": "MEDIUMINT", "PrimCo": "MEDIUMINT", "PrimNo": "MEDIUMINT", "TrinNo": "MEDIUMINT", "DigDate": "DATE"}	# the rest are TEXT
+
+gpkg_core_tables = (
+	"CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)",
+	"CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER)",
+	"CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name))"
+)
+gpkg_required_srs = (
+	("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+	("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+	("WGS 84", 4326, "EPSG", 4326, 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]', None)
+)
+
+# (GeoPackage path, table) of an output in a GeoPackage, or None
+def gpkg_output_table(feature_class):
+	(gpkg_path, table) = os.path.split(feature_class)
+	if os.path.splitext(gpkg_path)[1].lower() != ".gpkg":
+		return None
+	return (gpkg_path, table)
+
+def output_exists(feature_class):
+	gpkg_table = gpkg_output_table(feature_class)
+	if gpkg_table is None:
+		return arcpy.Exists(feature_class)
+	if not os.path.exists(gpkg_table[0]):
+		return False
+	db = sqlite3.connect(gpkg_table[0])
+	exists = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (gpkg_table[1],)).fetchone() is not None
+	db.close()
+	return exists
+
+# create the next <name>_APN_<n> feature table in mapByAPN.gpkg, with a column for each of the fields
+# (SHAPE@ is its geometry); returns (True, feature class) like create_output_feature
+def create_gpkg_output(source_dir, new_basename, fields):
+	gpkg_path = os.path.join(source_dir,map_by_APN_gpkg)
+	if not os.path.exists(gpkg_path):
+		add_message("creating GeoPackage for Map_by_APN outputs: {0}".format(gpkg_path))
+	db = sqlite3.connect(gpkg_path)
+	if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'gpkg_contents'").fetchone() is None:
+		db.execute("PRAGMA application_id = 1196444487")			# 'GPKG'
+		db.execute("PRAGMA user_version = 10200")
+		for sql in gpkg_core_tables:
+			db.execute(sql)
+		db.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)", gpkg_required_srs)
+	seq = 1
+	while output_exists(os.path.join(gpkg_path,new_basename + "_APN_{0}".format(seq))):
+		seq += 1
+	table = new_basename + "_APN_{0}".format(seq)
+	columns = ["fid INTEGER PRIMARY KEY AUTOINCREMENT", "shape GEOMETRY"]
+	columns.extend("{0} {1}".format(field, gpkg_column_types.get(field, "TEXT")) for field in fields if field != "SHAPE@")
+	db.execute("CREATE TABLE {0} ({1})".format(gpkg_name(table),", ".join(columns)))
+	db.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?,'features',?,0)", (table, table))
+	db.execute("INSERT INTO gpkg_geometry_columns VALUES (?,'shape','GEOMETRY',0,0,0)", (table,))
+	db.commit()
+	db.close()
+	return (True, os.path.join(gpkg_path,table))
+
+# the DigDate of a row, as a GeoPackage DATE
+def gpkg_value(value):
+	if isinstance(value, datetime.datetime):
+		return value.strftime("%Y-%m-%d")
+	return value
+
+class GeoPackageOutputWriter(object):
+	def __init__(self, feature_class, fields):
+		self.feature_class = feature_class
+		(self.path, self.table) = gpkg_output_table(feature_class)
+		self.fields = tuple(field for field in fields if field != "SHAPE@")
+		self.db = sqlite3.connect(self.path)
+		self.srs_id = self.db.execute("SELECT srs_id FROM gpkg_geometry_columns WHERE table_name = ?", (self.table,)).fetchone()[0]
+		self.sql = "INSERT INTO {0} (shape, {1}) VALUES ({2})".format(gpkg_name(self.table),", ".join(self.fields),",".join(["?"] * (len(self.fields) + 1)))
+		self.rows = []
+		self.count = 0
+
+	# set the table's spatial reference (0, undefined, until the first shape is written)
+	def set_srs(self, srs_id, srs_row):
+		if self.db.execute("SELECT 1 FROM gpkg_spatial_ref_sys WHERE srs_id = ?", (srs_id,)).fetchone() is None:
+			self.db.execute("INSERT INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,NULL)", (srs_row[1], srs_id, srs_row[2], srs_row[3], srs_row[4]))
+		self.db.execute("UPDATE gpkg_geometry_columns SET srs_id = ? WHERE table_name = ?", (srs_id, self.table))
+		self.db.execute("UPDATE gpkg_contents SET srs_id = ? WHERE table_name = ?", (srs_id, self.table))
+		self.srs_id = srs_id
+
+	# a shape as a GeoPackage geometry blob: a blob from a GeoPackageParcelSource as is, an arcpy geometry from its WKB
+	def geometry(self, shape):
+		if shape is None:
+			return None
+		if isinstance(shape, (bytes, bytearray)):
+			if self.srs_id == 0:
+				srs_id = gpkg_blob_srs_id(shape)
+				self.set_srs(srs_id, gpkg_srs_definitions.get(srs_id, (srs_id, "unknown", "NONE", srs_id, "undefined")))
+			return sqlite3.Binary(shape)
+		if self.srs_id == 0:
+			spatial_ref = shape.spatialReference
+			srs_id = spatial_ref.factoryCode
+			self.set_srs(srs_id, (srs_id, spatial_ref.name, "EPSG" if srs_id < 100000 else "ESRI", srs_id, spatial_ref.exportToString()))
+		return sqlite3.Binary(gpkg_blob(shape.WKB, self.srs_id))
+
+	def insert(self, values, parcel=None):
+		self.rows.append((self.geometry(values.get('SHAPE@')),) + tuple(gpkg_value(values.get(field)) for field in self.fields))
+		self.count += 1
+
+	def flush(self):
+		self.db.executemany(self.sql, self.rows)
+		self.db.commit()
+		self.rows = []
+
+	def close(self):
+		if self.db is None:
+			return
+		self.flush()
+		self.db.execute("UPDATE gpkg_contents SET last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now') WHERE table_name = ?", (self.table,))
+		self.db.commit()
+		self.db.close()
+		self.db = None
+
+# drop_unjournaled_rows() of a GeoPackage output
+def drop_unjournaled_gpkg_rows(feature_class, key_fields, record_of, done):
+	(gpkg_path, table) = gpkg_output_table(feature_class)
+	db = sqlite3.connect(gpkg_path)
+	rows = db.execute("SELECT fid, {0} FROM {1}".format(", ".join(key_fields),gpkg_name(table))).fetchall()
+	dropped = [(row[0],) for row in rows if None in row[1:] or record_of(*row[1:]) not in done]
+	db.executemany("DELETE FROM {0} WHERE fid = ?".format(gpkg_name(table)), dropped)
+	db.commit()
+	db.close()
+	return len(dropped)
+
+#-----
+# linked output
+#	with output_layout = "linked", each parcel shape is written once, to <name>_APN_<n>_parcels (keyed by
+#	County and ParcelOID), and each record's row, without a shape, to the <name>_APN_<n>_links table along
+#	with the County and ParcelOID of its parcel; expand_linked_output() writes the usual flat feature class
+#	back out of the two, without searching the parcels again
+
+def linked_parcels_path(links_table):
+	return links_table[:-len("_links")] + "_parcels"
+
+class LinkedOutputWriter(object):
+	def __init__(self, links_table, fields):
+		self.links_table = links_table
+		self.parcels = linked_parcels_path(links_table)
+		self.fields = tuple(field for field in fields if field != "SHAPE@")
+		cursor_parcels = arcpy.da.SearchCursor(self.parcels,["County","ParcelOID"])
+		self.written = set((county, oid) for (county, oid) in cursor_parcels)		# parcels already written (by a resumed run)
+		del cursor_parcels
+		self.open_cursors()
+		self.count = 0
+
+	def open_cursors(self):
+		self.parcel_cursor = arcpy.da.InsertCursor(self.parcels,("SHAPE@","County","ParcelOID","APN"))
+		self.cursor = arcpy.da.InsertCursor(self.links_table,self.fields + ("County","ParcelOID"))
+
+	def insert(self, values, parcel=None):
+		(county, apn, oid) = parcel
+		if (county, oid) not in self.written:
+			self.parcel_cursor.insertRow((values['SHAPE@'], county, oid, apn))
+			self.written.add((county, oid))
+		self.cursor.insertRow(tuple(values.get(field) for field in self.fields) + (county, oid))
+		self.count += 1
+
+	def flush(self):
+		self.close()
+		self.open_cursors()
+
+	def close(self):
+		if self.cursor is None:
+			return
+		del self.parcel_cursor
+		del self.cursor
+		self.parcel_cursor = None
+		self.cursor = None
+
+# write the flat feature class of a linked output (one polygon per record and parcel, named like the
+# links table without "_links") from its parcels and links; returns the feature class, or None
+def expand_linked_output(links_table):
+	link_fields = [field.name for field in arcpy.ListFields(links_table)]
+	if "DocNo" in link_fields:
+		(template_name, fields) = (report_template, report_fields)
+	else:
+		(template_name, fields) = (resource_template, resource_fields)
+	(fgdb_path, links_name) = os.path.split(links_table)
+	arcpy_result = arcpy.CreateFeatureclass_management(fgdb_path,links_name[:-len("_links")],"POLYGON",template_name,"SAME_AS_TEMPLATE","SAME_AS_TEMPLATE",template_name)
+	if arcpy_result.status != 4:
+		add_error("; ".join(arcpy_result.getMessages()))
+		return None
+	feature_class = arcpy_result.getOutput(0)
+	cursor_parcels = arcpy.da.SearchCursor(linked_parcels_path(links_table),["County","ParcelOID","SHAPE@"])
+	shapes = dict(((county, oid), shape) for (county, oid, shape) in cursor_parcels)
+	del cursor_parcels
+	out_writer = OutputWriter(feature_class,fields)
+	link_fields = fields[1:]									# all but SHAPE@
+	cursor_links = arcpy.da.SearchCursor(links_table,link_fields + ("County","ParcelOID"))
+	for row in cursor_links:
+		values = dict(zip(link_fields, row))
+		values['SHAPE@'] = shapes.get((row[-2], row[-1]))
+		out_writer.insert(values)
+	del cursor_links
+	out_writer.close()
+	add_message("{0} rows of {1} expanded to {2}".format(out_writer.count,links_table,feature_class))
+	return feature_class
+
+#-----
+# dissolved output
+#	with dissolve_records set, the parcels a record matches are unioned into one multipart polygon (one
+#	per county, for a report listing more than one) whose Notes list all the APN's, instead of a feature
+#	for each parcel
+
+# union shapes pairwise, in rounds, so each union is of pieces of about the same size (a record with
+# hundreds of parcels doesn't grow one polygon a parcel at a time); None if any shape is None (a dry run)
+def union_shapes(shapes):
+	if any(shape is None for shape in shapes):
+		return None
+	while len(shapes) > 1:
+		unioned = [shapes[i].union(shapes[i + 1]) for i in range(0, len(shapes) - 1, 2)]
+		if len(shapes) % 2:
+			unioned.append(shapes[-1])
+		shapes = unioned
+	return shapes[0]
+
+# dissolve a record's (county#, apn, oid, shape) matches: returns [(county#, [apn,...], shape, None),...],
+# one for each county, each parcel in it once
+def dissolve_matches(matches):
+	by_county = {}
+	for (county, apn, oid, shape) in matches:
+		(apns, shapes) = by_county.setdefault(county, ([], {}))
+		if apn not in apns:
+			apns.append(apn)
+		shapes.setdefault(oid, shape)
+	return [(county, apns, union_shapes([shapes[oid] for oid in sorted(shapes)]), None) for (county, (apns, shapes)) in sorted(by_county.items())]
+
+# the Notes of a feature: the prefix and its APN's, cut (at an APN, ending with "...") to fit length, if given
+def apn_notes(prefix, apns, length=None):
+	notes = prefix + ", ".join(apns)
+	if length is None or len(notes) <= length:
+		return notes
+	notes = prefix + apns[0]
+	for apn in apns[1:]:
+		if len(notes) + len(apn) + 5 > length:
+			break
+		notes += ", " + apn
+	return (notes + "...")[:length]
+
+def field_length(table, field_name, default=255):
+	for field in arcpy.ListFields(table, field_name):
+		return field.length
+	return default
+
+# stands in for the OutputWriter in a dry run: counts the rows, writes nothing
+class DryRunWriter(object):
+	def __init__(self):
+		self.count = 0
+
+	def insert(self, values, parcel=None):
+		self.count += 1
+
+	def flush(self):
+		pass
+
+	def close(self):
+		pass
+
+#--------------------
+# per county match rates
+#	county_matches is { county# : [APN searches, APN searches that found a parcel] }
+
+def add_county_match(county_matches, county, found):
+	county_match = county_matches.setdefault(county, [0, 0])
+	county_match[0] += 1
+	if found:
+		county_match[1] += 1
+
+def report_county_matches(county_matches):
+	if county_matches:
+		add_message("APN's found in each county's parcel layer:")
+	for county in sorted(county_matches):
+		(searched, found) = county_matches[county]
+		add_message("     {0}: {1} of {2} ({3:.0%})".format(county_numbers[county],found,searched,float(found) / searched))
+
+def map_reports(saved_selection_file, doc_keys, lookups=None):
+	add_message("Mapping reports by APN")
 	# loop through each S-#
 	
-	# create the output feature
-	out_template = r"MAIN\Reports\Reports (polygons)"
-	(success, output_shapefile_name) = create_output_feature(DBsaved_selection_file,out_template)
-	if not success:
-		arcpy.AddError(output_shapefile_name)
-		return
+	# create the output feature, or pick up the one of an unfinished run on this saved selection
+	# (a dry run only counts, and creates no feature class)
+	out_template = report_template
+	linked = run_options["output_layout"] == "linked"
+	gpkg = run_options["output_format"] == "gpkg"
+	if linked and gpkg:
+		add_warning("the linked output layout isn't written to a GeoPackage, the output is flat")
+		linked = False
+	dissolve = run_options["dissolve_records"] and not linked
+	if run_options["dissolve_records"] and linked:
+		add_warning("dissolve_records doesn't apply to the linked output layout, its parcels are kept apart")
+	if dissolve and gpkg and run_options["parcel_source"]:
+		add_warning("dissolve_records needs arcpy geometries, it doesn't apply to a GeoPackage parcel source written to a GeoPackage")
+		dissolve = False
+	journal = None
+	if run_options["dry_run"]:
+		add_message("dry run: counting only, no feature class is written")
+		(output_shapefile_name, done_records) = (None, set())
+	else:
+		if run_options["journal_runs"]:
+			journal = open_run_journal(saved_selection_file)
+		(output_shapefile_name, done_records) = start_run_output(saved_selection_file,sheet_saved_reports,out_template,("DocNo",),report_record,journal,linked,output_options(linked,gpkg,dissolve))
+		if output_shapefile_name is None:
+			if journal is not None:
+				journal.close()
+			return
 
 	# create the output shapefile
 	#output_shapefile_name = make_output_file(DBsaved_selection_file,"parcelmapped","shp")
@@ -250,322 +2472,725 @@ def map_reports():
 	#(out_path, out_name) = os.path.split(output_shapefile_name)
 	#out_template = r"MAIN\Reports\Reports (polygons)"
 	#arcpy.CreateFeatureclass_management(out_path,out_name,"POLYGON",out_template,"SAME_AS_TEMPLATE","SAME_AS_TEMPLATE",out_template)
-	shp_shape_field = arcpy.Describe(output_shapefile_name).ShapeFieldName
-	
-	count_voids = 0			# count S-#'s marked "Void"
-	count_noCounty = 0		# count S-#'s with no county specified
-	count_malformed = 0		# count reports with malformed APN's
-	count_noAPN = 0			# count number of reports with no APN in ICDB
-	count_noParcel = 0		# count number of reports with 0 APN found in parcel layer
-	count_multiParcel = 0	# count number of reports with >1 APN found in parcel layer
-	count_shapes = 0		# count number of parcel shapes output
+	if run_options["dry_run"]:
+		out_writer = DryRunWriter()
+	elif linked:
+		out_writer = LinkedOutputWriter(output_shapefile_name,report_fields)
+	elif gpkg:
+		out_writer = GeoPackageOutputWriter(output_shapefile_name,report_fields)
+	else:
+		out_writer = OutputWriter(output_shapefile_name,report_fields,run_options["stage_in_memory"])
+	own_lookups = lookups is None
+	try:
+		notes_length = None
+		if dissolve and not gpkg:
+			notes_length = field_length(out_template,"Notes")
 	
-	for s_no in DocList:
-		current_report = "S-{0:06}".format(s_no)
-		arcpy.AddMessage("{0}:".format(current_report))
+		count_voids = 0			# count S-#'s marked "Void"
+		count_noCounty = 0		# count S-#'s with no county specified
+		count_malformed = 0		# count reports with malformed APN's
+		count_noAPN = 0			# count number of reports with no APN in ICDB
+		count_noParcel = 0		# count number of reports with 0 APN found in parcel layer
+		count_multiParcel = 0	# count number of reports with >1 APN found in parcel layer
+		count_shapes = 0		# count number of parcel shapes output
+		count_searches_skipped = 0	# count APN searches skipped in counties the APN can't be in
+		count_input = 0			# count S-#'s in the saved selection
+		malformed_apns = []		# (record, county, APN in ICDB, canonical APN) of every malformed APN, for the report
+		county_matches = {}		# APN searches, and how many found a parcel, by county
+		count_features = 0		# count features output before this run, by a run it resumes (see below)
+
+		# the counts so far; journaled with each batch, so a resumed run picks them up, and returned at the end
+		def report_counts():
+			return {
+				'kind'			: sheet_saved_reports,
+				'output'		: output_shapefile_name,
+				'input'			: count_input,
+				'void'			: count_voids,
+				'noCounty'		: count_noCounty,
+				'noAPN'			: count_noAPN,
+				'malformed'		: count_malformed,
+				'noParcel'		: count_noParcel,
+				'multiParcel'	: count_multiParcel,
+				'shapes'		: count_shapes,
+				'features'		: count_features + out_writer.count,
+				'searchesSkipped'	: count_searches_skipped
+			}
+
+		# resuming an unfinished run: start from its counts and malformed APN's, so the summary covers the whole selection
+		if done_records:
+			(resumed, county_matches, malformed_apns) = journal.resumed_counts()
+			count_input = resumed.get('input', 0)
+			count_voids = resumed.get('void', 0)
+			count_noCounty = resumed.get('noCounty', 0)
+			count_noAPN = resumed.get('noAPN', 0)
+			count_malformed = resumed.get('malformed', 0)
+			count_noParcel = resumed.get('noParcel', 0)
+			count_multiParcel = resumed.get('multiParcel', 0)
+			count_shapes = resumed.get('shapes', 0)
+			count_features = resumed.get('features', 0)
+			count_searches_skipped = resumed.get('searchesSkipped', 0)
+		count_resumed = count_input
+		malformed_journaled = len(malformed_apns)
+
+		# the parcel source (APN index or GeoPackage), crosswalk, ICDB cache and parcel shapes read, of this run (or of the whole batch, see map_saved_selections)
+		if own_lookups:
+			lookups = RunLookups(saved_selection_file)
+		(parcel_source, crosswalk, icdb_cache, shape_cache) = (lookups.parcel_source, lookups.crosswalk, lookups.icdb_cache, lookups.shape_cache)
+		if icdb_cache is not None:
+			(cache_hits, cache_misses) = (icdb_cache.hits, icdb_cache.misses)
+
+		# the S-#'s are read from the saved selection as they're taken, so that's when its reading is timed
+		# (they aren't all read up front just to tell how many there are, the progress lines go by the rows of the file)
+		count_total = run_record_total(doc_keys,saved_selection_file,done_records)
+		doc_keys = timed_iter(doc_keys,"read saved selection")
+		if done_records:
+			doc_keys = (s_no for s_no in doc_keys if report_record(s_no) not in done_records)
+
+		load_bundles = load_report_bundles
+		if icdb_cache is not None:
+			load_bundles = icdb_cache.loader(sheet_saved_reports,load_report_bundles,load_report_stamps,report_record)
+		start_run_log(saved_selection_file,output_shapefile_name)
 
 		#----
-		# start a connection and cursor to the ICDB
-		icdb_connect = connect_to_icdb()
-		icdb_cursor = icdb_connect.cursor(as_dict=True)
-
-		#-----
-		# get the parent table entry for this resource
-		icdb_cursor.execute("Select * from tblInventory WHERE DocNo = {0}".format(s_no))
-		icdb_report_parent = icdb_cursor.next()	# we'll assume that there's only 1 row returned
-		#-----
-		# skip this if it's marked "VOIDED" in the ICDB
-		if icdb_report_parent['Voided']:
-			arcpy.AddMessage("     {0} is marked VOIDED".format(current_report))
-			count_voids += 1
-			continue
-		#----
-		# extract some field values 
-		if icdb_report_parent['CitTitle']:
-			icdb_report_name = icdb_report_parent['CitTitle']
-		else:
-			icdb_report_name = "[none]"
-		
-		#-----
-		# find all the report's address records
-		icdb_cursor.execute("Select * from tblInventoryAddr WHERE DocNo = {0}".format(s_no))
-		icdb_report_apns = []		# gather up the APN values found
-		for icdb_addr in icdb_cursor:
-			if icdb_addr['APN']:
-				apn_cleaned = icdb_addr['APN'].strip()	# remove leading/trailing whitespace
-				if (len(apn_cleaned) > 0) and (apn_cleaned not in icdb_report_apns):
-					icdb_report_apns.append(apn_cleaned)
-		arcpy.AddMessage("     {0} APN's found in ICDB".format(len(icdb_report_apns)))
-		if len(icdb_report_apns) == 0:
-			count_noAPN += 1				# count reports with no APN value
-			continue						# skip this one
-		
-		#------
-		# loop through the APN's found for this Report
-		# this gets a bit tricky... the parcel APN layers are messy.
-		# So, while 1 Report may be reasonably mapped to more than 1 APN
-		# it is also possible that for a given APN, the parcel layer may have multiple shapes with that APN value
-		# BUT... report identifiers (the S-#'s) don't have county numbers coded in them...
-		# so... I guess we'll pull which county parcel layer to search by looking up the report's CountyName in tblInventoryCnty
-		#	hopefully, there's only 1 county, or else we'll have to search *all* the counties listed for that APN # !?!?!?!?!
-		
-		icdb_report_counties = []					# make a list of the county numbers
-		icdb_cursor.execute("Select * from tblInventoryCnty WHERE DocNo = {0}".format(s_no))
-		for icdb_cnty in icdb_cursor:
-			if icdb_cnty["CountyName"]:
-				icdb_report_counties.append(county_names[icdb_cnty["CountyName"]])	# lookup the name and store county number
-		if len(icdb_report_counties) < 1:
-			count_noCounty += 1
-			continue								# skip to next report (can't proceed without knowing which county to search)
-		
-		# for each county, search its APN table for all the APN's listed in the report's icdb (hopefully, this is only 1 county)
-		# this is not a clean loop, looking up each APN in each county doesn't make sense, but the data are structured that way, alas
-		this_report_malformed_apn = False
-		apn_shapes = []											# store up tuples of (county,apn,shape) here
-		for report_county in icdb_report_counties:
-			# gather up all the parcel shapes we find in all counties
-			parcel_layer = parcel_layers[report_county]			# get the layer name of the parcel
-			if not parcel_selections_cleared[report_county]:
-				arcpy.SelectLayerByAttribute_management(parcel_layer,"CLEAR_SELECTION")
-				parcel_selections_cleared[report_county] = True
-			for icdb_apn in icdb_report_apns:
-				cursor_apn = arcpy.da.SearchCursor(parcel_layer,["APN","SHAPE@"],"APN = '{0}'".format(icdb_apn))
-				# attempt to test the APN for well-formed-ness and output a blurb if not
-				if not re.match(apn_patterns[report_county],icdb_apn):
-					arcpy.AddMessage("      APN '{0}' in {1} county may not be well-formed".format(icdb_apn,county_numbers[report_county]))
-					this_report_malformed_apn = True
-				icdb_apn_count = 0
-				for apn in cursor_apn:
-					apn_shapes.append((report_county,icdb_apn,cursor_apn[1]))			# the SHAPE@ field is [1]
-					icdb_apn_count += 1													# count the parcels with this APN
-				arcpy.AddMessage("     searching for APN {0} in {1} : found {2} parcels".format(icdb_apn,parcel_layer,icdb_apn_count))
-		
-		if this_report_malformed_apn:
-			count_malformed += 1						# count reports with mal-formed APN values
-			
-		if len(apn_shapes) > 0:							# if any shapes found...
-			if len(apn_shapes) > 1:						# tally up the number of times that multiple parcels are found
-				count_multiParcel += 1
-			#-----
-			# generate a feature in the output for each APN shape
-			shp_to = arcpy.InsertCursor(output_shapefile_name)
-			for apn_shape in apn_shapes:
-				shp_new_row = shp_to.newRow()							# create empty record
-				shp_new_row.setValue(shp_shape_field,apn_shape[2])		# the shape geometry
-				shp_new_row.setValue('DocCo',apn_shape[0])				# the county number (saved in above loop)
-				shp_new_row.setValue('DocNo',s_no)
-				shp_new_row.setValue('OtherID',icdb_report_name)
-				shp_new_row.setValue('DocSource','p')					# selects 'parcel (APN)'
-				shp_new_row.setValue('DigSource','p')					# selects 'parcel (APN)'
-				shp_new_row.setValue('DigBy',run_user)
-				shp_new_row.setValue('DigDate',run_date)
-				shp_new_row.setValue('DigOrg','NWIC')
-				shp_new_row.setValue('Notes','automap APN:{0}'.format(apn_shape[1]))
-				shp_to.insertRow(shp_new_row)			 				# stuff that sucker in there
-				del shp_new_row
-				count_shapes += 1
-			del shp_to													# remove/close the InsertCursor
+		# pull the ICDB records for the S-#'s a batch at a time (from the local cache if they're in it)
+		for (batch_keys, report_bundles) in timed_iter(iter_bundle_batches(load_bundles,doc_keys,run_options["record_batch_size"],run_options["icdb_workers"],run_options["prefetch_batches"]),"icdb batches"):
+			#----
+			# put their APN's in canonical form and check them, then look them up in the parcel layers (or the APN index), a county at a time
+			with run_timer.phase("apn planning"):
+				normalize_bundle_apns(report_bundles)
+				plan_apn_searches(report_bundles,run_options["search_malformed_apns"],run_options["route_report_apns"],parcel_source)
+			parcel_shapes = resolve_parcels(collect_apns_by_county(report_bundles),parcel_source=parcel_source,workers=run_options["parcel_workers"],crosswalk=crosswalk,shapes=not run_options["dry_run"],shape_cache=shape_cache)
+
+			for s_no in batch_keys:
+				count_input += 1
+				current_report = report_record(s_no)
+				run_timer.start_record(current_report)
+				run_log.progress(count_input - count_resumed - 1,count_total)
+				record_message("{0}:".format(current_report))
+
+				#-----
+				# get the parent table entry for this report
+				report_bundle = report_bundles[s_no]
+				icdb_report_parent = report_bundle['parent']
+				if icdb_report_parent is None:
+					record_message("     {0} is not in the ICDB".format(current_report))
+					continue
+				#-----
+				# skip this if it's marked "VOIDED" in the ICDB
+				if icdb_report_parent['Voided']:
+					record_message("     {0} is marked VOIDED".format(current_report))
+					count_voids += 1
+					continue
+				#----
+				# extract some field values 
+				if icdb_report_parent['CitTitle']:
+					icdb_report_name = icdb_report_parent['CitTitle']
+				else:
+					icdb_report_name = "[none]"
+
+				#-----
+				# the APN values found in the report's address records
+				icdb_report_apns = report_bundle['apns']
+				record_message("     {0} APN's found in ICDB".format(len(icdb_report_apns)))
+				if len(icdb_report_apns) == 0:
+					count_noAPN += 1				# count reports with no APN value
+					continue						# skip this one
+
+				#------
+				# loop through the APN's found for this Report
+				# this gets a bit tricky... the parcel APN layers are messy.
+				# So, while 1 Report may be reasonably mapped to more than 1 APN
+				# it is also possible that for a given APN, the parcel layer may have multiple shapes with that APN value
+				# BUT... report identifiers (the S-#'s) don't have county numbers coded in them...
+				# so... I guess we'll pull which county parcel layer to search by looking up the report's CountyName in tblInventoryCnty
+				#	hopefully, there's only 1 county, or else we'll have to search *all* the counties listed for that APN # !?!?!?!?!
+
+				icdb_report_counties = report_bundle['counties']	# the list of county numbers
+				if len(icdb_report_counties) < 1:
+					count_noCounty += 1
+					continue								# skip to next report (can't proceed without knowing which county to search)
+
+				# for each county, search its APN table for the APN's listed in the report's icdb (hopefully, this is only 1 county)
+				# looking up each APN in each county doesn't make sense, so (unless route_report_apns is off) plan_apn_searches()
+				# has routed each APN to only the counties it can be in
+				this_report_malformed_apn = False
+				apn_shapes = []											# store up tuples of (county,apn,oid,shape) here
+				for report_county in icdb_report_counties:
+					# gather up all the parcel shapes we find in all counties
+					parcel_layer = parcel_layers[report_county]			# get the layer name of the parcel
+					for icdb_apn in icdb_report_apns:
+						# output a blurb if the APN isn't well-formed (as tested by normalize_bundle_apns())
+						if (report_county,icdb_apn) in report_bundle['malformed']:
+							apn_message("      APN '{0}' in {1} county may not be well-formed".format(icdb_apn,county_numbers[report_county]))
+							this_report_malformed_apn = True
+							malformed_apns.append((current_report,county_numbers[report_county],report_bundle['apn_sources'][icdb_apn],icdb_apn))
+						elif (report_county,icdb_apn) not in report_bundle['searches']:
+							count_searches_skipped += 1				# routed to the report's other county(s)
+						if (report_county,icdb_apn) not in report_bundle['searches']:
+							continue
+						found_shapes = parcel_shapes[report_county][icdb_apn]	# looked up, for the whole run, by resolve_parcels()
+						add_county_match(county_matches,report_county,found_shapes)
+						for (oid, shape) in found_shapes:
+							apn_shapes.append((report_county,icdb_apn,oid,shape))
+						apn_message("     searching for APN {0} in {1} : found {2} parcels".format(icdb_apn,parcel_layer,len(found_shapes)))
+
+				if this_report_malformed_apn:
+					count_malformed += 1						# count reports with mal-formed APN values
+
+				if len(apn_shapes) > 0:							# if any shapes found...
+					if len(apn_shapes) > 1:						# tally up the number of times that multiple parcels are found
+						count_multiParcel += 1
+					#-----
+					# generate a feature in the output for each APN shape (or, dissolving, one for each county of the report)
+					if dissolve:
+						features = dissolve_matches(apn_shapes)
+					else:
+						features = [(apn_shape[0],[apn_shape[1]],apn_shape[3],apn_shape[:3]) for apn_shape in apn_shapes]
+					for (feature_county, feature_apns, feature_shape, feature_parcel) in features:
+						insert_start = timer_clock()
+						out_writer.insert({
+							'SHAPE@'	: feature_shape,					# the shape geometry
+							'DocCo'		: feature_county,					# the county number (saved in above loop)
+							'DocNo'		: s_no,
+							'OtherID'	: icdb_report_name,
+							'DocSource'	: 'p',								# selects 'parcel (APN)'
+							'DigSource'	: 'p',								# selects 'parcel (APN)'
+							'DigBy'		: run_user,
+							'DigDate'	: run_date,
+							'DigOrg'	: 'NWIC',
+							'Notes'		: apn_notes('automap APN:',feature_apns,notes_length)
+						},feature_parcel)
+						run_timer.add_insert(feature_county,feature_apns,timer_clock() - insert_start)
+					count_shapes += len(apn_shapes)
+				else:
+					count_noParcel += 1											# tally up APN's not found
+
+			#----
+			# commit the batch's rows, then journal its S-#'s as done
+			run_timer.end_record()
+			if journal is not None:
+				with run_timer.phase("commit"):
+					out_writer.flush()
+					journal.mark_done((report_record(s_no) for s_no in batch_keys),report_counts(),county_matches,malformed_apns[malformed_journaled:])
+					malformed_journaled = len(malformed_apns)
+			run_log.flush()
+			shape_cache.trim()
+
+		#----- end of loop: for reports in doc_keys
+		with run_timer.phase("commit"):
+			out_writer.close()
+		if journal is not None:
+			journal.finish()
+		if linked and not run_options["dry_run"] and run_options["expand_linked_output"]:
+			expand_linked_output(output_shapefile_name)
+		if linked and not run_options["dry_run"]:
+			arcpy.SetParameterAsText(1, linked_parcels_path(output_shapefile_name))		# add the parcels to map
+		elif not run_options["dry_run"] and not gpkg:
+			arcpy.SetParameterAsText(1, output_shapefile_name)		# add to map
+		if icdb_cache is not None:
+			add_message("{0} Reports from the local ICDB cache, {1} loaded from the ICDB".format(icdb_cache.hits - cache_hits,icdb_cache.misses - cache_misses))
+		add_message("{0} Reports marked VOID".format(count_voids))
+		add_message("{0} Reports have no county specified".format(count_noCounty))
+		add_message("{0} Reports have no APN value".format(count_noAPN))
+		add_message("{0} Reports have mal-formed APN value".format(count_malformed))
+		if malformed_apns and not run_options["dry_run"]:
+			add_message("     mal-formed APN's are listed in {0}".format(write_malformed_apn_report(saved_selection_file,malformed_apns)))
+		add_message("{0} Reports with APN but no parcel found".format(count_noParcel))
+		add_message("{0} Reports with APN matching multiple parcels".format(count_multiParcel))
+		if run_options["route_report_apns"]:
+			add_message("{0} APN searches skipped in counties the APN can't be in".format(count_searches_skipped))
+		if run_options["dry_run"]:
+			add_message("{0} parcel shapes would be copied".format(count_shapes))
 		else:
-			count_noParcel += 1											# tally up APN's not found
-			
-				
-	#----- end of loop: for reports in DocList
-	arcpy.SetParameterAsText(1, output_shapefile_name)		# add to map
-	arcpy.AddMessage("{0} Reports marked VOID".format(count_voids))
-	arcpy.AddMessage("{0} Reports have no county specified".format(count_noCounty))
-	arcpy.AddMessage("{0} Reports have no APN value".format(count_noAPN))
-	arcpy.AddMessage("{0} Reports have mal-formed APN value".format(count_malformed))
-	arcpy.AddMessage("{0} Reports with APN but no parcel found".format(count_noParcel))
-	arcpy.AddMessage("{0} Reports with APN matching multiple parcels".format(count_multiParcel))
-	arcpy.AddMessage("{0} parcel shapes copied".format(count_shapes))
-
-def map_resources():
-	arcpy.AddMessage("Mapping resources by APN")
+			add_message("{0} parcel shapes copied".format(count_shapes))
+		counts = report_counts()
+		del counts['searchesSkipped']
+		if dissolve:
+			add_message("     dissolved into {0} features".format(counts['features']))
+		report_county_matches(county_matches)
+		if run_options["run_report"]:
+			add_message("run report (phase timings) in {0}".format(write_run_report(saved_selection_file,output_shapefile_name,counts)))
+		return counts
+	except Exception:
+		run_log.log("ERROR: {0}".format(traceback.format_exc().rstrip()))
+		raise
+	finally:
+		# (closed here too if it failed part way; the journal isn't finished, so a rerun resumes it, dropping the failed batch's rows)
+		out_writer.close()
+		if journal is not None:
+			journal.close()
+		if own_lookups and lookups is not None:
+			lookups.close()
+		end_run_log()
+
+def map_resources(saved_selection_file, res_keys, lookups=None):
+	add_message("Mapping resources by APN")
 	# loop through each Primary#
 	
-	# create the output feature
-	out_template = r"MAIN\Resources\Resources (polygons)"
-	(success, output_shapefile_name) = create_output_feature(DBsaved_selection_file,out_template)
-	if not success:
-		arcpy.AddError(output_shapefile_name)
-		return
+	# create the output feature, or pick up the one of an unfinished run on this saved selection
+	# (a dry run only counts, and creates no feature class)
+	out_template = resource_template
+	linked = run_options["output_layout"] == "linked"
+	gpkg = run_options["output_format"] == "gpkg"
+	if linked and gpkg:
+		add_warning("the linked output layout isn't written to a GeoPackage, the output is flat")
+		linked = False
+	dissolve = run_options["dissolve_records"] and not linked
+	if run_options["dissolve_records"] and linked:
+		add_warning("dissolve_records doesn't apply to the linked output layout, its parcels are kept apart")
+	if dissolve and gpkg and run_options["parcel_source"]:
+		add_warning("dissolve_records needs arcpy geometries, it doesn't apply to a GeoPackage parcel source written to a GeoPackage")
+		dissolve = False
+	journal = None
+	if run_options["dry_run"]:
+		add_message("dry run: counting only, no feature class is written")
+		(output_shapefile_name, done_records) = (None, set())
+	else:
+		if run_options["journal_runs"]:
+			journal = open_run_journal(saved_selection_file)
+		(output_shapefile_name, done_records) = start_run_output(saved_selection_file,sheet_saved_resources,out_template,("PrimCo","PrimNo"),resource_record,journal,linked,output_options(linked,gpkg,dissolve))
+		if output_shapefile_name is None:
+			if journal is not None:
+				journal.close()
+			return
 	
 	# output_shapefile_name = make_output_file(DBsaved_selection_file,"parcelmapped","shp")
 	# arcpy.AddMessage("output to: {0}".format(output_shapefile_name))
 	# (out_path, out_name) = os.path.split(output_shapefile_name)
 	# arcpy.CreateFeatureclass_management(out_path,out_name,"POLYGON",out_template,"SAME_AS_TEMPLATE","SAME_AS_TEMPLATE",out_template)
-	shp_shape_field = arcpy.Describe(output_shapefile_name).ShapeFieldName				# get the fieldname of the field that holds the geometry
-	
-	count_voids = 0			# count primary numbers marked "Void"
-	count_noAPN = 0			# count number of primarys with no APN in ICDB
-	count_malformed = 0		# count records with potentially malformed APN's
-	count_shapes = 0		# count number of parcel shapes output
-	count_multiParcel = 0	# count number of primarys with >1 APN found in parcel layer
-	count_noParcel = 0		# count number of primarys with 0 APN found in parcel layer
+	if run_options["dry_run"]:
+		out_writer = DryRunWriter()
+	elif linked:
+		out_writer = LinkedOutputWriter(output_shapefile_name,resource_fields)
+	elif gpkg:
+		out_writer = GeoPackageOutputWriter(output_shapefile_name,resource_fields)
+	else:
+		out_writer = OutputWriter(output_shapefile_name,resource_fields,run_options["stage_in_memory"])
+	own_lookups = lookups is None
+	try:
+		notes_length = None
+		if dissolve and not gpkg:
+			notes_length = field_length(out_template,"Notes")
 	
-	for primary in ResList:
-		(p_co,p_no) = (int(x) for x in primary.split('-'))
-		current_primary = "P-{0:02}-{1:06}".format(p_co,p_no)
-		arcpy.AddMessage("{0}:".format(current_primary))
+		count_voids = 0			# count primary numbers marked "Void"
+		count_noAPN = 0			# count number of primarys with no APN in ICDB
+		count_malformed = 0		# count records with potentially malformed APN's
+		count_shapes = 0		# count number of parcel shapes output
+		count_multiParcel = 0	# count number of primarys with >1 APN found in parcel layer
+		count_noParcel = 0		# count number of primarys with 0 APN found in parcel layer
+		count_input = 0			# count primary numbers in the saved selection
+		malformed_apns = []		# (record, county, APN in ICDB, canonical APN) of every malformed APN, for the report
+		county_matches = {}		# APN searches, and how many found a parcel, by county
+		count_features = 0		# count features output before this run, by a run it resumes (see below)
+
+		# the counts so far; journaled with each batch, so a resumed run picks them up, and returned at the end
+		def resource_counts():
+			return {
+				'kind'			: sheet_saved_resources,
+				'output'		: output_shapefile_name,
+				'input'			: count_input,
+				'void'			: count_voids,
+				'noCounty'		: 0,
+				'noAPN'			: count_noAPN,
+				'malformed'		: count_malformed,
+				'noParcel'		: count_noParcel,
+				'multiParcel'	: count_multiParcel,
+				'shapes'		: count_shapes,
+				'features'		: count_features + out_writer.count
+			}
+
+		# resuming an unfinished run: start from its counts and malformed APN's, so the summary covers the whole selection
+		if done_records:
+			(resumed, county_matches, malformed_apns) = journal.resumed_counts()
+			count_input = resumed.get('input', 0)
+			count_voids = resumed.get('void', 0)
+			count_noAPN = resumed.get('noAPN', 0)
+			count_malformed = resumed.get('malformed', 0)
+			count_noParcel = resumed.get('noParcel', 0)
+			count_multiParcel = resumed.get('multiParcel', 0)
+			count_shapes = resumed.get('shapes', 0)
+			count_features = resumed.get('features', 0)
+		count_resumed = count_input
+		malformed_journaled = len(malformed_apns)
+
+		# the parcel source (APN index or GeoPackage), crosswalk, ICDB cache and parcel shapes read, of this run (or of the whole batch, see map_saved_selections)
+		if own_lookups:
+			lookups = RunLookups(saved_selection_file)
+		(parcel_source, crosswalk, icdb_cache, shape_cache) = (lookups.parcel_source, lookups.crosswalk, lookups.icdb_cache, lookups.shape_cache)
+		if icdb_cache is not None:
+			(cache_hits, cache_misses) = (icdb_cache.hits, icdb_cache.misses)
+
+		# the primary #'s are read from the saved selection as they're taken, so that's when its reading is timed
+		# (they aren't all read up front just to tell how many there are, the progress lines go by the rows of the file)
+		count_total = run_record_total(res_keys,saved_selection_file,done_records)
+		res_keys = timed_iter(res_keys,"read saved selection")
+		if done_records:
+			res_keys = (key for key in res_keys if resource_record(*key) not in done_records)
+
+		load_bundles = load_resource_bundles
+		if icdb_cache is not None:
+			load_bundles = icdb_cache.loader(sheet_saved_resources,load_resource_bundles,load_resource_stamps,lambda key: resource_record(*key))
+		start_run_log(saved_selection_file,output_shapefile_name)
 
 		#----
-		# start a connection and cursor to the ICDB
-		icdb_connect = connect_to_icdb()
-		icdb_cursor = icdb_connect.cursor(as_dict=True)
-
-		#-----
-		# get the parent table entry for this resource
-		icdb_cursor.execute("Select * from tblResource WHERE PrimCo = {0} and PrimNo = {1}".format(p_co,p_no))
-		icdb_resource_parent = icdb_cursor.next()	# we'll assume that there's only 1 row returned
-		#-----
-		# skip this if it's marked "VOIDED" in the ICDB
-		if icdb_resource_parent['Voided']:
-			arcpy.AddMessage("     {0} is marked VOIDED".format(current_primary))
-			count_voids += 1
-			continue
-		#----
-		# extract some field values 
-		if icdb_resource_parent['ResourceName']:
-			icdb_resource_name = icdb_resource_parent['ResourceName']
+		# pull the ICDB records for the P-#'s a batch at a time (from the local cache if they're in it)
+		for (batch_keys, resource_bundles) in timed_iter(iter_bundle_batches(load_bundles,res_keys,run_options["record_batch_size"],run_options["icdb_workers"],run_options["prefetch_batches"]),"icdb batches"):
+			#----
+			# put their APN's in canonical form and check them, then look them up in the parcel layers (or the APN index), a county at a time
+			with run_timer.phase("apn planning"):
+				normalize_bundle_apns(resource_bundles)
+				plan_apn_searches(resource_bundles,run_options["search_malformed_apns"])
+			parcel_shapes = resolve_parcels(collect_apns_by_county(resource_bundles),parcel_source=parcel_source,workers=run_options["parcel_workers"],crosswalk=crosswalk,shapes=not run_options["dry_run"],shape_cache=shape_cache)
+
+			for (p_co,p_no) in batch_keys:
+				count_input += 1
+				current_primary = resource_record(p_co,p_no)
+				run_timer.start_record(current_primary)
+				run_log.progress(count_input - count_resumed - 1,count_total)
+				record_message("{0}:".format(current_primary))
+
+				#-----
+				# get the parent table entry for this resource
+				resource_bundle = resource_bundles[(p_co,p_no)]
+				icdb_resource_parent = resource_bundle['parent']
+				if icdb_resource_parent is None:
+					record_message("     {0} is not in the ICDB".format(current_primary))
+					continue
+				#-----
+				# skip this if it's marked "VOIDED" in the ICDB
+				if icdb_resource_parent['Voided']:
+					record_message("     {0} is marked VOIDED".format(current_primary))
+					count_voids += 1
+					continue
+				#----
+				# extract some field values 
+				if icdb_resource_parent['ResourceName']:
+					icdb_resource_name = icdb_resource_parent['ResourceName']
+				else:
+					icdb_resource_name = "[none]"
+
+				#-----
+				# the APN values found in the resource's address records
+				icdb_resource_apns = resource_bundle['apns']
+				record_message("     {0} APN's found in ICDB".format(len(icdb_resource_apns)))
+				if len(icdb_resource_apns) == 0:
+					count_noAPN += 1				# count primary with no APN value
+					continue
+
+				#------
+				# loop through the APN's found for this Primary (i.e. icdb_resource_apns)
+				# this gets a bit tricky... the parcel APN layers are messy.
+				# So, while 1 Primary may be reasonably mapped to more than 1 APN
+				# it is also possible that for a given APN, the parcel layer may have multiple shapes with that APN value
+				parcel_layer = parcel_layers[p_co]			# get the layer name of the parcel
+				found_malformed_apn = False					# clear this before looping through the APN's for this resource
+				# go through the list of APN's found in the ICBD, for the current P-# and find them in the parcel layer
+				apn_shapes = []								# store up the tuples with shape objects here
+				for icdb_apn in icdb_resource_apns:
+					if (p_co,icdb_apn) in resource_bundle['malformed']:
+						apn_message("      APN '{0}' in {1} county may not be well-formed".format(icdb_apn,county_numbers[p_co]))
+						found_malformed_apn = True			# found APN value that may not match in parcel layer
+						malformed_apns.append((current_primary,county_numbers[p_co],resource_bundle['apn_sources'][icdb_apn],icdb_apn))
+					if (p_co,icdb_apn) not in resource_bundle['searches']:
+						continue							# (malformed) it can't match the standardized APN field, don't bother
+					found_shapes = parcel_shapes[p_co][icdb_apn]	# looked up, for the whole run, by resolve_parcels()
+					add_county_match(county_matches,p_co,found_shapes)
+					for (oid, shape) in found_shapes:
+						apn_shapes.append((icdb_apn,oid,shape))
+					apn_message("     searching for APN {0} in {1} found {2} parcels".format(icdb_apn,parcel_layer,len(found_shapes)))
+
+				# copy the parcel shapes to the output .shp file
+				if len(apn_shapes) > 0:
+					if len(apn_shapes) > 1:
+						count_multiParcel += 1
+					#-----
+					# generate a feature in the output for each APN shape (or, dissolving, just one)
+					if dissolve:
+						features = dissolve_matches([(p_co,) + apn_shape for apn_shape in apn_shapes])
+					else:
+						features = [(p_co,[apn_shape[0]],apn_shape[2],(p_co,apn_shape[0],apn_shape[1])) for apn_shape in apn_shapes]
+					for (feature_county, feature_apns, feature_shape, feature_parcel) in features:
+						insert_start = timer_clock()
+						shp_new_row = {
+							'SHAPE@'	: feature_shape,
+							'PrimCo'	: p_co,
+							'PrimNo'	: p_no,
+							'OtherID'	: icdb_resource_name,
+							'DocSource'	: 'p',								# selects 'parcel (APN)'
+							'DigSource'	: 'p',								# selects 'parcel (APN)'
+							'DigBy'		: run_user,
+							'DigDate'	: run_date,
+							'DigOrg'	: 'NWIC',
+							'Notes'		: apn_notes('automap APN:',feature_apns,notes_length)
+						}
+						if icdb_resource_parent['TrinNo'] > 0:					# if TrinNo is non-zero then copy it over, else leave Null
+							shp_new_row['TrinNo'] = icdb_resource_parent['TrinNo']
+						if icdb_resource_parent['TrinH']:
+							shp_new_row['Notes'] = apn_notes('{0}; automap APN:'.format(icdb_resource_parent['TrinH']),feature_apns,notes_length)
+						out_writer.insert(shp_new_row,feature_parcel)
+						run_timer.add_insert(feature_county,feature_apns,timer_clock() - insert_start)
+					count_shapes += len(apn_shapes)
+				else:
+					count_noParcel += 1
+
+				if found_malformed_apn:
+					count_malformed += 1
+
+			#----
+			# commit the batch's rows, then journal its P-#'s as done
+			run_timer.end_record()
+			if journal is not None:
+				with run_timer.phase("commit"):
+					out_writer.flush()
+					journal.mark_done((resource_record(p_co,p_no) for (p_co,p_no) in batch_keys),resource_counts(),county_matches,malformed_apns[malformed_journaled:])
+					malformed_journaled = len(malformed_apns)
+			run_log.flush()
+			shape_cache.trim()
+
+		#----- end of loop: for primary in res_keys
+		with run_timer.phase("commit"):
+			out_writer.close()
+		if journal is not None:
+			journal.finish()
+		if linked and not run_options["dry_run"] and run_options["expand_linked_output"]:
+			expand_linked_output(output_shapefile_name)
+		if linked and not run_options["dry_run"]:
+			arcpy.SetParameterAsText(1, linked_parcels_path(output_shapefile_name))		# add the parcels to map
+		elif not run_options["dry_run"] and not gpkg:
+			arcpy.SetParameterAsText(1, output_shapefile_name)		# add to map
+		add_message("{0} Primary #'s input".format(count_input))
+		if icdb_cache is not None:
+			add_message("{0} Primary #'s from the local ICDB cache, {1} loaded from the ICDB".format(icdb_cache.hits - cache_hits,icdb_cache.misses - cache_misses))
+		add_message("{0} Primary #'s marked VOID".format(count_voids))
+		add_message("{0} Primary #'s have no APN value".format(count_noAPN))
+		add_message("{0} Primary #'s possibly mal-formed APN value".format(count_malformed))
+		if malformed_apns and not run_options["dry_run"]:
+			add_message("     mal-formed APN's are listed in {0}".format(write_malformed_apn_report(saved_selection_file,malformed_apns)))
+		add_message("{0} Primary with APN but no parcel found".format(count_noParcel))
+		add_message("{0} Primary #'s with APN matching multiple parcels".format(count_multiParcel))
+		if run_options["dry_run"]:
+			add_message("{0} parcel shapes would be copied".format(count_shapes))
 		else:
-			icdb_resource_name = "[none]"
-		
-		#-----
-		# find all the resource's address records
-		icdb_cursor.execute("Select * from tblResourceAddr WHERE PrimCo = {0} and PrimNo = {1}".format(p_co,p_no))
-		icdb_resource_apns = []
-		for icdb_addr in icdb_cursor:
-			if icdb_addr['APN']:
-				apn_cleaned = icdb_addr['APN'].strip()	# remove leading/trailing whitespace
-				if (len(apn_cleaned) > 0) and (apn_cleaned not in icdb_resource_apns):
-					icdb_resource_apns.append(apn_cleaned)
-		arcpy.AddMessage("     {0} APN's found in ICDB".format(len(icdb_resource_apns)))
-		if len(icdb_resource_apns) == 0:
-			count_noAPN += 1				# count primary with no APN value
+			add_message("{0} parcel shapes copied".format(count_shapes))
+		counts = resource_counts()
+		if dissolve:
+			add_message("     dissolved into {0} features".format(counts['features']))
+		report_county_matches(county_matches)
+		if run_options["run_report"]:
+			add_message("run report (phase timings) in {0}".format(write_run_report(saved_selection_file,output_shapefile_name,counts)))
+		return counts
+	except Exception:
+		run_log.log("ERROR: {0}".format(traceback.format_exc().rstrip()))
+		raise
+	finally:
+		# (closed here too if it failed part way; the journal isn't finished, so a rerun resumes it, dropping the failed batch's rows)
+		out_writer.close()
+		if journal is not None:
+			journal.close()
+		if own_lookups and lookups is not None:
+			lookups.close()
+		end_run_log()
+
+#--------------------
+# batch mode
+#
+#	map a list of saved selections files (or every one in a folder), reports and resources mixed, in one
+#	go: the ICDB session (not those of the prefetch threads, see iter_bundle_batches), APN index, crosswalk,
+#	ICDB cache and parcel shapes (up to shape_cache_size) are shared by all of them, each gets its own feature class
+#	in mapByAPN.gdb, and a combined summary is written to batch_summary.csv in the (first) folder
+#	the map_* functions return their counts: { 'kind', 'output', 'input', 'void', ... }
+
+# the parcel source (None for the parcel layers of the map), crosswalk, ICDB cache and parcel shape
+# cache of a run, or of a batch of them
+class RunLookups(object):
+	def __init__(self, base_file):
+		self.parcel_source = None
+		if run_options["parcel_source"]:
+			self.parcel_source = open_parcel_source(run_options["parcel_source"])
+			if run_options["use_apn_index"] or run_options["rebuild_apn_index"] or run_options["use_crosswalk"]:
+				add_warning("the APN index and the crosswalk are of the parcel layers, they aren't used with a GeoPackage parcel source")
+		elif run_options["use_apn_index"] or run_options["rebuild_apn_index"]:
+			self.parcel_source = open_apn_index(base_file)
+		self.crosswalk = None
+		if run_options["use_crosswalk"] and not run_options["parcel_source"]:
+			self.crosswalk = open_crosswalk()
+		self.icdb_cache = open_icdb_cache()
+		self.shape_cache = ShapeCache(run_options["shape_cache_size"])	# parcel shapes read, by (county, OID)
+
+	def close(self):
+		for lookup in (self.parcel_source, self.crosswalk, self.icdb_cache):
+			if lookup is not None:
+				lookup.close()
+		self.shape_cache.clear()
+
+saved_selection_extensions = (".xlsx",".csv",".tsv",".txt")
+excel_lock_file_prefix = "~$"			# the lock file Excel keeps next to a workbook open in it
+report_file_pattern = re.compile(r"(_malformed_APN|_unmapped_APN|^batch_summary)(_\d+)?$")	# this tool's own .csv reports, not saved selections
+
+# the saved selections files named by the tool's parameter: a file, a folder (every saved selections file
+# in it) or a ';' separated list of either (as a multivalue parameter is handed over)
+def saved_selection_files(parameter):
+	files = []
+	for name in parameter.split(";"):
+		name = name.strip().strip("'\"")
+		if not name:
 			continue
-		
-		#------
-		# loop through the APN's found for this Primary (i.e. icdb_resource_apns)
-		# this gets a bit tricky... the parcel APN layers are messy.
-		# So, while 1 Primary may be reasonably mapped to more than 1 APN
-		# it is also possible that for a given APN, the parcel layer may have multiple shapes with that APN value
-		parcel_layer = parcel_layers[p_co]			# get the layer name of the parcel
-		if not parcel_selections_cleared[p_co]:
-			arcpy.SelectLayerByAttribute_management(parcel_layer,"CLEAR_SELECTION")
-			parcel_selections_cleared[p_co] = True
-		found_malformed_apn = False					# clear this before looping through the APN's for this resource
-		# go through the list of APN's found in the ICBD, for the current P-# and find them in the parcel layer
-		apn_shapes = []								# store up the tuples with shape objects here
-		for icdb_apn in icdb_resource_apns:
-			if not re.match(apn_patterns[p_co],icdb_apn):
-				arcpy.AddMessage("      APN '{0}' in {1} county may not be well-formed".format(icdb_apn,county_numbers[p_co]))
-				found_malformed_apn = True			# found APN value that may not match in parcel layer
-			cursor_apn = arcpy.da.SearchCursor(parcel_layer,["APN","SHAPE@"],"APN = '{0}'".format(icdb_apn))
-			icdb_apn_count = 0
-			for apn in cursor_apn:
-				apn_shapes.append((icdb_apn,cursor_apn[1]))					# the SHAPE@ field is [1]
-				icdb_apn_count += 1
-			arcpy.AddMessage("     searching for APN {0} in {1} found {2} parcels".format(icdb_apn,parcel_layer,icdb_apn_count))
-		
-		# copy the parcel shapes to the output .shp file
-		if len(apn_shapes) > 0:
-			if len(apn_shapes) > 1:
-				count_multiParcel += 1
-			#-----
-			# generate a feature in the output for each APN shape
-			shp_to = arcpy.InsertCursor(output_shapefile_name)
-			for apn_shape in apn_shapes:
-				shp_new_row = shp_to.newRow()							# create empty record
-				shp_new_row.setValue(shp_shape_field,apn_shape[1])
-				shp_new_row.setValue('PrimCo',p_co)
-				shp_new_row.setValue('PrimNo',p_no)
-				if icdb_resource_parent['TrinNo'] > 0:					# if TrinNo is non-zero then copy it over, else leave Null
-					shp_new_row.setValue('TrinNo',icdb_resource_parent['TrinNo'])
-				shp_new_row.setValue('OtherID',icdb_resource_name)
-				shp_new_row.setValue('DocSource','p')					# selects 'parcel (APN)'
-				shp_new_row.setValue('DigSource','p')					# selects 'parcel (APN)'
-				shp_new_row.setValue('DigBy',run_user)
-				shp_new_row.setValue('DigDate',run_date)
-				shp_new_row.setValue('DigOrg','NWIC')
-				if icdb_resource_parent['TrinH']:
-					shp_new_row.setValue('Notes','{0}; automap APN:{1}'.format(icdb_resource_parent['TrinH'],apn_shape[0]))
-				else:
-					shp_new_row.setValue('Notes','automap APN:{0}'.format(apn_shape[0]))
-				shp_to.insertRow(shp_new_row)			 				# stuff that sucker in there
-				del shp_new_row
-				count_shapes += 1
-			del shp_to		# remove/close the InsertCursor
+		if os.path.isdir(name):
+			for f in sorted(os.listdir(name)):
+				(f_base, f_ext) = os.path.splitext(f)
+				if f_ext.lower() in saved_selection_extensions and not report_file_pattern.search(f_base) and not f.startswith(excel_lock_file_prefix):
+					files.append(os.path.join(name, f))
 		else:
-			count_noParcel += 1
-
-		if found_malformed_apn:
-			count_malformed += 1
-				
-	#----- end of loop: for primary in ResList
-	arcpy.SetParameterAsText(1, output_shapefile_name)		# add to map
-	arcpy.AddMessage("{0} Primary #'s marked VOID".format(count_voids))
-	arcpy.AddMessage("{0} Primary #'s have no APN value".format(count_noAPN))
-	arcpy.AddMessage("{0} Primary #'s possibly mal-formed APN value".format(count_malformed))
-	arcpy.AddMessage("{0} Primary with APN but no parcel found".format(count_noParcel))
-	arcpy.AddMessage("{0} Primary #'s with APN matching multiple parcels".format(count_multiParcel))
-	arcpy.AddMessage("{0} parcel shapes copied".format(count_shapes))
+			files.append(name)
+	return files
+
+batch_summary_fields = ("input","void","noCounty","noAPN","malformed","noParcel","multiParcel","shapes","features")
+
+def map_saved_selections(file_names):
+	results = []
+	lookups = RunLookups(file_names[0])
+	try:
+		for file_name in file_names:
+			add_message("==== {0}".format(file_name))
+			reset_run_timer()
+			counts = None
+			try:
+				with run_timer.phase("read saved selection"):
+					(saved_kind, saved_keys) = read_saved_selection(file_name)
+				if saved_kind == sheet_saved_reports:
+					counts = map_reports(file_name,saved_keys,lookups)
+				elif saved_kind == sheet_saved_resources:
+					counts = map_resources(file_name,saved_keys,lookups)
+				else:
+					add_warning("{0}: {1}, skipped".format(file_name,saved_keys))
+			except Exception as e:
+				add_error("{0} failed: {1}".format(file_name,e))
+			results.append((file_name, counts))
+	finally:
+		lookups.close()
+		close_icdb_sessions()
+		close_parcel_pool()
+
+	#----
+	# combined summary
+	rows = []
+	totals = dict((field, 0) for field in batch_summary_fields)
+	for (file_name, counts) in results:
+		if counts is None:
+			rows.append((file_name, "skipped/failed", "") + ("",) * len(batch_summary_fields))
+			continue
+		for field in batch_summary_fields:
+			totals[field] += counts[field]
+		rows.append((file_name, counts['kind'], counts['output'] or "") + tuple(counts[field] for field in batch_summary_fields))
+	mapped = len([counts for (file_name, counts) in results if counts is not None])
+	add_message("==== {0} of {1} saved selections mapped".format(mapped,len(results)))
+	for field in batch_summary_fields:
+		add_message("{0} {1}".format(totals[field],field))
+	summary_base = os.path.join(os.path.dirname(os.path.abspath(file_names[0])),"batch")
+	summary_file = write_csv_report(summary_base,"summary",("File","Kind","Output") + batch_summary_fields,rows)
+	add_message("summary of each file in {0}".format(summary_file))
+	return results
 
 #================
 # MAIN line code
 #================
 
-#-----------
-# open the db saved selections file and see what it is
-DBsave_wb = openpyxl.load_workbook(str(DBsaved_selection_file))
-# advance the 'sheet' variable up to a recognized sheet name
-for sheet in DBsave_wb.get_sheet_names():
-	if sheet == sheet_saved_reports or sheet == sheet_saved_resources:
-		break
-# process, depending on which kind of saved selections were found
-if sheet == sheet_saved_reports:
-	tbl_Reports = DBsave_wb[sheet]
-	if tbl_Reports['B1'].value != "DocNo" or tbl_Reports['A1'].value != "DocCo":
-		arcpy.AddError("File is not a valid ICDB saved reports")
-		sys.exit(1)
-	DocList = []
-	cellrow = 2		# start reading at row 2 of column 'B'
-	while cellrow > 0:
-		cellname = "B" + str(cellrow)
-		if tbl_Reports[cellname].value is not None:
-			DocList.append(tbl_Reports[cellname].value)		# add the S-# to the DocList
-			cellrow += 1
-		else:
-			cellrow = 0
-			break
+# map the saved selections file(s) of the tool's parameter; returns the exit code
+def map_saved_selection_parameter(DBsaved_selection_file, batch=False):
+	#-----------
+	# more than one saved selections file (or a folder of them): map them all in one batch
+	batch_files = saved_selection_files(DBsaved_selection_file)
+	if batch or len(batch_files) > 1 or os.path.isdir(DBsaved_selection_file):
+		if not batch_files:
+			add_error("no saved selections files in {0}".format(DBsaved_selection_file))
+			return 1
+		map_saved_selections(batch_files)
+		return 0
 
-	#----
-	# process reports, S-#'s in DocList
-	map_reports()
-
-elif sheet == sheet_saved_resources:
-	tbl_Resources = DBsave_wb[sheet]
-	if tbl_Resources['B1'].value != "PrimNo" or tbl_Resources['A1'].value != "PrimCo":
-		arcpy.AddError("File is not a valid ICDB saved resources")
-		sys.exit(1)
-	ResList = []
-	cellrow = 2
-	while cellrow > 0:
-		cellCo = "A" + str(cellrow)
-		cellNo = "B" + str(cellrow)
-		if tbl_Resources[cellCo].value is not None and tbl_Resources[cellNo].value is not None:
-			ResList.append("{0}-{1}".format(str(tbl_Resources[cellCo].value),str(tbl_Resources[cellNo].value)))
-			cellrow += 1
+	#-----------
+	# open the db saved selections file and see what it is
+	reset_run_timer()
+	with run_timer.phase("read saved selection"):
+		(saved_kind, saved_keys) = read_saved_selection(DBsaved_selection_file)
+	# process, depending on which kind of saved selections were found
+	# (a key that isn't a number, found as the keys are read, stops the run with an error naming its row)
+	try:
+		if saved_kind == sheet_saved_reports:
+			#----
+			# process reports, S-#'s in the saved selection
+			map_reports(DBsaved_selection_file,saved_keys)
+
+		elif saved_kind == sheet_saved_resources:
+			#----
+			# process resources, P-#'s in the saved selection
+			map_resources(DBsaved_selection_file,saved_keys)
+
+		# we're here because the saved selections are for neither reports nor resources (prolly wrong file picked?)
 		else:
-			cellrow = 0
-			break
+			add_error(saved_keys)							# (the error msg)
+			return 1
+	except ValueError as e:
+		add_error("{0} failed: {1}".format(DBsaved_selection_file,e))
+		return 1
+	return 0
 
-	#----
-	# process resources, P-#'s in ResList (formatted)
-	#----
-	arcpy.AddMessage("{0} Primary #'s input".format(len(ResList)))
-	map_resources()
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="mapbyparcel.py",description="map the reports/resources of ICDB saved selections to their parcels by APN")
+	parser.add_argument("files",nargs="*",metavar="file",help="saved selections file(s) or folder(s) (default: the tool's parameter); links tables with --expand")
+	command = parser.add_mutually_exclusive_group()
+	command.add_argument("--build-crosswalk",nargs="?",const="",metavar="mxd",help="build the ICDB-to-parcel crosswalk from the parcel layers of the map document (or the current map)")
+	command.add_argument("--rebuild-index",nargs="?",const="",metavar="mxd",help="rebuild the APN index of the parcel layers of the map document (or the current map) in each folder given (default: the current folder)")
+	command.add_argument("--expand",action="store_true",help="write the flat feature class of each linked output's links table")
+	command.add_argument("--unmapped",action="store_true",help="list the APN's of each saved selection that don't map to a parcel, from the crosswalk")
+	command.add_argument("--batch",action="store_true",help="map every saved selections file given in one run (the default with more than one)")
+	args = parser.parse_args(argv)
+
+	#-----------
+	# pick up any run options set in the environment
+	load_run_options()
+
+	try:
+		return run_command(args)
+	finally:
+		close_icdb_sessions()
+		close_parcel_pool()
+
+# run the command line's command, or map the saved selections file(s); returns the exit code
+def run_command(args):
+	#-----------
+	# batch commands: build the crosswalk, rebuild the APN index, write the flat layout of linked outputs, or list the unmapped APN's of saved selections
+	if args.build_crosswalk is not None:
+		build_crosswalk(crosswalk_path(),args.build_crosswalk or None)
+		return 0
+	if args.rebuild_index is not None:
+		for index_folder in args.files or [os.getcwd()]:
+			rebuild_apn_index(index_folder,args.rebuild_index or None)
+		return 0
+	if args.expand:
+		for links_table in args.files:
+			expand_linked_output(links_table)
+		return 0
+	if args.unmapped:
+		for saved_selection_file in args.files:
+			report_unmapped_apns(saved_selection_file)
+		return 0
+
+	# input file path of saved selections (run as the ArcMap tool: its first parameter)
+	DBsaved_selection_file = ";".join(args.files) or arcpy.GetParameterAsText(0)
+
+	#-----------
+	# optionally profile the run, saving the stats next to the (first) saved selections file
+	if not run_options["profile_run"]:
+		return map_saved_selection_parameter(DBsaved_selection_file,args.batch)
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		return map_saved_selection_parameter(DBsaved_selection_file,args.batch)
+	finally:
+		profiler.disable()
+		profile_file = make_output_file((saved_selection_files(DBsaved_selection_file) or [DBsaved_selection_file])[0],"profile","pstats")
+		profiler.dump_stats(profile_file)
+		add_message("profile of the run in {0}".format(profile_file))
 
-# we're here because the saved selections are for neither reports nor resources (prolly wrong file picked?)
-else:
-	arcpy.AddError("File is not a valid ICDB saved selections")
-	sys.exit(1)
+if __name__ == "__main__":			# (and not when imported by a parcel worker process, or another script)
+	sys.exit(main())
@@ -0,0 +1,492 @@
+#------------------------------------
+#
+# unit tests of the parts of mapbyparcel.py that run without arcpy or the ICDB:
+#	loading ICDB records (against a SQLite stand-in for the ICDB), APN canonical form and county patterns, the planning (and routing) of the APN searches, the
+#	order the batches of ICDB records come back in with prefetch threads, the run timer's phases, the parcel shape cache, the local ICDB
+#	cache, the saved selections files of a folder, and resuming a run stopped part way (GeoPackage in and out, no arcpy)
+#
+#	python -m unittest discover tests		(or python -m pytest tests)
+
+import os
+import random
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mapbyparcel
+
+SONOMA = 49						# ddd-ddd-ddd
+MARIN = 21						# ddd-ddd-dd
+COLUSA = 6
+CONTRA_COSTA = 7
+
+def report_bundle(apns, counties, voided=False):
+	return {'parent': {'Voided': voided}, 'apns': list(apns), 'counties': list(counties)}
+
+def planned(bundle, search_malformed=False, route=False, parcel_source=None):
+	bundles = {1: bundle}
+	mapbyparcel.normalize_bundle_apns(bundles)
+	mapbyparcel.plan_apn_searches(bundles, search_malformed, route, parcel_source)
+	return bundle
+
+# an ICDBSession on a SQLite database, that keeps the queries it ran
+class RecordingSession(mapbyparcel.ICDBSession):
+	def __init__(self, db):
+		mapbyparcel.ICDBSession.__init__(self, lambda: db, "?")
+		self.queries = []
+
+	def query(self, sql, params=()):
+		self.queries.append((sql, list(params)))
+		return mapbyparcel.ICDBSession.query(self, sql, params)
+
+class LoadBundlesTest(unittest.TestCase):
+	def setUp(self):
+		self.db = sqlite3.connect(":memory:")
+		self.db.executescript("""
+			CREATE TABLE tblInventory (DocNo INTEGER, CitTitle TEXT, Voided INTEGER);
+			CREATE TABLE tblInventoryAddr (DocNo INTEGER, APN TEXT);
+			CREATE TABLE tblInventoryCnty (DocNo INTEGER, CountyName TEXT);
+			CREATE TABLE tblResource (PrimCo INTEGER, PrimNo INTEGER, Voided INTEGER);
+			CREATE TABLE tblResourceAddr (PrimCo INTEGER, PrimNo INTEGER, APN TEXT);
+		""")
+		for doc_no in range(1, 6):
+			self.db.execute("INSERT INTO tblInventory VALUES (?,?,0)", (doc_no, "report {0}".format(doc_no)))
+			self.db.execute("INSERT INTO tblInventoryCnty VALUES (?,'Sonoma')", (doc_no,))
+		self.db.executemany("INSERT INTO tblInventoryAddr VALUES (?,?)", [
+			(1, "012-345-678"), (1, " 012-345-678 "), (1, ""), (1, None), (1, "   "), (2, "012-345-67")])
+		for (p_co, p_no) in ((SONOMA, 1), (SONOMA, 2), (MARIN, 1)):
+			self.db.execute("INSERT INTO tblResource VALUES (?,?,0)", (p_co, p_no))
+			self.db.execute("INSERT INTO tblResourceAddr VALUES (?,?,?)", (p_co, p_no, "{0}-{1}".format(p_co, p_no)))
+		self.session = RecordingSession(self.db)
+
+	def tearDown(self):
+		self.session.close()
+
+	def test_reports(self):
+		bundles = mapbyparcel.load_report_bundles(self.session, [2, 1, 9])
+		self.assertEqual(sorted(bundles), [1, 2, 9])
+		self.assertEqual(bundles[1]['apns'], ["012-345-678"])			# duplicates and blanks dropped
+		self.assertEqual(bundles[2]['apns'], ["012-345-67"])
+		self.assertEqual(bundles[1]['counties'], [SONOMA])
+		self.assertEqual(bundles[1]['parent']['CitTitle'], "report 1")
+		self.assertEqual(bundles[9], {'parent': None, 'apns': [], 'counties': []})	# not in the ICDB
+
+	def test_report_chunks_are_padded(self):
+		mapbyparcel.load_report_bundles(self.session, [1, 2, 3, 4, 5], chunk_size=4)
+		params = [params for (sql, params) in self.session.queries if "from tblInventory WHERE" in sql]
+		self.assertEqual(params, [[1, 2, 3, 4], [5]])
+		self.assertEqual(mapbyparcel.in_list_params([1, 2, 3], 8), ("?,?,?,?", [1, 2, 3, 3]))
+		self.assertEqual(mapbyparcel.in_list_params([1, 2, 3, 4, 5], 6), ("?,?,?,?,?,?", [1, 2, 3, 4, 5, 5]))
+
+	def test_resources_grouped_by_county(self):
+		bundles = mapbyparcel.load_resource_bundles(self.session, [(SONOMA, 2), ("21", "1"), (SONOMA, 1), (SONOMA, 2), (SONOMA, 7)])
+		self.assertEqual(sorted(bundles), [(MARIN, 1), (SONOMA, 1), (SONOMA, 2), (SONOMA, 7)])
+		self.assertEqual(bundles[(SONOMA, 2)]['apns'], ["49-2"])
+		self.assertEqual(bundles[(MARIN, 1)]['counties'], [MARIN])
+		self.assertIsNone(bundles[(SONOMA, 7)]['parent'])
+		params = [params for (sql, params) in self.session.queries if "from tblResource WHERE" in sql]
+		self.assertEqual(params, [[MARIN, 1], [SONOMA, 1, 2, 7, 7]])	# one IN list per county, padded to 4
+
+class CanonicalAPNTest(unittest.TestCase):
+	def test_unchanged(self):
+		self.assertEqual(mapbyparcel.canonical_apn("123-456-789"), "123-456-789")
+
+	def test_trimmed_and_upper_case(self):
+		self.assertEqual(mapbyparcel.canonical_apn("  4123-005-a \t"), "4123-005-A")
+
+	def test_spaces_between_groups(self):
+		self.assertEqual(mapbyparcel.canonical_apn("123 456 789"), "123-456-789")
+		self.assertEqual(mapbyparcel.canonical_apn("123 - 456 -789"), "123-456-789")
+
+	def test_dash_look_alikes_and_runs(self):
+		self.assertEqual(mapbyparcel.canonical_apn(u"123\u2013456\u2212789"), "123-456-789")
+		self.assertEqual(mapbyparcel.canonical_apn("123--456-789"), "123-456-789")
+
+	def test_text_is_kept(self):
+		# not a close match: the text stays, and the APN then fits no county's pattern
+		self.assertEqual(mapbyparcel.canonical_apn("APN 123-456-78"), "APN-123-456-78")
+		self.assertIsNone(mapbyparcel.apn_validators[MARIN].match("APN-123-456-78"))
+
+class APNPatternTest(unittest.TestCase):
+	def test_every_county_has_a_pattern(self):
+		self.assertEqual(sorted(mapbyparcel.apn_validators), sorted(mapbyparcel.parcel_layers))
+
+	def test_colusa(self):
+		# (its pattern used to have "d{3}" for "\d{3}", and matched only a literal "ddd")
+		self.assertTrue(mapbyparcel.apn_validators[COLUSA].match("012-345-678"))
+		self.assertFalse(mapbyparcel.apn_validators[COLUSA].match("012-345-ddd"))
+
+	def test_contra_costa(self):
+		self.assertTrue(mapbyparcel.apn_validators[CONTRA_COSTA].match("012-345-678-000"))
+		self.assertFalse(mapbyparcel.apn_validators[CONTRA_COSTA].match("012-345-678"))
+		self.assertFalse(mapbyparcel.apn_validators[CONTRA_COSTA].match("012-345-ddd-000"))
+
+	def test_normalized_apns_fit(self):
+		bundle = {1: report_bundle(["012 345 678", "012-345-67", "012-345-678"], [SONOMA, MARIN])}
+		mapbyparcel.normalize_bundle_apns(bundle)
+		self.assertEqual(bundle[1]['apns'], ["012-345-678", "012-345-67"])
+		self.assertEqual(bundle[1]['apn_sources']["012-345-678"], "012 345 678")
+		self.assertEqual(bundle[1]['fits'], {"012-345-678": set([SONOMA]), "012-345-67": set([MARIN])})
+
+class PlanAPNSearchesTest(unittest.TestCase):
+	def test_one_county(self):
+		bundle = planned(report_bundle(["012-345-678", "012-345-67"], [SONOMA]))
+		self.assertEqual(bundle['searches'], set([(SONOMA, "012-345-678")]))
+		self.assertEqual(bundle['malformed'], set([(SONOMA, "012-345-67")]))
+
+	def test_search_malformed(self):
+		bundle = planned(report_bundle(["012-345-67"], [SONOMA]), search_malformed=True)
+		self.assertEqual(bundle['searches'], set([(SONOMA, "012-345-67")]))
+		self.assertEqual(bundle['malformed'], set([(SONOMA, "012-345-67")]))
+
+	def test_routed_to_the_counties_it_fits(self):
+		bundle = planned(report_bundle(["012-345-678", "012-345-67"], [SONOMA, MARIN]), route=True)
+		self.assertEqual(bundle['searches'], set([(SONOMA, "012-345-678"), (MARIN, "012-345-67")]))
+		self.assertEqual(bundle['malformed'], set())
+
+	def test_routed_but_fits_none(self):
+		bundle = planned(report_bundle(["12-34"], [SONOMA, MARIN]), route=True)
+		self.assertEqual(bundle['searches'], set())
+		self.assertEqual(bundle['malformed'], set([(SONOMA, "12-34"), (MARIN, "12-34")]))
+
+	def test_not_routed(self):
+		bundle = planned(report_bundle(["012-345-678"], [SONOMA, MARIN]))
+		self.assertEqual(bundle['searches'], set([(SONOMA, "012-345-678")]))
+		self.assertEqual(bundle['malformed'], set([(MARIN, "012-345-678")]))
+
+	def test_routed_by_an_indexed_source(self):
+		class IndexedSource(object):
+			def contains(self, county, apns, chunk_size=None):
+				return set(apn for apn in apns if (county, apn) == (SONOMA, "012-345-678"))
+		bundle = planned(report_bundle(["012-345-678", "012-345-67", "12-34"], [SONOMA, MARIN]), route=True, parcel_source=IndexedSource())
+		self.assertEqual(bundle['searches'], set([(SONOMA, "012-345-678")]))
+		self.assertEqual(bundle['malformed'], set([(SONOMA, "12-34"), (MARIN, "12-34")]))
+
+class SavedSelectionKeysTest(unittest.TestCase):
+	def keys(self, kind, rows):
+		return list(mapbyparcel.saved_selection_keys(kind, iter(rows), "sel.csv"))
+
+	def test_keys(self):
+		self.assertEqual(self.keys(mapbyparcel.sheet_saved_reports, [("", "12"), ("", 7.0), ("", "12"), ("", ""), ("", "3")]), [12, 7])
+		self.assertEqual(self.keys(mapbyparcel.sheet_saved_resources, [("49", "2"), (21, "1")]), [(49, 2), (21, 1)])
+
+	def test_bad_key_names_its_row(self):
+		with self.assertRaises(ValueError) as raised:
+			self.keys(mapbyparcel.sheet_saved_reports, [("", "12"), ("", " S-000123 ")])
+		self.assertEqual(str(raised.exception), "row 3 of sel.csv: 'S-000123' is not a number")
+
+class IterBundleBatchesTest(unittest.TestCase):
+	keys = list(range(1, 104))
+
+	def load_bundles(self, session, batch):
+		time.sleep(random.random() * 0.01)					# the workers finish out of order
+		return dict((key, {'thread': threading.current_thread().name}) for key in batch)
+
+	def batches(self, workers, prefetch=4):
+		return list(mapbyparcel.iter_bundle_batches(self.load_bundles, iter(self.keys), 10, workers, prefetch))
+
+	def test_serial(self):
+		batches = self.batches(0)
+		self.assertEqual([batch for (batch, bundles) in batches], list(mapbyparcel.chunked(self.keys, 10)))
+
+	def test_prefetch_keeps_the_order(self):
+		random.seed(1)
+		for workers in (1, 3):
+			batches = self.batches(workers, prefetch=2)
+			self.assertEqual([batch for (batch, bundles) in batches], list(mapbyparcel.chunked(self.keys, 10)))
+			for (batch, bundles) in batches:
+				self.assertEqual(sorted(bundles), batch)
+
+	def test_prefetch_closes_its_sessions(self):
+		self.batches(3)
+		time.sleep(0.1)										# (the workers close their sessions as they quit)
+		self.assertEqual(mapbyparcel.icdb_sessions, [])
+
+	def test_prefetch_error(self):
+		def load_bundles(session, batch):
+			if 55 in batch:
+				raise ValueError("lost the ICDB")
+			return dict((key, {}) for key in batch)
+		loaded = []
+		with self.assertRaises(ValueError):
+			for (batch, bundles) in mapbyparcel.iter_bundle_batches(load_bundles, iter(self.keys), 10, 2):
+				loaded.append(batch[0])
+		self.assertEqual(loaded, [1, 11, 21, 31, 41])
+
+	def test_keys_error(self):
+		def keys():
+			for key in self.keys:
+				if key == 25:
+					raise ValueError("S-000025 isn't a DocNo")
+				yield key
+		for workers in (0, 1, 3):
+			outcome = {}
+			def run():
+				loaded = []
+				try:
+					for (batch, bundles) in mapbyparcel.iter_bundle_batches(self.load_bundles, keys(), 10, workers):
+						loaded.append(batch[0])
+				except ValueError as e:
+					outcome['error'] = e
+				finally:
+					mapbyparcel.close_icdb_session()		# (the serial one's, of this thread)
+				outcome['loaded'] = loaded
+			thread = threading.Thread(target=run)
+			thread.daemon = True
+			thread.start()
+			thread.join(10)
+			self.assertFalse(thread.is_alive(), "hung with {0} workers".format(workers))
+			self.assertIn('error', outcome)
+			self.assertEqual(outcome['loaded'], [1, 11])
+
+class RunTimerTest(unittest.TestCase):
+	def setUp(self):
+		self.clock = [0.0]
+		self.timer_clock = mapbyparcel.timer_clock
+		mapbyparcel.timer_clock = lambda: self.clock[0]
+		self.run_timer = mapbyparcel.run_timer
+		mapbyparcel.run_timer = mapbyparcel.RunTimer()
+
+	def tearDown(self):
+		mapbyparcel.timer_clock = self.timer_clock
+		mapbyparcel.run_timer = self.run_timer
+
+	def tick(self, seconds):
+		self.clock[0] += seconds
+
+	def phases(self):
+		return dict((phase, (round(seconds, 6), calls)) for (phase, (seconds, calls)) in mapbyparcel.run_timer.phases.items())
+
+	def test_nested_phases_are_exclusive(self):
+		run_timer = mapbyparcel.run_timer
+		with run_timer.phase("outer"):
+			self.tick(1)
+			with run_timer.phase("inner"):
+				self.tick(2)
+				run_timer.add("query", 0.5)
+			self.tick(3)
+		self.assertEqual(self.phases(), {"outer": (4, 1), "inner": (1.5, 1), "query": (0.5, 1)})
+
+	def test_timed_iter(self):
+		def keys():
+			for key in (1, 2):
+				self.tick(1)
+				yield key
+			self.tick(0.25)
+		def batches():
+			for key in mapbyparcel.timed_iter(keys(), "read"):
+				self.tick(2)
+				yield [key]
+		for batch in mapbyparcel.timed_iter(batches(), "batches"):
+			self.tick(10)								# (the batch's own work, in no phase)
+		self.assertEqual(self.phases(), {"read": (2.25, 2), "batches": (4, 2)})
+
+	def test_phases_on_other_threads(self):
+		def query():
+			with mapbyparcel.run_timer.phase("query"):
+				self.tick(1)
+		with mapbyparcel.run_timer.phase("wait"):
+			thread = threading.Thread(target=query)
+			thread.start()
+			thread.join()
+		self.assertEqual(self.phases(), {"query": (1, 1), "wait": (1, 1)})
+
+class ShapeCacheTest(unittest.TestCase):
+	def test_trim_keeps_the_most_recently_used(self):
+		cache = mapbyparcel.ShapeCache(2)
+		for oid in (1, 2, 3):
+			cache[(SONOMA, oid)] = "shape {0}".format(oid)
+		self.assertEqual(len(cache), 3)						# (only trimmed between batches)
+		cache.get((SONOMA, 1))
+		cache.trim()
+		self.assertEqual(sorted(oid for (county, oid) in cache.shapes), [1, 3])
+
+	def test_shared_shape(self):
+		cache = mapbyparcel.ShapeCache(10)
+		first = mapbyparcel.cached_parcel(cache, SONOMA, 1, ["shape"])
+		again = mapbyparcel.cached_parcel(cache, SONOMA, 1, ["shape"])
+		self.assertIs(again[1], first[1])
+
+	def test_none_kept(self):
+		cache = mapbyparcel.ShapeCache(0)
+		cache.setdefault((SONOMA, 1), "shape")
+		cache.trim()
+		self.assertNotIn((SONOMA, 1), cache)
+
+class ICDBCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.cache = mapbyparcel.ICDBCache(os.path.join(self.folder, mapbyparcel.icdb_cache_name), 1, 10)
+		self.loaded = []
+
+	def tearDown(self):
+		self.cache.close()
+		shutil.rmtree(self.folder)
+
+	def load_bundles(self, session, keys):
+		self.loaded.extend(keys)
+		return dict((key, report_bundle([], [], voided=(key == 2)) if key != 3 else {'parent': None, 'apns': [], 'counties': []}) for key in keys)
+
+	def test_served_from_the_cache(self):
+		load = self.cache.loader("reports", self.load_bundles, None, mapbyparcel.report_record)
+		first = load(None, [1, 2])
+		self.assertEqual(load(None, [1, 2]), first)
+		self.assertEqual(self.loaded, [1, 2])
+		self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+	def test_records_not_in_the_icdb_are_not_cached(self):
+		load = self.cache.loader("reports", self.load_bundles, None, mapbyparcel.report_record)
+		load(None, [1, 3])
+		self.assertIsNone(load(None, [1, 3])[3]['parent'])
+		self.assertEqual(self.loaded, [1, 3, 3])
+
+class SavedSelectionFilesTest(unittest.TestCase):
+	def test_folder(self):
+		folder = tempfile.mkdtemp()
+		try:
+			for name in ("a.xlsx", "~$a.xlsx", "b.csv", "b_malformed_APN.csv", "batch_summary.csv", "notes.doc"):
+				open(os.path.join(folder, name), "w").close()
+			files = mapbyparcel.saved_selection_files(folder)
+			self.assertEqual([os.path.basename(name) for name in files], ["a.xlsx", "b.csv"])
+		finally:
+			shutil.rmtree(folder)
+
+# a GeoPackage geometry blob of a square parcel
+def parcel_blob(oid, srs_id=2226):
+	(x, y) = (6000000.0 + oid * 100.0, 1900000.0)
+	points = ((x, y), (x + 90.0, y), (x + 90.0, y + 90.0), (x, y + 90.0), (x, y))
+	wkb = struct.pack("<BIII", 1, 3, 1, len(points)) + b"".join(struct.pack("<dd", px, py) for (px, py) in points)
+	return b"GP\x00\x01" + struct.pack("<i", srs_id) + wkb
+
+class ResumeRunTest(unittest.TestCase):
+	reports = 35
+	batch_size = 10
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.options = dict(mapbyparcel.run_options)
+		self.icdb = (mapbyparcel.icdb_connect_factory, mapbyparcel.icdb_placeholder)
+		mapbyparcel.close_icdb_sessions()								# (a session left by another test logs in with its own factory)
+		icdb_path = os.path.join(self.folder, "icdb.sqlite")
+		icdb = sqlite3.connect(icdb_path)
+		icdb.executescript("""
+			CREATE TABLE tblInventory (DocNo INTEGER, CitTitle TEXT, Voided INTEGER);
+			CREATE TABLE tblInventoryAddr (DocNo INTEGER, APN TEXT);
+			CREATE TABLE tblInventoryCnty (DocNo INTEGER, CountyName TEXT);
+		""")
+		for doc_no in range(1, self.reports + 1):
+			icdb.execute("INSERT INTO tblInventory VALUES (?,?,?)", (doc_no, "report {0}".format(doc_no), int(doc_no % 9 == 0)))
+			icdb.execute("INSERT INTO tblInventoryCnty VALUES (?,'Sonoma')", (doc_no,))
+			if doc_no % 7 != 0:
+				icdb.execute("INSERT INTO tblInventoryAddr VALUES (?,?)", (doc_no, "012-345-{0:03d}".format(doc_no % 12)))
+			if doc_no % 5 == 0:
+				icdb.execute("INSERT INTO tblInventoryAddr VALUES (?,?)", (doc_no, "12-34"))		# malformed
+		icdb.commit()
+		icdb.close()
+		parcels_path = os.path.join(self.folder, "parcels.gpkg")
+		parcels = sqlite3.connect(parcels_path)
+		parcels.executescript("""
+			CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+			CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', last_change DATETIME, min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER);
+			CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name));
+		""")
+		parcels.execute("INSERT INTO gpkg_spatial_ref_sys VALUES ('NAD83 / California zone 2 (ftUS)', 2226, 'EPSG', 2226, 'undefined', NULL)")
+		table = mapbyparcel.parcel_layers[SONOMA].split("\\")[-1]
+		parcels.execute("CREATE TABLE \"{0}\" (OBJECTID INTEGER PRIMARY KEY, Shape BLOB, APN TEXT)".format(table))
+		parcels.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, 'features', ?, 2226)", (table, table))
+		parcels.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'Shape', 'POLYGON', 2226, 0, 0)", (table,))
+		for oid in range(1, 13):										# APN 012-345-000 has no parcel, 012-345-001 two
+			apn = "012-345-{0:03d}".format(oid if oid < 12 else 1)
+			parcels.execute("INSERT INTO \"{0}\" VALUES (?,?,?)".format(table), (oid, sqlite3.Binary(parcel_blob(oid)), apn))
+		parcels.commit()
+		parcels.close()
+		mapbyparcel.icdb_connect_factory = lambda: sqlite3.connect(icdb_path, check_same_thread=False)
+		mapbyparcel.icdb_placeholder = "?"
+		mapbyparcel.run_options.update({
+			"parcel_source"		: parcels_path,
+			"output_format"		: "gpkg",
+			"record_batch_size"	: self.batch_size,
+			"journal_runs"		: True,
+			"icdb_cache_hours"	: 0,
+			"run_report"		: False,
+			"log_file"			: False,
+			"progress_seconds"	: 0
+		})
+
+	def tearDown(self):
+		mapbyparcel.close_icdb_sessions()
+		(mapbyparcel.icdb_connect_factory, mapbyparcel.icdb_placeholder) = self.icdb
+		mapbyparcel.run_options.clear()
+		mapbyparcel.run_options.update(self.options)
+		shutil.rmtree(self.folder)
+
+	def saved_selection(self, name):
+		folder = os.path.join(self.folder, name)
+		os.makedirs(folder)
+		file_name = os.path.join(folder, "sel.csv")
+		with open(file_name, "w") as csv_file:
+			csv_file.write("DocCo,DocNo\n" + "".join(",{0}\n".format(doc_no) for doc_no in range(1, self.reports + 1)))
+		return file_name
+
+	def map(self, file_name):
+		(kind, keys) = mapbyparcel.read_saved_selection(file_name)
+		return mapbyparcel.map_reports(file_name, keys)
+
+	def output_rows(self, feature_class):
+		(gpkg_path, table) = mapbyparcel.gpkg_output_table(feature_class)
+		db = sqlite3.connect(gpkg_path)
+		try:
+			columns = [row[1] for row in db.execute("PRAGMA table_info({0})".format(table))][1:]		# (not the fid)
+			return sorted(tuple(row) for row in db.execute("SELECT {0} FROM {1}".format(", ".join(columns), table)))
+		finally:
+			db.close()
+
+	def malformed_report(self, file_name):
+		with open(os.path.splitext(file_name)[0] + "_malformed_APN.csv") as report:
+			return report.read()
+
+	def test_resumed_run_matches_an_uninterrupted_one(self):
+		whole_file = self.saved_selection("whole")
+		whole = self.map(whole_file)
+
+		resumed_file = self.saved_selection("resumed")
+		insert = mapbyparcel.GeoPackageOutputWriter.insert
+		def failing_insert(writer, values, parcel=None):
+			if values['DocNo'] > self.batch_size + 2:						# part way through the second batch
+				raise RuntimeError("ArcMap crashed")
+			insert(writer, values, parcel)
+		mapbyparcel.GeoPackageOutputWriter.insert = failing_insert
+		try:
+			with self.assertRaises(RuntimeError):
+				self.map(resumed_file)
+		finally:
+			mapbyparcel.GeoPackageOutputWriter.insert = insert
+		journal = mapbyparcel.open_run_journal(resumed_file)
+		try:
+			(feature_class, options) = journal.db.execute("SELECT feature_class, options FROM runs").fetchone()
+			self.assertEqual(options, mapbyparcel.output_options(gpkg=True))
+			(gpkg_path, table) = mapbyparcel.gpkg_output_table(feature_class)
+			output = sqlite3.connect(gpkg_path)
+			self.assertTrue(output.execute("SELECT count(*) FROM {0} WHERE DocNo > ?".format(table), (self.batch_size,)).fetchone()[0])		# (committed, not journaled)
+			output.close()
+			self.assertEqual(journal.done_records(), set(mapbyparcel.report_record(doc_no) for doc_no in range(1, self.batch_size + 1)))
+			self.assertIsNotNone(journal.unfinished_output(mapbyparcel.sheet_saved_reports, mapbyparcel.output_options(gpkg=True)))
+			self.assertIsNone(journal.unfinished_output(mapbyparcel.sheet_saved_reports, mapbyparcel.output_options()))
+		finally:
+			journal.close()
+		resumed = self.map(resumed_file)
+
+		self.assertEqual(self.output_rows(resumed['output']), self.output_rows(whole['output']))
+		self.assertEqual(os.path.basename(resumed.pop('output')), os.path.basename(whole.pop('output')))
+		self.assertEqual(resumed, whole)
+		self.assertGreater(whole['malformed'], 0)
+		self.assertEqual(self.malformed_report(resumed_file), self.malformed_report(whole_file))
+
+if __name__ == "__main__":
+	unittest.main()